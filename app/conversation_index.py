@@ -0,0 +1,233 @@
+"""
+Full-text search over stored conversations.
+
+An inverted index of the patient's turns and the summary of every conversation in
+the conversation store, kept in the same SQLite database and updated in the same
+transaction as each conversation is recorded. Text is tokenised and negation is
+read with the guardrail helpers, so a term counts as present only where the triage
+rules would count it: "no true locking" does not match "true locking" unless
+include_negated is set.
+
+Queries support bare terms, "quoted phrases", prefixes (pivot*), AND (also
+implied between terms), OR, NOT and parentheses, e.g.
+
+    "true locking" AND (pivot* OR twist*) NOT summary:"no locking"
+
+A field prefix (patient: or summary:) limits a term or phrase to one field.
+"""
+
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .triage_guardrails import tokenize, negated_positions
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS term_postings (
+    term TEXT NOT NULL,
+    field TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    positions TEXT NOT NULL,
+    negated TEXT NOT NULL,
+    PRIMARY KEY (term, field, conversation_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS indexed_conversations (
+    conversation_id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+FIELDS = ("patient", "summary")
+QUERY_TOKEN = re.compile(r'\s*(?:(\()|(\))|(?:(\w+):)?"([^"]*)"|(\S+?)(?=\s|\)|$))')
+
+
+class QueryError(ValueError):
+    """Raised for a search query that cannot be parsed."""
+
+
+# --- Indexing ---
+def field_positions(texts: Iterable[str]) -> Dict[str, Tuple[List[int], List[int]]]:
+    """Affirmed and negated positions of each token; a gap between texts stops phrases spanning turns."""
+    postings: Dict[str, Tuple[List[int], List[int]]] = {}
+    offset = 0
+    for text in texts:
+        tokens = tokenize(text)
+        negated = negated_positions(tokens)
+        for i, token in enumerate(tokens):
+            affirmed, denied = postings.setdefault(token, ([], []))
+            (denied if i in negated else affirmed).append(offset + i)
+        offset += len(tokens) + 1
+    return postings
+
+
+def _positions(text: str) -> List[int]:
+    return [int(p) for p in text.split()] if text else []
+
+
+class ConversationIndex:
+    """Inverted index tables in a conversation store's database."""
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.db.executescript(INDEX_SCHEMA)
+
+    def add(self, conversation_id: str, patient_turns: List[str], summary: Optional[str]):
+        """Index one conversation; call inside the transaction that stores it."""
+        rows = []
+        for field, texts in (("patient", patient_turns), ("summary", [summary] if summary else [])):
+            for term, (affirmed, denied) in field_positions(texts).items():
+                rows.append((term, field, conversation_id, " ".join(map(str, affirmed)), " ".join(map(str, denied))))
+        self.db.executemany("INSERT OR REPLACE INTO term_postings VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.execute("INSERT OR IGNORE INTO indexed_conversations VALUES (?)", (conversation_id,))
+
+    def index_missing(self) -> int:
+        """Index conversations stored before the index existed; returns how many were added."""
+        missing = self.db.execute("SELECT id, summary FROM conversations WHERE id NOT IN "
+                                  "(SELECT conversation_id FROM indexed_conversations)").fetchall()
+        with self.db:
+            for conversation_id, summary in missing:
+                turns = [row[0] for row in self.db.execute(
+                    "SELECT content FROM messages WHERE conversation_id = ? AND role = 'user' ORDER BY seq",
+                    (conversation_id,))]
+                self.add(conversation_id, turns, summary)
+        return len(missing)
+
+    # --- Lookup ---
+    def _postings(self, term: str, fields: Tuple[str, ...]):
+        """(conversation, field) -> (affirmed, negated) positions for a token, or a prefix ending in '*'."""
+        marks = ", ".join("?" for _ in fields)
+        if term.endswith("*"):
+            prefix = term[:-1]
+            rows = self.db.execute(f"SELECT conversation_id, field, positions, negated FROM term_postings "
+                                   f"WHERE term >= ? AND term < ? AND field IN ({marks})",
+                                   (prefix, prefix + "\uffff", *fields))
+        else:
+            rows = self.db.execute(f"SELECT conversation_id, field, positions, negated FROM term_postings "
+                                   f"WHERE term = ? AND field IN ({marks})", (term, *fields))
+        postings: Dict[Tuple[str, str], Tuple[Set[int], Set[int]]] = {}
+        for conversation_id, field, positions, negated in rows:
+            affirmed, denied = postings.setdefault((conversation_id, field), (set(), set()))
+            affirmed.update(_positions(positions))
+            denied.update(_positions(negated))
+        return postings
+
+    def match_phrase(self, words: List[str], fields: Tuple[str, ...], include_negated: bool = False) -> Set[str]:
+        """
+        Conversations where the words appear in order. As in the triage rules, a phrase
+        negated anywhere in a conversation ("no true locking") does not count as present
+        there, unless include_negated is set.
+        """
+        # (conversation, field) -> {start position: negated}
+        matched: Dict[Tuple[str, str], Dict[int, bool]] = {}
+        for offset, word in enumerate(words):
+            current = {}
+            for key, (affirmed, denied) in self._postings(word, fields).items():
+                if offset == 0:
+                    starts = {position: False for position in affirmed}
+                    starts.update({position: True for position in denied})
+                elif key in matched:
+                    anywhere = affirmed | denied
+                    starts = {start: negated for start, negated in matched[key].items() if start + offset in anywhere}
+                else:
+                    continue
+                if starts:
+                    current[key] = starts
+            matched = current
+            if not matched:
+                break
+
+        found, negated = set(), set()
+        for (conversation_id, _), starts in matched.items():
+            found.add(conversation_id)
+            if any(starts.values()):
+                negated.add(conversation_id)
+        return found if include_negated else found - negated
+
+    def all_conversations(self) -> Set[str]:
+        return {row[0] for row in self.db.execute("SELECT conversation_id FROM indexed_conversations")}
+
+    # --- Queries ---
+    def search(self, query: str, include_negated: bool = False) -> Set[str]:
+        """Ids of the conversations matching a query (see the module docstring for the syntax)."""
+        parser = _QueryParser(self, query, include_negated)
+        return parser.parse()
+
+
+class _QueryParser:
+    """Recursive descent over OR > AND > NOT > (group | phrase | term), evaluating as it goes."""
+    def __init__(self, index: ConversationIndex, query: str, include_negated: bool):
+        self.index = index
+        self.include_negated = include_negated
+        self.tokens = []
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = QUERY_TOKEN.match(query, position)
+            if not match or match.end() == position:
+                raise QueryError(f"Cannot parse query at: {query[position:]}")
+            self.tokens.append(match.groups())
+            position = match.end()
+            while position < len(query) and query[position].isspace():
+                position += 1
+        self.next = 0
+
+    def parse(self) -> Set[str]:
+        if not self.tokens:
+            raise QueryError("Empty query")
+        result = self._or()
+        if self.next < len(self.tokens):
+            raise QueryError("Unbalanced ')' in query")
+        return result
+
+    def _peek(self):
+        return self.tokens[self.next] if self.next < len(self.tokens) else None
+
+    def _operator(self, name: str) -> bool:
+        token = self._peek()
+        if token and token[4] == name:
+            self.next += 1
+            return True
+        return False
+
+    def _or(self) -> Set[str]:
+        result = self._and()
+        while self._operator("OR"):
+            result = result | self._and()
+        return result
+
+    def _and(self) -> Set[str]:
+        result = self._not()
+        while self._peek() and not self._peek()[1] and self._peek()[4] != "OR":
+            self._operator("AND")
+            result = result & self._not()
+        return result
+
+    def _not(self) -> Set[str]:
+        if self._operator("NOT"):
+            return self.index.all_conversations() - self._not()
+        return self._primary()
+
+    def _primary(self) -> Set[str]:
+        token = self._peek()
+        if token is None:
+            raise QueryError("Query ends where a term was expected")
+        self.next += 1
+        group_open, group_close, field, phrase, word = token
+        if group_open:
+            result = self._or()
+            if not self._peek() or not self._peek()[1]:
+                raise QueryError("Missing ')' in query")
+            self.next += 1
+            return result
+        if group_close or word in ("AND", "OR", "NOT"):
+            raise QueryError(f"Unexpected {group_close or word} in query")
+        if phrase is None:
+            field, _, word = word.rpartition(":") if ":" in word else (None, None, word)
+            phrase = word
+        if field and field not in FIELDS:
+            raise QueryError(f"Unknown field {field}: (expected one of {', '.join(FIELDS)})")
+        prefix = phrase.endswith("*")
+        words = tokenize(phrase)
+        if not words:
+            raise QueryError(f"No searchable words in {phrase!r}")
+        if prefix:
+            words[-1] += "*"
+        return self.index.match_phrase(words, (field,) if field else FIELDS, self.include_negated)
@@ -0,0 +1,271 @@
+"""
+Structured store of completed triage conversations.
+
+Each conversation is recorded once, in SQLite: the messages with their timings,
+the extracted patient data, questionnaire engine output, guardrail scores, the
+summary and classification, and the referral letters. The expected triage from
+the case is normalised to a referral type so conversations that were routed
+differently from what the case expected can be found through an index instead of
+re-parsing log files.
+
+The patient's turns and the summary are also indexed for full-text search (see
+conversation_index). The database is CONVERSATION_STORE (default conversations.db).
+"""
+
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .conversation_index import ConversationIndex
+from .questionnaire_engine import run_questionnaire_engine
+from .questionnaire_specs import get_questionnaire_form
+from .triage_agent import TriageAgent, select_questionnaire
+from .triage_guardrails import score_triage_guardrails, PATHWAY_REFERRAL_TYPES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    case_id TEXT,
+    title TEXT,
+    started_at TEXT NOT NULL,
+    source TEXT,
+    expected_triage TEXT,
+    expected_referral_type TEXT,
+    pathway TEXT,
+    referral_type TEXT,
+    mismatch INTEGER NOT NULL DEFAULT 0,
+    questionnaire TEXT,
+    degraded INTEGER NOT NULL DEFAULT 0,
+    summary TEXT,
+    classification TEXT,
+    extracted_data TEXT,
+    engine_output TEXT,
+    guardrails TEXT,
+    referral_letters TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL REFERENCES conversations(id),
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    at TEXT,
+    seconds REAL,
+    PRIMARY KEY (conversation_id, seq)
+);
+CREATE INDEX IF NOT EXISTS conversations_case ON conversations (case_id, started_at);
+CREATE INDEX IF NOT EXISTS conversations_started ON conversations (started_at);
+CREATE INDEX IF NOT EXISTS conversations_pathway ON conversations (pathway, started_at);
+CREATE INDEX IF NOT EXISTS conversations_mismatch ON conversations (started_at) WHERE mismatch = 1;
+CREATE UNIQUE INDEX IF NOT EXISTS conversations_source ON conversations (source) WHERE source IS NOT NULL;
+"""
+
+# JSON columns, decoded when a conversation is read back
+JSON_COLUMNS = ["classification", "extracted_data", "engine_output", "guardrails", "referral_letters", "metadata"]
+
+
+def expected_referral_type(expected_triage: Optional[str]) -> Optional[str]:
+    """Referral type a case's free-text expected triage (e.g. "SWLEOC Orthopaedic Surgery") points to."""
+    text = (expected_triage or "").lower()
+    if any(term in text for term in ["urgent", "emergency", "a&e", "same-day", "same day"]):
+        return "urgent_ed"
+    if any(term in text for term in ["swleoc", "orthopaedic", "orthopedic", "surgery", "surgical",
+                                     "arthroplasty", "soft tissue"]):
+        return "swleoc"
+    if "physio" in text:
+        return "physio"
+    if any(term in text for term in ["gp", "primary care", "general practice"]):
+        return "gp"
+    return None
+
+
+def analyse_conversation(messages: List[Dict]) -> Dict[str, Any]:
+    """Extracted data, questionnaire engine output and guardrail scores for a transcript."""
+    patient_data = TriageAgent()._extract_patient_data(messages)
+    user_messages = [msg["content"] for msg in messages if msg["role"] == "user"]
+    questionnaire = select_questionnaire(user_messages[0] if user_messages else "")
+    form = get_questionnaire_form(questionnaire)
+    try:
+        engine = run_questionnaire_engine(form["spec"], patient_data) if form else {"error": "Questionnaire form not found"}
+    except Exception as e:
+        engine = {"error": f"Questionnaire analysis failed: {str(e)}"}
+    guardrails = score_triage_guardrails(patient_data, " ".join(user_messages))
+    return {"questionnaire": questionnaire, "extracted_data": patient_data, "engine_output": engine,
+            "guardrails": guardrails}
+
+
+class ConversationStore:
+    """Append-only SQLite store of conversations; a conversation is written once and never updated."""
+    def __init__(self, path: str = "conversations.db"):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.index = ConversationIndex(self.db)
+        # Conversations stored before the index existed are indexed on first open
+        self.index.index_missing()
+
+    def record_conversation(self, messages: List[Dict], case_id: Optional[str] = None, title: Optional[str] = None,
+                            expected_triage: Optional[str] = None, started_at: Optional[str] = None,
+                            summary: Optional[str] = None, classification: Optional[Dict] = None,
+                            referral_letters: Optional[Dict[str, str]] = None, degraded: bool = False,
+                            source: Optional[str] = None, metadata: Optional[Dict] = None,
+                            analysis: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Store a finished conversation and return its id. Messages may carry an "at"
+        timestamp (ISO format); each message's seconds are the time since the one before.
+        """
+        analysis = analysis or analyse_conversation(messages)
+        pathway = analysis["guardrails"]["pathway"]
+        # The validated classification decides the referral when there is one, as in the summary
+        referral_type = (classification or {}).get("referral_type") or PATHWAY_REFERRAL_TYPES[pathway]
+        expected = expected_referral_type(expected_triage)
+        conversation_id = str(uuid.uuid4())
+        started_at = started_at or next((msg["at"] for msg in messages if msg.get("at")), None) \
+            or datetime.now().isoformat(timespec="seconds")
+
+        rows, previous = [], None
+        for seq, msg in enumerate(messages):
+            at = msg.get("at")
+            seconds = None
+            if at and previous:
+                seconds = (datetime.fromisoformat(at) - datetime.fromisoformat(previous)).total_seconds()
+            previous = at or previous
+            rows.append((conversation_id, seq, msg["role"], msg["content"], at, seconds))
+
+        def dump(value):
+            return json.dumps(value, default=str) if value is not None else None
+
+        with self.db:
+            self.db.execute(
+                "INSERT INTO conversations (id, case_id, title, started_at, source, expected_triage, "
+                "expected_referral_type, pathway, referral_type, mismatch, questionnaire, degraded, summary, "
+                "classification, extracted_data, engine_output, guardrails, referral_letters, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (conversation_id, case_id, title, started_at, source, expected_triage, expected, pathway,
+                 referral_type, int(expected is not None and expected != referral_type), analysis["questionnaire"],
+                 int(degraded), summary, dump(classification), dump(analysis["extracted_data"]),
+                 dump(analysis["engine_output"]), dump(analysis["guardrails"]), dump(referral_letters),
+                 dump(metadata)))
+            self.db.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.index.add(conversation_id, [msg["content"] for msg in messages if msg["role"] == "user"], summary)
+        return conversation_id
+
+    def has_source(self, source: str) -> bool:
+        return self.db.execute("SELECT 1 FROM conversations WHERE source = ?", (source,)).fetchone() is not None
+
+    # --- Queries ---
+    def _row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        for column in JSON_COLUMNS:
+            if record.get(column) is not None:
+                record[column] = json.loads(record[column])
+        record["mismatch"] = bool(record["mismatch"])
+        record["degraded"] = bool(record["degraded"])
+        return record
+
+    def get(self, conversation_id: str, with_messages: bool = True) -> Optional[Dict[str, Any]]:
+        row = self.db.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        record = self._row(row)
+        if with_messages:
+            record["messages"] = self.messages(conversation_id)
+        return record
+
+    def messages(self, conversation_id: str) -> List[Dict[str, Any]]:
+        rows = self.db.execute("SELECT role, content, at, seconds FROM messages WHERE conversation_id = ? "
+                               "ORDER BY seq", (conversation_id,))
+        return [dict(row) for row in rows]
+
+    def recorded_after(self, rowid: int = 0) -> List[Tuple[int, str, Optional[str]]]:
+        """(rowid, id, summary) of the conversations recorded after rowid, oldest first; the store is append-only."""
+        rows = self.db.execute("SELECT rowid, id, summary FROM conversations WHERE rowid > ? ORDER BY rowid", (rowid,))
+        return [tuple(row) for row in rows]
+
+    def _where(self, case_id: Optional[str], since: Optional[str], until: Optional[str],
+               pathway: Optional[str], mismatched: Optional[bool]):
+        clauses, params = [], []
+        if case_id is not None:
+            clauses.append("case_id = ?")
+            params.append(case_id)
+        if since is not None:
+            clauses.append("started_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("started_at < ?")
+            params.append(until)
+        if pathway is not None:
+            clauses.append("pathway = ?")
+            params.append(pathway)
+        if mismatched is not None:
+            # Spelled like the partial index condition so SQLite can use it
+            clauses.append("mismatch = 1" if mismatched else "mismatch = 0")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def find(self, case_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+             pathway: Optional[str] = None, mismatched: Optional[bool] = None,
+             limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Conversations matching every given filter, newest first, without their messages.
+        since/until are ISO dates or timestamps (until is exclusive).
+        """
+        where, params = self._where(case_id, since, until, pathway, mismatched)
+        sql = f"SELECT * FROM conversations{where} ORDER BY started_at DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._row(row) for row in self.db.execute(sql, params)]
+
+    def search(self, query: str, include_negated: bool = False, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Conversations matching a full-text query (see conversation_index), newest first, without messages."""
+        ids = list(self.index.search(query, include_negated))
+        if not ids:
+            return []
+        marks = ", ".join("?" for _ in ids)
+        sql = f"SELECT * FROM conversations WHERE id IN ({marks}) ORDER BY started_at DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            ids.append(limit)
+        return [self._row(row) for row in self.db.execute(sql, ids)]
+
+    def query_plan(self, **filters) -> str:
+        """SQLite's plan for find(**filters), to check a query is served by an index."""
+        where, params = self._where(filters.get("case_id"), filters.get("since"), filters.get("until"),
+                                    filters.get("pathway"), filters.get("mismatched"))
+        rows = self.db.execute(f"EXPLAIN QUERY PLAN SELECT * FROM conversations{where} ORDER BY started_at DESC",
+                               params)
+        return "\n".join(row["detail"] for row in rows)
+
+    def stats(self) -> Dict[str, Any]:
+        conversations, mismatched = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(mismatch), 0) FROM conversations").fetchone()
+        messages = self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {"path": self.path, "conversations": conversations, "messages": messages, "mismatched": mismatched}
+
+    def close(self):
+        self.db.close()
+
+
+# --- Shared Store ---
+_conversation_store: Optional[ConversationStore] = None
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the process-wide store, opening CONVERSATION_STORE on first use."""
+    global _conversation_store
+    if _conversation_store is None:
+        _conversation_store = ConversationStore(os.environ.get("CONVERSATION_STORE", "conversations.db"))
+    return _conversation_store
+
+
+def configure_conversation_store(path: str) -> ConversationStore:
+    """Replace the process-wide store (used by tests and scripts)."""
+    global _conversation_store
+    _conversation_store = ConversationStore(path)
+    return _conversation_store
@@ -0,0 +1,157 @@
+"""
+Per-stage model and generation settings.
+
+Each LLM stage (SBAR, differential, classification, each referral letter type and
+the simulator's patient turns) has its own profile: model, num_ctx, num_predict,
+temperature, keep_alive and, for stages that read the conversation, the token budget
+for the compacted transcript. A profile without a model uses the model the agent was
+created with.
+
+GENERATION_PROFILE picks a preset ("default" or "fast", which moves the short
+stages to a smaller model). GENERATION_PROFILES_FILE can point at a JSON file of
+per-stage overrides, e.g. {"triage classification": {"model": "llama3.2:3b"}}.
+
+Ollama reloads a model whenever num_ctx changes, so every stage on the same model
+shares one num_ctx (the largest asked for); stages differ only in output length,
+temperature and keep_alive.
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+# --- Stages ---
+SBAR_STAGE = "SBAR summary"
+ROLLING_SBAR_STAGE = "rolling SBAR summary"
+DIFFERENTIAL_STAGE = "differential diagnosis"
+CLASSIFICATION_STAGE = "triage classification"
+PATIENT_TURN_STAGE = "patient turn"
+REFERRAL_LETTER_TYPES = ["swleoc", "physio", "gp"]
+
+
+def referral_letter_stage(referral_type: str) -> str:
+    return f"{referral_type} referral letter"
+
+
+# --- Presets ---
+# One context size for every stage, so moving between stages never reloads the model
+NUM_CTX = 4096
+# Transcript budgets leave room in num_ctx for the prompt template and the output
+LONG_FORM = {"num_ctx": NUM_CTX, "num_predict": 700, "temperature": 0.2, "keep_alive": "30m",
+             "transcript_tokens": 2000}
+LETTER = {"num_ctx": NUM_CTX, "num_predict": 900, "temperature": 0.3, "keep_alive": "30m",
+          "transcript_tokens": 700}
+
+PROFILE_PRESETS: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "default": {
+        SBAR_STAGE: LONG_FORM,
+        ROLLING_SBAR_STAGE: LONG_FORM,
+        # The JSON stages are schema-constrained, so their output can be capped tightly
+        DIFFERENTIAL_STAGE: {"num_ctx": NUM_CTX, "num_predict": 320, "temperature": 0.1, "keep_alive": "30m"},
+        CLASSIFICATION_STAGE: {"num_ctx": NUM_CTX, "num_predict": 160, "temperature": 0.0, "keep_alive": "30m"},
+        **{referral_letter_stage(t): LETTER for t in REFERRAL_LETTER_TYPES},
+        PATIENT_TURN_STAGE: {"num_ctx": NUM_CTX, "num_predict": 100, "temperature": 0.7, "top_p": 0.9,
+                             "keep_alive": "30m"},
+    },
+    # Short outputs on a smaller model; long-form stages stay on the agent's model
+    "fast": {
+        CLASSIFICATION_STAGE: {"model": "llama3.2:3b"},
+        DIFFERENTIAL_STAGE: {"model": "llama3.2:3b"},
+        PATIENT_TURN_STAGE: {"model": "llama3.2:3b"},
+    },
+}
+
+
+class GenerationProfile:
+    """Model and Ollama options for one stage."""
+    def __init__(self, stage: str, model: Optional[str] = None, num_ctx: Optional[int] = None,
+                 num_predict: Optional[int] = None, temperature: Optional[float] = None,
+                 top_p: Optional[float] = None, keep_alive: Optional[str] = None,
+                 transcript_tokens: Optional[int] = None):
+        self.stage = stage
+        self.model = model
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.temperature = temperature
+        self.top_p = top_p
+        self.keep_alive = keep_alive
+        self.transcript_tokens = transcript_tokens  # None: the transcript is not cut to a budget
+
+    def model_for(self, default_model: str) -> str:
+        return self.model or default_model
+
+    def options(self) -> Dict[str, Any]:
+        """The Ollama "options" object; unset fields keep the server defaults."""
+        options = {
+            "num_ctx": self.num_ctx,
+            "num_predict": self.num_predict,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+        }
+        return {key: value for key, value in options.items() if value is not None}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"stage": self.stage, "model": self.model, "keep_alive": self.keep_alive,
+                "transcript_tokens": self.transcript_tokens, **self.options()}
+
+
+def load_profiles(preset: str = "default", overrides: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, GenerationProfile]:
+    """Build the stage profiles from the default preset, a named preset and explicit overrides."""
+    if preset not in PROFILE_PRESETS:
+        raise ValueError(f"Unknown generation profile preset: {preset}")
+    settings: Dict[str, Dict[str, Any]] = {stage: dict(values) for stage, values in PROFILE_PRESETS["default"].items()}
+    for layer in (PROFILE_PRESETS[preset], overrides or {}):
+        for stage, values in layer.items():
+            settings.setdefault(stage, {}).update(values)
+    profiles = {stage: GenerationProfile(stage, **values) for stage, values in settings.items()}
+    
+    # An override that changes num_ctx on one stage applies to every stage on that model
+    # (stages without a model share the agent's model)
+    num_ctx: Dict[Optional[str], int] = {}
+    for profile in profiles.values():
+        if profile.num_ctx:
+            num_ctx[profile.model] = max(num_ctx.get(profile.model, 0), profile.num_ctx)
+    for profile in profiles.values():
+        if profile.model in num_ctx:
+            profile.num_ctx = num_ctx[profile.model]
+    return profiles
+
+
+# --- Shared Profiles ---
+_profiles: Optional[Dict[str, GenerationProfile]] = None
+
+
+def get_generation_profile(stage: str) -> GenerationProfile:
+    """Return the profile for stage, loading GENERATION_PROFILE(S_FILE) on first use."""
+    global _profiles
+    if _profiles is None:
+        overrides = None
+        path = os.environ.get("GENERATION_PROFILES_FILE")
+        if path:
+            with open(path, "r") as f:
+                overrides = json.load(f)
+        _profiles = load_profiles(os.environ.get("GENERATION_PROFILE", "default"), overrides)
+    return _profiles.get(stage) or GenerationProfile(stage)
+
+
+def served_models(default_model: str) -> List[str]:
+    """Models the backend's own stages use (patient turns belong to the simulator)."""
+    get_generation_profile(SBAR_STAGE)
+    return sorted({profile.model_for(default_model) for stage, profile in _profiles.items()
+                   if stage != PATIENT_TURN_STAGE})
+
+
+def model_load_options(default_model: str) -> Dict[str, Dict[str, Any]]:
+    """The Ollama options each served model is loaded with, so a warm-up loads it the way the stages use it."""
+    get_generation_profile(SBAR_STAGE)
+    return {profile.model_for(default_model): {"num_ctx": profile.num_ctx}
+            for stage, profile in _profiles.items()
+            if stage != PATIENT_TURN_STAGE and profile.num_ctx}
+
+
+def configure_generation_profiles(preset: str = "default",
+                                  overrides: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, GenerationProfile]:
+    """Replace the process-wide profiles (used by tests and the benchmark)."""
+    global _profiles
+    _profiles = load_profiles(preset, overrides)
+    return _profiles
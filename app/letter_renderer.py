@@ -0,0 +1,295 @@
+"""
+Templated referral letters.
+
+Most of a referral letter is either fixed (salutation, safety net, closing) or
+already known from the interview (patient details, the patient's own account of
+their treatment, imaging and red flag answers). Those sections are filled in here
+from the transcript and the triage classification; the LLM is only asked for the
+clinical reasoning sections listed in LETTER_LAYOUTS, which it returns under
+"**Heading:**" lines.
+"""
+
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from .triage_agent import TriageState
+from .triage_guardrails import apply_triage_guardrails
+from .transcript_compaction import answers_by_state
+from .triage_schemas import TriageClassification
+
+BODY_PARTS = ["knee", "hip", "shoulder", "back", "neck", "ankle", "foot", "wrist", "elbow", "hand"]
+
+# --- Letter Layouts ---
+# Sections in letter order. "llm" sections carry the guidance the model is given;
+# every other section is rendered by the function of the same name below.
+LETTER_LAYOUTS: Dict[str, Dict[str, Any]] = {
+    "swleoc": {
+        "recipient": "SWLEOC (South West London Elective Orthopaedic Centre)",
+        "salutation": "Dear Colleague,",
+        "purpose": "orthopaedic assessment and management",
+        "sections": [
+            ("Patient Details", "patient_details"),
+            ("Presenting Complaint", "presenting_complaint"),
+            ("History of Presenting Complaint", {"llm": "Onset, progression, pain characteristics and associated "
+                                                        "symptoms (instability, locking, swelling), then the functional "
+                                                        "impact with quantified metrics (walking distance, stairs, work, "
+                                                        "night pain, falls)."}),
+            ("Past Medical History", "past_medical_history"),
+            ("Treatment to Date", "treatment_to_date"),
+            ("Investigations", "investigations"),
+            ("Assessment", {"llm": "The most likely diagnosis with confidence, secondary considerations, and the red "
+                                   "flag conditions considered and excluded."}),
+            ("Clinical Reasoning", {"llm": "Why orthopaedic review is needed: evidence that conservative management "
+                                           "has failed, the functional impact, and surgical options that may apply."}),
+            ("Urgency", "urgency"),
+            ("Specific Request", "specific_request"),
+            ("Safety Net", "safety_net"),
+        ],
+    },
+    "physio": {
+        "recipient": "MSK Physiotherapy",
+        "salutation": "Dear Physiotherapy Team,",
+        "purpose": "physiotherapy assessment and management",
+        "sections": [
+            ("Patient Details", "patient_details"),
+            ("Presenting Complaint", "presenting_complaint"),
+            ("Pain Assessment", {"llm": "Location and type of pain, severity (0-10), aggravating and relieving "
+                                        "factors, and the pain pattern."}),
+            ("Functional Impact", {"llm": "Walking, stairs, work, activities of daily living, sport and sleep."}),
+            ("Treatment History", "treatment_to_date"),
+            ("Goals for Physiotherapy", {"llm": "Main functional goals, pain targets and return to activity goals."}),
+            ("Treatment Recommendations", {"llm": "Suggested approach (exercise, manual therapy, education), "
+                                                  "frequency, expected duration and home exercise focus."}),
+            ("Contraindications/Precautions", "safety_net"),
+        ],
+    },
+    "gp": {
+        "recipient": "the patient's GP",
+        "salutation": "Dear Doctor,",
+        "purpose": "ongoing primary care management following their MSK triage assessment",
+        "sections": [
+            ("Patient Details", "patient_details"),
+            ("Clinical Presentation", "presenting_complaint"),
+            ("Current Symptoms", {"llm": "Location, severity and pattern of pain, functional impact and "
+                                         "associated symptoms."}),
+            ("Assessment", {"llm": "The most likely diagnosis and the red flag conditions considered and excluded."}),
+            ("Treatment Recommendations", {"llm": "Immediate management (analgesia review, activity modification), "
+                                                  "lifestyle advice and self-management strategies."}),
+            ("Follow-up Arrangements", "gp_follow_up"),
+        ],
+    },
+}
+
+CLINICAL_SECTIONS_PROMPT = """You are an Orthopaedic Triage Clinician writing part of a referral letter to {recipient}.
+
+The salutation, patient details, treatment history, safety-netting and closing are filled in separately. Do NOT write them.
+Write ONLY the sections below, in this order. Start each section with its heading on its own line exactly as shown,
+followed by 2-4 sentences of flowing clinical prose. Use only information in the clinical summary and conversation excerpt;
+if something is not known, say so briefly rather than inventing it.
+
+{section_guidance}
+
+**CLINICAL SUMMARY:**
+{clinical_summary}
+
+**TRIAGE DECISION:**
+{triage_decision}
+
+**CONVERSATION EXCERPT:**
+{conversation_excerpt}
+"""
+
+
+def llm_sections(letter_type: str) -> List[str]:
+    return [heading for heading, kind in LETTER_LAYOUTS[letter_type]["sections"] if isinstance(kind, dict)]
+
+
+def clinical_sections_prompt(letter_type: str, clinical_summary: str, triage_decision: str,
+                             conversation_excerpt: str) -> str:
+    layout = LETTER_LAYOUTS[letter_type]
+    guidance = "\n".join(f"**{heading}:** {kind['llm']}" for heading, kind in layout["sections"]
+                         if isinstance(kind, dict))
+    return CLINICAL_SECTIONS_PROMPT.format(recipient=layout["recipient"], section_guidance=guidance,
+                                           clinical_summary=clinical_summary, triage_decision=triage_decision,
+                                           conversation_excerpt=conversation_excerpt)
+
+
+def parse_sections(text: str, headings: List[str]) -> Dict[str, str]:
+    """Split the model's output on the expected headings; unrecognised text goes to the first section."""
+    pattern = "|".join(re.escape(heading) for heading in headings)
+    # "**Heading:** text", "Heading:" or "## Heading" at the start of a line
+    parts = re.split(rf"^[ \t]*(?:#+[ \t]*)?(?:\*\*)?({pattern})[ \t]*(?::(?:\*\*)?|\*\*[ \t]*:|(?:\*\*)?[ \t]*$)[ \t]*",
+                     text.strip(), flags=re.MULTILINE | re.IGNORECASE)
+    sections: Dict[str, str] = {}
+    if parts[0].strip():
+        sections[headings[0]] = parts[0].strip()
+    by_lower = {heading.lower(): heading for heading in headings}
+    for name, body in zip(parts[1::2], parts[2::2]):
+        heading = by_lower[name.lower()]
+        sections[heading] = (sections.get(heading, "") + "\n" + body.strip()).strip()
+    return sections
+
+
+# --- Facts From The Interview ---
+def _quote(answer: Optional[str]) -> str:
+    return f'"{answer}"' if answer else ""
+
+
+def letter_facts(messages: List[Dict], patient_data: Dict[str, Any],
+                 classification: Optional[TriageClassification] = None) -> Dict[str, Any]:
+    """What the deterministic sections need, taken from the transcript rather than generated."""
+    answers = answers_by_state(messages)
+    patient_text = " ".join(msg["content"] for msg in messages if msg["role"] == "user")
+    introduction = answers.get(TriageState.GREETING) or next(
+        (msg["content"] for msg in messages if msg["role"] == "user"), "")
+
+    name = re.search(r"(?:my name is|I'm|I am)\s+([A-Z][a-z'-]+(?:\s+[A-Z][a-z'-]+)+)", introduction)
+    dob = re.search(r"(?:date of birth|DOB|born)\D{0,12}(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})", introduction, re.IGNORECASE)
+    # The complaint is what is left of the introduction once the personal details are taken out
+    complaint = answers.get(TriageState.SELECT_BODY_PART) or " ".join(
+        sentence for sentence in re.split(r"(?<=[.!?])\s+", introduction)
+        if not re.search(r"years old|date of birth|my name", sentence, re.IGNORECASE)
+        and not re.search(r"\bI'm [A-Z][a-z]+ [A-Z]", sentence))
+
+    body_part = classification.body_part.lower() if classification else next(
+        (part for part in BODY_PARTS if part in patient_text.lower()), "")
+    return {
+        "name": name.group(1) if name else "the patient",
+        "dob": dob.group(1) if dob else None,
+        "age": patient_data.get("patient", {}).get("age_years"),
+        "gender": patient_data.get("patient", {}).get("gender"),
+        "side": patient_data.get("laterality") or "",
+        "body_part": body_part,
+        "complaint": complaint.strip(),
+        "answers": answers,
+        "classification": classification,
+        # Without a validated classification, urgency falls back to the triage rules
+        "pathway": apply_triage_guardrails(patient_data, patient_text) if classification is None else None,
+    }
+
+
+def _description(facts: Dict[str, Any]) -> str:
+    """e.g. "34 year old female"."""
+    age = f"{facts['age']} year old" if facts["age"] else "adult"
+    return f"{age} {facts['gender'] or 'patient'}"
+
+
+def _site(facts: Dict[str, Any]) -> str:
+    return " ".join(part for part in (facts["side"], facts["body_part"]) if part) or "affected joint"
+
+
+# --- Deterministic Sections ---
+def patient_details(facts: Dict[str, Any]) -> str:
+    details = f"{facts['name']}, {_description(facts)}"
+    if facts["dob"]:
+        details += f", date of birth {facts['dob']}"
+    return details + ". NHS number and GP details as per the referral record."
+
+
+def presenting_complaint(facts: Dict[str, Any]) -> str:
+    text = f"Problem affecting the {_site(facts)}."
+    if facts["complaint"]:
+        text += f" In the patient's own words: {_quote(facts['complaint'])}"
+    duration = facts["answers"].get(TriageState.GATHER_DURATION)
+    if duration:
+        text += f" On duration: {_quote(duration)}"
+    return text
+
+
+def past_medical_history(facts: Dict[str, Any]) -> str:
+    answers = facts["answers"]
+    lines = []
+    if answers.get(TriageState.GATHER_PREVIOUS_INJURY_SURGERY):
+        lines.append(f"Previous injuries and surgery: {_quote(answers[TriageState.GATHER_PREVIOUS_INJURY_SURGERY])}")
+    if answers.get(TriageState.GATHER_SMOKING_STATUS):
+        lines.append(f"Smoking: {_quote(answers[TriageState.GATHER_SMOKING_STATUS])}")
+    lines.append("Comorbidities, medications and allergies were not covered by the triage interview.")
+    return " ".join(lines)
+
+
+def treatment_to_date(facts: Dict[str, Any]) -> str:
+    answers = facts["answers"]
+    questions = [
+        (TriageState.GATHER_PREVIOUS_TREATMENT, "Treatments tried"),
+        (TriageState.GATHER_DETAILED_TREATMENT_HISTORY, "Treatment history"),
+        (TriageState.GATHER_TREATMENT_RESPONSE, "Response to treatment"),
+        (TriageState.GATHER_CONSERVATIVE_TREATMENT_FAILURE, "Conservative management"),
+    ]
+    lines = [f"{label}: {_quote(answers[state])}" for state, label in questions if answers.get(state)]
+    return " ".join(lines) or "Treatment history was not asked about at triage."
+
+
+def investigations(facts: Dict[str, Any]) -> str:
+    answers = facts["answers"]
+    imaging = answers.get(TriageState.GATHER_IMAGING_HISTORY) or answers.get(TriageState.GATHER_IMAGING)
+    if imaging:
+        return f"Imaging as reported by the patient: {_quote(imaging)} Formal reports were not available at triage."
+    return "No imaging reports were available at triage."
+
+
+def urgency(facts: Dict[str, Any]) -> str:
+    classification = facts["classification"]
+    if classification is not None:
+        text = f"This referral is {'urgent' if classification.referral_type == 'urgent_ed' else 'routine'}."
+    elif facts.get("pathway") == "urgent_ed":
+        text = "The triage rules flagged this referral as urgent; there was no validated classification to confirm it."
+    else:
+        text = "Urgency was not determined at triage; please review the red flag screen."
+    red_flags = facts["answers"].get(TriageState.GATHER_RED_FLAGS)
+    if red_flags:
+        text += f" Red flag screen: {_quote(red_flags)}"
+    return text
+
+
+def specific_request(facts: Dict[str, Any]) -> str:
+    text = (f"I would be grateful if you could assess {facts['name']} and advise on further management of "
+            f"their {_site(facts)}, including whether surgical treatment is appropriate.")
+    interest = facts["answers"].get(TriageState.GATHER_SURGERY_INTEREST)
+    if interest:
+        text += f" Asked about surgery, the patient said: {_quote(interest)}"
+    return text
+
+
+def safety_net(facts: Dict[str, Any]) -> str:
+    return ("The patient has been advised to seek urgent care if they develop fever or feel systemically unwell, "
+            "a hot swollen joint, inability to weight bear, new numbness or weakness, or rapidly worsening pain. "
+            "While waiting, they should continue simple analgesia and activity modification as tolerated.")
+
+
+def gp_follow_up(facts: Dict[str, Any]) -> str:
+    return ("I suggest reviewing progress in 6 weeks and considering re-referral to specialist services if symptoms "
+            "persist despite the above management or new mechanical symptoms develop. " + safety_net(facts))
+
+
+SECTION_RENDERERS = {
+    "patient_details": patient_details,
+    "presenting_complaint": presenting_complaint,
+    "past_medical_history": past_medical_history,
+    "treatment_to_date": treatment_to_date,
+    "investigations": investigations,
+    "urgency": urgency,
+    "specific_request": specific_request,
+    "safety_net": safety_net,
+    "gp_follow_up": gp_follow_up,
+}
+
+
+def render_letter(letter_type: str, facts: Dict[str, Any], clinical_sections: Dict[str, str],
+                  letter_date: Optional[date] = None) -> str:
+    """Assemble the letter from the deterministic sections and the model's clinical sections."""
+    layout = LETTER_LAYOUTS[letter_type]
+    parts = [layout["salutation"], f"I am writing to refer {facts['name']} for {layout['purpose']}."]
+    for heading, kind in layout["sections"]:
+        if isinstance(kind, dict):
+            body = clinical_sections.get(heading) or "Not available from the triage assessment."
+        else:
+            body = SECTION_RENDERERS[kind](facts)
+        parts.append(f"**{heading}:**\n{body}")
+
+    classification = facts["classification"]
+    condition = classification.specialty if classification else f"a {_site(facts)} problem"
+    parts.append(f"**Conclusion:**\n{facts['name']} is a {_description(facts)} with {condition}. "
+                 f"I believe they would benefit from your assessment and management.")
+    parts.append("Yours sincerely,\n\nMSK Triage Service\n" + (letter_date or date.today()).strftime("%d %B %Y"))
+    return "\n\n".join(parts)
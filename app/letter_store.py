@@ -0,0 +1,118 @@
+"""
+Persistent store of generated referral letters.
+
+A letter is fully determined by its prompt (clinical summary, triage decision,
+referral type and conversation excerpt), the letter template version and the
+model settings, so the generated text is stored under a hash of those and only
+generated once. For templated letters that is the model's clinical sections; the
+rest of the letter is filled in again on each request. Bump LETTER_TEMPLATE_VERSION
+whenever a letter template changes.
+
+Set LETTER_STORE=<path> to keep letters across restarts in a JSON-lines file;
+only each letter's offset in the file is held in memory and the text is read back
+on a hit. Without it the LETTER_STORE_MAX (default 1000) most recently used
+letters are kept in memory.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+LETTER_TEMPLATE_VERSION = 2
+LETTER_STORE_MAX = int(os.environ.get("LETTER_STORE_MAX", "1000"))
+
+
+def letter_key(referral_type: str, model: str, prompt: str, options: Dict[str, Any]) -> str:
+    body = {"version": LETTER_TEMPLATE_VERSION, "referral_type": referral_type, "model": model,
+            "prompt": prompt, "options": options}
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+
+def summary_hash(clinical_summary: str) -> str:
+    return hashlib.sha256(clinical_summary.encode()).hexdigest()[:16]
+
+
+class LetterStore:
+    """
+    Generated letters keyed by letter_key: offsets into a JSON-lines file when path
+    is set, otherwise the max_letters most recently used letters in memory.
+    """
+    def __init__(self, path: Optional[str] = None, max_letters: int = LETTER_STORE_MAX):
+        self.path = path
+        self.max_letters = max_letters
+        self.offsets: Dict[str, int] = {}
+        self.letters: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.strip():
+                        try:
+                            self.offsets[json.loads(line)["key"]] = offset
+                        except (ValueError, KeyError):
+                            pass  # A line cut short by a crash; that letter is generated again
+                    offset += len(line)
+            if offset and not line.endswith(b"\n"):
+                with open(path, "ab") as f:
+                    f.write(b"\n")  # The next letter starts on its own line
+
+    def _entry(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.path is None:
+            entry = self.letters.get(key)
+            if entry is not None:
+                self.letters.move_to_end(key)
+            return entry
+        offset = self.offsets.get(key)
+        if offset is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entry(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["letter"]
+
+    def put(self, key: str, letter: str, referral_type: str, clinical_summary: str):
+        entry = {"key": key, "referral_type": referral_type, "summary_hash": summary_hash(clinical_summary),
+                 "template_version": LETTER_TEMPLATE_VERSION, "letter": letter}
+        if self.path:
+            with open(self.path, "ab") as f:
+                self.offsets[key] = f.tell()
+                f.write((json.dumps(entry) + "\n").encode("utf-8"))
+            return
+        self.letters[key] = entry
+        self.letters.move_to_end(key)
+        while len(self.letters) > self.max_letters:
+            self.letters.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "letters": len(self.offsets) if self.path else len(self.letters),
+                "hits": self.hits, "misses": self.misses}
+
+
+# --- Shared Store ---
+_letter_store: Optional[LetterStore] = None
+
+
+def get_letter_store() -> LetterStore:
+    """Return the process-wide letter store, reading LETTER_STORE on first use."""
+    global _letter_store
+    if _letter_store is None:
+        _letter_store = LetterStore(os.environ.get("LETTER_STORE"))
+    return _letter_store
+
+
+def configure_letter_store(path: Optional[str] = None) -> LetterStore:
+    """Replace the process-wide letter store (used by tests)."""
+    global _letter_store
+    _letter_store = LetterStore(path)
+    return _letter_store
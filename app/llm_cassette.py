@@ -0,0 +1,125 @@
+"""
+Record/replay of LLM calls for offline benchmarks and regression runs.
+
+In record mode every generation that goes through the LLM pool is appended to a
+gzipped JSON-lines cassette: the request hash, model, response text and timing. In
+replay mode the pool answers from the cassette instead of Ollama, either with the
+recorded latency or with none at all, so full-pipeline runs need no GPU.
+
+Configure with LLM_CASSETTE=<path>, LLM_CASSETTE_MODE=record|replay and
+LLM_CASSETTE_LATENCY=original|zero, or configure_cassette() from a script.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+class Cassette:
+    """Recorded LLM responses keyed by request hash."""
+    def __init__(self, path: str, mode: str = "replay", latency: str = "original"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if latency not in ("original", "zero"):
+            raise ValueError(f"Unknown cassette latency: {latency}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        if os.path.exists(path):
+            self.load()
+        elif mode == "replay":
+            raise FileNotFoundError(f"No cassette at {path} to replay")
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry  # Later recordings win
+
+    # --- Recording ---
+    def record(self, key: str, model: str, response: str, seconds: float,
+               first_token_seconds: Optional[float] = None):
+        entry = {
+            "key": key,
+            "model": model,
+            "response": response,
+            "seconds": round(seconds, 3),
+            "first_token_seconds": round(first_token_seconds, 3) if first_token_seconds is not None else None,
+        }
+        self.entries[key] = entry
+        self.recorded += 1
+        # Appending keeps everything recorded so far if the run is interrupted
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    # --- Replay ---
+    def _lookup(self, key: str) -> Dict[str, Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            raise CassetteMissError(f"Request {key[:12]} is not on cassette {self.path}")
+        self.hits += 1
+        return entry
+
+    async def replay(self, key: str) -> str:
+        entry = self._lookup(key)
+        if self.latency == "original":
+            await asyncio.sleep(entry["seconds"])
+        return entry["response"]
+
+    async def replay_stream(self, key: str) -> AsyncIterator[str]:
+        """Yield the recorded response a word at a time, spread over the recorded timing."""
+        entry = self._lookup(key)
+        chunks: List[str] = re.findall(r"\S+\s*|\s+", entry["response"]) or [""]
+        if self.latency == "zero":
+            for chunk in chunks:
+                yield chunk
+            return
+        first_token = entry["first_token_seconds"] if entry["first_token_seconds"] is not None else 0.0
+        await asyncio.sleep(first_token)
+        per_chunk = max(0.0, entry["seconds"] - first_token) / len(chunks)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(per_chunk)
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "mode": self.mode, "latency": self.latency, "entries": len(self.entries),
+                "hits": self.hits, "misses": self.misses, "recorded": self.recorded}
+
+
+# --- Shared Cassette ---
+_cassette: Optional[Cassette] = None
+_cassette_loaded = False
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Return the process-wide cassette from LLM_CASSETTE, or None when not recording or replaying."""
+    global _cassette, _cassette_loaded
+    if not _cassette_loaded:
+        _cassette_loaded = True
+        path = os.environ.get("LLM_CASSETTE")
+        if path:
+            _cassette = Cassette(path, os.environ.get("LLM_CASSETTE_MODE", "replay"),
+                                 os.environ.get("LLM_CASSETTE_LATENCY", "original"))
+    return _cassette
+
+
+def configure_cassette(path: Optional[str], mode: str = "replay", latency: str = "original") -> Optional[Cassette]:
+    """Replace the process-wide cassette (None turns recording and replay off)."""
+    global _cassette, _cassette_loaded
+    _cassette_loaded = True
+    _cassette = Cassette(path, mode, latency) if path else None
+    return _cassette
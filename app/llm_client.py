@@ -0,0 +1,652 @@
+"""
+Ollama client shared by the agents.
+
+Requests are spread over one or more Ollama backends listed in OLLAMA_BACKENDS
+(comma-separated base URLs, default http://localhost:11434). Each request goes to
+the backend with the fewest requests in flight (or the lowest latency-weighted load
+with OLLAMA_ROUTING=latency). A backend that would first have to load the model
+counts as OLLAMA_COLD_START_PENALTY extra requests in flight, so warm backends are
+preferred until they are busier than that. Backends that keep failing are ejected for a while and re-admitted by the
+periodic health check.
+
+With hedging enabled (OLLAMA_HEDGING=1), a request that has not produced its first
+token within the stage's usual time-to-first-token percentile is duplicated on
+another backend; the first copy to finish wins and the other is cancelled.
+
+A circuit breaker stops calls to Ollama while requests keep failing or missing the
+latency SLO (OLLAMA_SLO_SECONDS), so callers can fall back straight away.
+
+With LLM_CASSETTE set, generations are recorded to or replayed from a cassette
+file (see llm_cassette) instead of depending on live Ollama output.
+
+Identical requests (same model, prompt and options) that arrive while one is already in
+flight share its generation instead of starting another, streams included.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import httpx
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Deque, Dict, Iterable, List, Optional, Set
+from .llm_cassette import Cassette, get_cassette
+
+DEFAULT_OLLAMA_BACKENDS = "http://localhost:11434"
+
+
+class LLMUnavailableError(Exception):
+    """Raised when no Ollama backend could serve a request."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without calling Ollama while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to Ollama while it is failing or missing its latency SLO.
+
+    Opens after max_failures consecutive failed requests, or when at least slow_ratio
+    of the last window requests (and min_calls or more) took longer than slo_seconds.
+    After open_seconds one trial request is let through; it closes the breaker if it
+    succeeds within the SLO and re-opens it otherwise.
+    """
+    def __init__(self, max_failures: int = 3, slo_seconds: float = 20.0, window: int = 10,
+                 slow_ratio: float = 0.5, min_calls: int = 4, open_seconds: float = 30.0):
+        self.max_failures = max_failures
+        self.slo_seconds = slo_seconds
+        self.slow_ratio = slow_ratio
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.state = "closed"                       # closed, open or half_open
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def is_open(self) -> bool:
+        """True while requests are being refused."""
+        if self.state == "open":
+            return time.monotonic() - self.opened_at < self.open_seconds
+        return self.state == "half_open" and self.trial_in_flight
+
+    def allow(self) -> bool:
+        """Whether a new request may go to Ollama; in half-open state only the trial request may."""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self.trial_in_flight = False
+        self.latencies.clear()
+
+    def record_success(self, latency: float):
+        self.consecutive_failures = 0
+        if self.state == "half_open":
+            if latency <= self.slo_seconds:
+                self.state = "closed"
+                self.trial_in_flight = False
+            else:
+                self._open()
+            return
+        self.latencies.append(latency)
+        slow = sum(1 for seconds in self.latencies if seconds > self.slo_seconds)
+        if len(self.latencies) >= self.min_calls and slow >= self.slow_ratio * len(self.latencies):
+            self._open()
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.max_failures:
+            self._open()
+
+    def release(self):
+        """A request was cancelled before it had an outcome."""
+        self.trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": "open" if self.is_open() else self.state,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "consecutive_failures": self.consecutive_failures,
+            "slo_seconds": self.slo_seconds,
+        }
+
+
+class OllamaBackend:
+    """One Ollama instance and what the pool has learned about it."""
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0                        # Requests in flight
+        self.latency_ewma: Optional[float] = None   # Seconds per completed generation
+        self.loaded_models: Set[str] = set()        # From /api/ps and successful generations
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0                    # time.monotonic() until which the node is skipped
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def record_success(self, model: str, latency: float, alpha: float):
+        self.consecutive_failures = 0
+        self.loaded_models.add(model)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = alpha * latency + (1 - alpha) * self.latency_ewma
+
+    def record_failure(self, max_failures: int, eject_seconds: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= max_failures:
+            self.ejected_until = time.monotonic() + eject_seconds
+
+
+class SharedStream:
+    """One in-flight streamed generation that any number of readers can follow from the start."""
+    def __init__(self, source: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._changed.set()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    async def read(self) -> AsyncIterator[str]:
+        """Yield every chunk so far, then new ones as they arrive."""
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class LLMPool:
+    """
+    Routes Ollama /api/generate calls across several backends.
+
+    strategy is "least_outstanding" (fewest in-flight requests, latency breaks ties)
+    or "latency" (in-flight requests weighted by each backend's latency average).
+    A backend without the model loaded counts cold_start_penalty extra requests.
+
+    hedging duplicates slow requests for a named stage once hedge_min_samples
+    first-token times have been seen for it (or after hedge_initial_delay before then).
+    First-token times are recorded for every staged request, hedged or not.
+    """
+    def __init__(self, urls: List[str], strategy: str = "least_outstanding",
+                 health_interval: float = 15.0, eject_seconds: float = 30.0,
+                 max_failures: int = 2, ewma_alpha: float = 0.3, timeout: float = 60.0,
+                 hedging: bool = False, hedge_percentile: float = 0.95, hedge_min_samples: int = 20,
+                 hedge_initial_delay: Optional[float] = None, breaker: Optional[CircuitBreaker] = None,
+                 parallel_per_backend: int = 2, cassette: Optional[Cassette] = None,
+                 cold_start_penalty: float = 2.0):
+        if not urls:
+            raise ValueError("LLMPool needs at least one backend URL")
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.backends = [OllamaBackend(url) for url in urls]
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self.eject_seconds = eject_seconds
+        self.max_failures = max_failures
+        self.ewma_alpha = ewma_alpha
+        self.timeout = timeout
+        self.last_health_check: Optional[float] = None
+        self._health_lock = asyncio.Lock()
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_initial_delay = hedge_initial_delay
+        self.first_token_times: Dict[str, Deque[float]] = {}
+        self.hedge_stats: Dict[str, Dict[str, int]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._inflight_streams: Dict[str, SharedStream] = {}
+        self.coalesced = {"generate": 0, "stream": 0}
+        self.breaker = breaker or CircuitBreaker()
+        self.parallel_per_backend = parallel_per_backend  # Match the servers' OLLAMA_NUM_PARALLEL
+        self.cassette = cassette
+        self.cold_start_penalty = cold_start_penalty  # Requests in flight a model load is worth
+
+    # --- Routing ---
+    def _load(self, backend: OllamaBackend, model: str):
+        # Model affinity: loading the model costs about as much as queueing behind a few requests,
+        # so a warm backend is preferred until it is that much busier than a cold one
+        outstanding = backend.outstanding + (0 if model in backend.loaded_models else self.cold_start_penalty)
+        if self.strategy == "latency":
+            return ((outstanding + 1) * (backend.latency_ewma or 0.0), outstanding)
+        return (outstanding, backend.latency_ewma or 0.0)
+
+    def pick(self, model: str, exclude: Iterable[str] = ()) -> Optional[OllamaBackend]:
+        """Choose a backend for model, skipping the URLs in exclude."""
+        excluded = set(exclude)
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.url not in excluded]
+        healthy = [b for b in candidates if b.available(now)]
+        # With every node ejected, trying one beats failing outright
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda backend: self._load(backend, model))
+
+    # --- Health checks ---
+    async def check_health(self):
+        """Refresh loaded models from /api/ps; eject nodes that do not answer and re-admit those that do."""
+        async def check(backend: OllamaBackend):
+            try:
+                async with httpx.AsyncClient(timeout=2.0) as client:
+                    response = await client.get(f"{backend.url}/api/ps")
+                    response.raise_for_status()
+                    models = response.json().get("models", [])
+                backend.loaded_models = {m.get("name") or m.get("model") for m in models} - {None}
+                backend.consecutive_failures = 0
+                backend.ejected_until = 0.0
+            except Exception as e:
+                print(f"Health check failed for Ollama backend {backend.url}: {e}")
+                backend.record_failure(1, self.eject_seconds)
+
+        await asyncio.gather(*(check(backend) for backend in self.backends))
+        self.last_health_check = time.monotonic()
+
+    async def _maybe_check_health(self):
+        if len(self.backends) == 1:
+            return  # Nothing to route around
+        due = self.last_health_check is None or time.monotonic() - self.last_health_check >= self.health_interval
+        if due and not self._health_lock.locked():
+            async with self._health_lock:
+                await self.check_health()
+
+    # --- Warm-up and readiness ---
+    async def warm_up(self, models: List[str], keep_alive: str = "30m",
+                      options: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, bool]]:
+        """
+        Load each model on every backend with an empty generation, so real requests skip the load time.
+        options maps a model to the Ollama options its requests use; a different num_ctx would reload it.
+        """
+        async def load(backend: OllamaBackend) -> Dict[str, bool]:
+            loaded = {}
+            # One model at a time per backend, so warm-up does not fight itself for GPU memory
+            for model in models:
+                try:
+                    body = {"model": model, "prompt": "", "keep_alive": keep_alive, "stream": False}
+                    if options and options.get(model):
+                        body["options"] = options[model]
+                    async with httpx.AsyncClient(timeout=max(self.timeout, 300.0)) as client:
+                        response = await client.post(f"{backend.url}/api/generate", json=body)
+                        response.raise_for_status()
+                    backend.loaded_models.add(model)
+                    loaded[model] = True
+                except Exception as e:
+                    print(f"Warm-up of {model} on Ollama backend {backend.url} failed: {e}")
+                    loaded[model] = False
+            return loaded
+
+        outcomes = await asyncio.gather(*(load(backend) for backend in self.backends))
+        return {backend.url: outcome for backend, outcome in zip(self.backends, outcomes)}
+
+    def sustainable_concurrency(self) -> int:
+        """Requests the healthy backends can run at once without queueing inside Ollama."""
+        now = time.monotonic()
+        healthy = sum(1 for b in self.backends if b.available(now))
+        return max(1, healthy * self.parallel_per_backend)
+
+    def readiness(self, models: Iterable[str]) -> Dict[str, Any]:
+        """Which healthy backends have each model loaded, and how many requests are in flight."""
+        now = time.monotonic()
+        warm = {
+            model: [b.url for b in self.backends if b.available(now) and model in b.loaded_models]
+            for model in models
+        }
+        return {
+            "models": warm,
+            "all_warm": all(warm.values()),
+            "queue_depth": sum(b.outstanding for b in self.backends),
+        }
+
+    # --- Generation ---
+    async def _stream_from(self, backend: OllamaBackend, model: str, body: Dict[str, Any],
+                           timeout: Optional[float], stage: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream a completion from one backend, keeping its routing state (and the stage's first-token times) up to date."""
+        backend.outstanding += 1
+        backend.requests += 1
+        started = time.perf_counter()
+        first_token = True
+        try:
+            async with httpx.AsyncClient(timeout=timeout or self.timeout) as client:
+                async with client.stream(
+                    "POST",
+                    f"{backend.url}/api/generate",
+                    json={**body, "stream": True},
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("response"):
+                            if first_token and stage is not None:
+                                self._record_first_token(stage, time.perf_counter() - started)
+                            first_token = False
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            break
+            backend.record_success(model, time.perf_counter() - started, self.ewma_alpha)
+        except Exception as e:
+            print(f"Ollama backend {backend.url} failed: {e}")
+            backend.record_failure(self.max_failures, self.eject_seconds)
+            raise
+        finally:
+            backend.outstanding -= 1
+
+    async def generate(self, model: str, prompt: str, timeout: Optional[float] = None,
+                       stage: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                       keep_alive: Optional[str] = None, format: Optional[Any] = None) -> str:
+        """
+        Generate a completion, sharing any identical request already in flight.
+        format is passed to Ollama as is: "json" or a JSON schema for structured output.
+        """
+        body = request_body(model, prompt, options, keep_alive, format)
+        key = request_key(body)
+        if self.cassette is not None and self.cassette.mode == "replay":
+            return await self.cassette.replay(key)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced["generate"] += 1
+        else:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit breaker open, not calling Ollama for {model}")
+            call = self._through_breaker(self._generate(model, body, timeout, stage))
+            if self.cassette is not None:
+                call = self._record(key, model, call)
+            task = asyncio.create_task(call)
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # One caller giving up must not cancel the generation for the others
+        return await asyncio.shield(task)
+
+    async def _generate(self, model: str, body: Dict[str, Any], timeout: Optional[float] = None,
+                        stage: Optional[str] = None) -> str:
+        """Generate a completion, failing over to other backends on error (and hedging if enabled)."""
+        await self._maybe_check_health()
+        if stage is not None:
+            self.hedge_stats.setdefault(stage, {"requests": 0, "fired": 0, "won": 0})["requests"] += 1
+            if self.hedging and len(self.backends) > 1:
+                threshold = self.hedge_threshold(stage)
+                if threshold is not None:
+                    try:
+                        return await self._generate_hedged(model, body, timeout, stage, threshold)
+                    except Exception as e:
+                        print(f"Hedged generation failed, retrying without hedging: {e}")
+        
+        tried: List[str] = []
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.backends):
+            backend = self.pick(model, tried)
+            if backend is None:
+                break
+            tried.append(backend.url)
+            backend.outstanding += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            try:
+                async with httpx.AsyncClient(timeout=timeout or self.timeout) as client:
+                    response = await client.post(
+                        f"{backend.url}/api/generate",
+                        json={**body, "stream": False},
+                    )
+                    response.raise_for_status()
+                    data = response.json()
+                    result = data.get("response", "")
+                elapsed = time.perf_counter() - started
+                backend.record_success(model, elapsed, self.ewma_alpha)
+                if stage is not None:
+                    # Without streaming the first token arrived about when Ollama started evaluating (ns)
+                    self._record_first_token(stage, max(0.0, elapsed - data.get("eval_duration", 0) / 1e9))
+                return result
+            except Exception as e:
+                print(f"Ollama backend {backend.url} failed: {e}")
+                backend.record_failure(self.max_failures, self.eject_seconds)
+                last_error = e
+            finally:
+                backend.outstanding -= 1
+        raise LLMUnavailableError(f"No Ollama backend could serve {model}: {last_error}")
+
+    async def generate_stream(self, model: str, prompt: str, timeout: Optional[float] = None,
+                              options: Optional[Dict[str, Any]] = None,
+                              keep_alive: Optional[str] = None, format: Optional[Any] = None) -> AsyncIterator[str]:
+        """Stream a completion, joining an identical stream already in flight from its first chunk."""
+        body = request_body(model, prompt, options, keep_alive, format)
+        key = request_key(body)
+        if self.cassette is not None and self.cassette.mode == "replay":
+            async for chunk in self.cassette.replay_stream(key):
+                yield chunk
+            return
+        stream = self._inflight_streams.get(key)
+        if stream is not None:
+            self.coalesced["stream"] += 1
+        else:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit breaker open, not calling Ollama for {model}")
+            source = self._stream_through_breaker(self._generate_stream(model, body, timeout))
+            if self.cassette is not None:
+                source = self._record_stream(key, model, source)
+            stream = SharedStream(source)
+            self._inflight_streams[key] = stream
+            stream.task.add_done_callback(lambda _: self._inflight_streams.pop(key, None))
+        async for chunk in stream.read():
+            yield chunk
+
+    async def _generate_stream(self, model: str, body: Dict[str, Any], timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Stream a completion. Fails over to another backend only until the first chunk is out."""
+        await self._maybe_check_health()
+        tried: List[str] = []
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.backends):
+            backend = self.pick(model, tried)
+            if backend is None:
+                break
+            tried.append(backend.url)
+            emitted = False
+            try:
+                async for chunk in self._stream_from(backend, model, body, timeout):
+                    emitted = True
+                    yield chunk
+                return
+            except Exception as e:
+                last_error = e
+                if emitted:
+                    raise
+        raise LLMUnavailableError(f"No Ollama backend could serve {model}: {last_error}")
+
+    # --- Cassette recording ---
+    async def _record(self, key: str, model: str, call: Awaitable[str]) -> str:
+        started = time.perf_counter()
+        result = await call
+        self.cassette.record(key, model, result, time.perf_counter() - started)
+        return result
+
+    async def _record_stream(self, key: str, model: str, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        first_token = None
+        parts = []
+        async for chunk in stream:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            parts.append(chunk)
+            yield chunk
+        self.cassette.record(key, model, "".join(parts), time.perf_counter() - started, first_token)
+
+    # --- Circuit breaker ---
+    async def _through_breaker(self, call: Awaitable[str]) -> str:
+        """Await a generation, reporting its outcome and latency to the breaker."""
+        started = time.perf_counter()
+        try:
+            result = await call
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success(time.perf_counter() - started)
+        return result
+
+    async def _stream_through_breaker(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass a stream through, reporting its outcome and total latency to the breaker."""
+        started = time.perf_counter()
+        try:
+            async for chunk in stream:
+                yield chunk
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success(time.perf_counter() - started)
+
+    # --- Hedging ---
+    def hedge_threshold(self, stage: str) -> Optional[float]:
+        """Seconds to wait for a first token before hedging, from the stage's recent history."""
+        samples = self.first_token_times.get(stage)
+        if not samples or len(samples) < self.hedge_min_samples:
+            return self.hedge_initial_delay
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self.hedge_percentile * len(ordered)))]
+
+    def _record_first_token(self, stage: str, seconds: float):
+        self.first_token_times.setdefault(stage, deque(maxlen=200)).append(seconds)
+
+    async def _generate_hedged(self, model: str, body: Dict[str, Any], timeout: Optional[float],
+                               stage: str, threshold: float) -> str:
+        """Run one copy; if no first token by threshold, race a copy on another backend."""
+        async def collect(backend: OllamaBackend, first_token: asyncio.Event) -> str:
+            parts = []
+            async for chunk in self._stream_from(backend, model, body, timeout, stage):
+                first_token.set()
+                parts.append(chunk)
+            return "".join(parts)
+
+        primary_backend = self.pick(model)
+        if primary_backend is None:
+            raise LLMUnavailableError(f"No Ollama backend could serve {model}")
+        first_token = asyncio.Event()
+        primary = asyncio.create_task(collect(primary_backend, first_token))
+        waiter = asyncio.create_task(first_token.wait())
+        await asyncio.wait({primary, waiter}, timeout=threshold, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        
+        hedge_backend = None
+        if not primary.done() and not first_token.is_set():
+            hedge_backend = self.pick(model, exclude=[primary_backend.url])
+        if hedge_backend is None:
+            return await primary
+        
+        stats = self.hedge_stats[stage]
+        stats["fired"] += 1
+        hedge = asyncio.create_task(collect(hedge_backend, asyncio.Event()))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            stats["won"] += 1
+                        return task.result()
+            # Both copies failed
+            raise primary.exception() or hedge.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> List[Dict]:
+        """Per-backend routing state."""
+        now = time.monotonic()
+        return [
+            {
+                "url": b.url,
+                "healthy": b.available(now),
+                "outstanding": b.outstanding,
+                "latency_ewma": b.latency_ewma,
+                "loaded_models": sorted(b.loaded_models),
+                "requests": b.requests,
+                "failures": b.failures,
+            }
+            for b in self.backends
+        ]
+
+
+def request_body(model: str, prompt: str, options: Optional[Dict[str, Any]] = None,
+                 keep_alive: Optional[str] = None, format: Optional[Any] = None) -> Dict[str, Any]:
+    """The /api/generate payload, without the stream flag."""
+    body: Dict[str, Any] = {"model": model, "prompt": prompt}
+    if options:
+        body["options"] = options
+    if keep_alive is not None:
+        body["keep_alive"] = keep_alive
+    if format is not None:
+        body["format"] = format
+    return body
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """Hash identifying identical generation requests (model, prompt and options)."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+
+# --- Shared Pool ---
+_pool: Optional[LLMPool] = None
+
+
+def get_llm_pool() -> LLMPool:
+    """Return the process-wide pool, built from OLLAMA_BACKENDS on first use."""
+    global _pool
+    if _pool is None:
+        urls = [url.strip() for url in os.environ.get("OLLAMA_BACKENDS", DEFAULT_OLLAMA_BACKENDS).split(",") if url.strip()]
+        _pool = LLMPool(urls, strategy=os.environ.get("OLLAMA_ROUTING", "least_outstanding"),
+                        hedging=os.environ.get("OLLAMA_HEDGING", "0") == "1",
+                        hedge_initial_delay=float(os.environ.get("OLLAMA_HEDGE_INITIAL_DELAY", "5")),
+                        breaker=CircuitBreaker(slo_seconds=float(os.environ.get("OLLAMA_SLO_SECONDS", "20"))),
+                        parallel_per_backend=int(os.environ.get("OLLAMA_NUM_PARALLEL", "2")),
+                        cold_start_penalty=float(os.environ.get("OLLAMA_COLD_START_PENALTY", "2")),
+                        cassette=get_cassette())
+    return _pool
+
+
+def configure_llm_pool(urls: List[str], **kwargs) -> LLMPool:
+    """Replace the process-wide pool (used by tests and scripts)."""
+    global _pool
+    kwargs.setdefault("cassette", get_cassette())
+    _pool = LLMPool(urls, **kwargs)
+    return _pool
@@ -0,0 +1,184 @@
+"""
+Non-blocking log writes.
+
+Log text is queued in memory and written by a background task, so a request or a
+simulation turn never waits for the disk. The writer takes whatever has queued up
+(up to batch_size records), groups it by file and writes it in a worker thread;
+files written since the last fsync are fsynced every fsync_interval seconds and
+when the sink is closed.
+
+The queue is bounded. submit() drops a record when it is full; write() waits for
+room instead. Both are counted in stats(), along with the queue's high-water
+mark, so a slow disk shows up as backpressure rather than as request latency.
+
+Configure with LOG_SINK_QUEUE (default 1000 records), LOG_SINK_BATCH (default 64)
+and LOG_SINK_FSYNC_SECONDS (default 1.0).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class LogSink:
+    """Bounded queue of (path, text) appends drained by a background writer."""
+    def __init__(self, max_queue: int = 1000, batch_size: int = 64, fsync_interval: float = 1.0):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self.writer: Optional[asyncio.Task] = None
+        self.dirty: Set[str] = set()
+        self.dirty_lock = threading.Lock()
+        self.last_fsync = time.monotonic()
+        self.counters = {"submitted": 0, "written": 0, "dropped": 0, "blocked": 0, "blocked_seconds": 0.0,
+                         "batches": 0, "fsyncs": 0, "write_seconds": 0.0, "errors": 0, "high_water": 0}
+
+    def start(self):
+        """Start the background writer on the running loop (done on first use)."""
+        if self.writer is None or self.writer.done():
+            if self.queue is not None:
+                # Lines a stopped writer never wrote are lost with its queue; count them
+                self.counters["dropped"] += self.queue.qsize()
+            self.queue = asyncio.Queue(self.max_queue)
+            self.writer = asyncio.create_task(self._run())
+
+    def _queued(self):
+        self.counters["submitted"] += 1
+        self.counters["high_water"] = max(self.counters["high_water"], self.queue.qsize())
+
+    def submit(self, path: str, text: str) -> bool:
+        """Queue text to append to path without waiting; returns False (and counts a drop) if the queue is full."""
+        self.start()
+        try:
+            self.queue.put_nowait((path, text))
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            return False
+        self._queued()
+        return True
+
+    async def write(self, path: str, text: str):
+        """Queue text to append to path, waiting for room if the queue is full."""
+        self.start()
+        if self.queue.full():
+            self.counters["blocked"] += 1
+            started = time.perf_counter()
+            await self.queue.put((path, text))
+            self.counters["blocked_seconds"] += time.perf_counter() - started
+        else:
+            self.queue.put_nowait((path, text))
+        self._queued()
+
+    # --- Background Writer ---
+    async def _run(self):
+        while True:
+            # Files written since the last fsync are fsynced once the interval passes, even if nothing new arrives
+            try:
+                first = await asyncio.wait_for(self.queue.get(), self.fsync_interval if self.dirty else None)
+            except asyncio.TimeoutError:
+                try:
+                    await asyncio.to_thread(self._fsync)
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    print(f"Error syncing logs: {e}")
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            fsync = time.monotonic() - self.last_fsync >= self.fsync_interval
+            try:
+                await asyncio.to_thread(self._write_batch, batch, fsync)
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"Error writing log batch: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_batch(self, batch: List[Tuple[str, str]], fsync: bool):
+        """Append a batch, one open per file, and fsync everything written since the last fsync if due."""
+        started = time.perf_counter()
+        by_path: Dict[str, List[str]] = {}
+        for path, text in batch:
+            by_path.setdefault(path, []).append(text)
+        for path, texts in by_path.items():
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(texts))
+            with self.dirty_lock:
+                self.dirty.add(path)
+        if fsync:
+            self._fsync()
+        self.counters["batches"] += 1
+        self.counters["written"] += len(batch)
+        self.counters["write_seconds"] += time.perf_counter() - started
+
+    def _fsync(self):
+        with self.dirty_lock:
+            paths, self.dirty = self.dirty, set()
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                # e.g. the file was rotated or deleted since it was written; the others still get synced
+                self.counters["errors"] += 1
+                print(f"Error syncing log {path}: {e}")
+        if paths:
+            self.counters["fsyncs"] += 1
+        self.last_fsync = time.monotonic()
+
+    async def flush(self):
+        """Wait until everything queued so far is written and fsynced."""
+        if self.queue is not None:
+            await self.queue.join()
+        await asyncio.to_thread(self._fsync)
+
+    async def close(self):
+        """Flush and stop the writer; the sink starts again on next use."""
+        if self.writer is None:
+            return
+        if not self.writer.done():
+            await self.flush()
+            self.writer.cancel()
+        self.writer = None
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counters["batches"]
+        return {
+            **self.counters,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue": self.max_queue,
+            "mean_batch": round(self.counters["written"] / batches, 2) if batches else 0.0,
+            "blocked_seconds": round(self.counters["blocked_seconds"], 3),
+            "write_seconds": round(self.counters["write_seconds"], 3),
+        }
+
+
+# --- Shared Sink ---
+_log_sink: Optional[LogSink] = None
+
+
+def get_log_sink() -> LogSink:
+    """Return the process-wide log sink, configured from LOG_SINK_* on first use."""
+    global _log_sink
+    if _log_sink is None:
+        _log_sink = LogSink(int(os.environ.get("LOG_SINK_QUEUE", "1000")),
+                            int(os.environ.get("LOG_SINK_BATCH", "64")),
+                            float(os.environ.get("LOG_SINK_FSYNC_SECONDS", "1.0")))
+    return _log_sink
+
+
+def configure_log_sink(max_queue: int = 1000, batch_size: int = 64, fsync_interval: float = 1.0) -> LogSink:
+    """Replace the process-wide log sink (used by tests)."""
+    global _log_sink
+    _log_sink = LogSink(max_queue, batch_size, fsync_interval)
+    return _log_sink
@@ -1,12 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
+import asyncio
+import json
+import os
+import time
 import uvicorn
+import uuid
 
 # Import the existing agent
-from triage_agent import TriageAgent
+from .triage_agent import TriageAgent, TriageState, get_question_block, SPECULATIVE_SUMMARY_STATES
 # Import the NEW agent
-from summarization_agent import SummarizationAgent
+from .summarization_agent import SummarizationAgent, RollingSummary, SPECULATION_STATS
+from .referral_letter_agent import ReferralLetterAgent
+from .letter_store import get_letter_store
+from .log_sink import get_log_sink
+from .similar_cases import find_similar_cases
+from .triage_schemas import TriageClassification
+from .llm_client import get_llm_pool
+from .generation_profiles import served_models, model_load_options
+from .questionnaire_specs import get_available_forms, get_questionnaire_form
+from .questionnaire_engine import compile_scoring_rules
+from .triage_guardrails import score_triage_guardrails
 
 
 # --- Data Models (No changes here) ---
@@ -14,11 +32,208 @@ class ChatMessage(BaseModel):
     role: str
     content: str
 
+DEFAULT_MODEL = "llama3.1:8b"
+
 class PromptRequest(BaseModel):
     messages: List[ChatMessage]
-    model: str = "llama3.1:8b"
+    model: str = DEFAULT_MODEL
+    conversation_id: Optional[str] = None
+    speculative_summary: bool = False  # Opt-in: pre-generate the SBAR near the end of the conversation
+
+# --- Startup ---
+# Readiness state filled in by the startup hook; /readyz reports it
+startup_state = {"started_at": None, "caches_primed": False, "warm_up": None, "warm_up_attempts": 0}
+READY_MAX_QUEUE_DEPTH = int(os.environ.get("READY_MAX_QUEUE_DEPTH", "8"))
+# How often to check that the served models are still resident, and reload them if not
+WARM_UP_RETRY_SECONDS = float(os.environ.get("WARM_UP_RETRY_SECONDS", "15"))
+# NDJSON log of completed WebSocket conversations, written through the log sink (off when unset)
+CONVERSATION_EVENT_LOG = os.environ.get("CONVERSATION_EVENT_LOG")
+
+
+def prime_caches():
+    """Compile the questionnaire scoring rules and run the extractors once, off the request path."""
+    for form_name in get_available_forms():
+        spec = get_questionnaire_form(form_name).get("spec")
+        if spec:
+            compile_scoring_rules(spec)
+    sample = [{"role": "user", "content": "I'm 45 and I twisted my left knee, it's swollen and 6/10"}]
+    score_triage_guardrails(TriageAgent()._extract_patient_data(sample), sample[0]["content"])
+
+
+async def warm_up_llm():
+    """Load every model the stages use on every backend, with a keep-alive so it stays resident."""
+    startup_state["warm_up"] = await get_llm_pool().warm_up(served_models(DEFAULT_MODEL),
+                                                            options=model_load_options(DEFAULT_MODEL))
+    startup_state["warm_up_attempts"] += 1
+
+
+async def keep_models_warm():
+    """
+    Warm up at startup and again whenever a served model is cold: Ollama was not up
+    yet, the model was pulled later, or keep_alive expired while the server was idle.
+    """
+    models = served_models(DEFAULT_MODEL)
+    while True:
+        try:
+            pool = get_llm_pool()
+            await pool.check_health()  # /api/ps shows which models are actually resident
+            if not pool.readiness(models)["all_warm"]:
+                await warm_up_llm()
+        except Exception as e:
+            print(f"Model warm-up failed, retrying in {WARM_UP_RETRY_SECONDS}s: {e}")
+        await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_state["started_at"] = time.monotonic()
+    prime_caches()
+    startup_state["caches_primed"] = True
+    # Model loading can take a while; /readyz stays 503 until the models are resident
+    warm_up = asyncio.create_task(keep_models_warm())
+    yield
+    warm_up.cancel()
+    await get_log_sink().close()
+
+app = FastAPI(lifespan=lifespan)
+
+
+class BatchTranscript(BaseModel):
+    id: str
+    messages: List[ChatMessage]
+
+class BatchSummarizeRequest(BaseModel):
+    transcripts: List[BatchTranscript]
+    model: str = DEFAULT_MODEL
+    concurrency: Optional[int] = None   # Default: what the healthy Ollama backends can run at once
+    skip_ids: List[str] = []            # Transcripts already summarised by an earlier, interrupted run
+
+
+def summary_payload(summary: Dict) -> Dict:
+    """JSON body for a summarize_and_triage_structured result."""
+    return {
+        "response": summary["text"],
+        "differential": summary["differential"].model_dump() if summary["differential"] else None,
+        "classification": summary["classification"].model_dump() if summary["classification"] else None,
+        "degraded": summary["degraded"],
+    }
+
+class ReferralLetterRequest(BaseModel):
+    clinical_summary: str
+    messages: List[ChatMessage]
+    classification: Optional[Dict] = None    # The "classification" returned with the summary
+    triage_decision: Optional[str] = None    # Default: the classification's decision
+    referral_type: Optional[str] = None      # Default: the primary referral type
+    model: str = DEFAULT_MODEL
+
+class SimilarCasesRequest(BaseModel):
+    messages: List[ChatMessage]
+    k: int = 5
+    exclude_conversation_id: Optional[str] = None   # e.g. the stored conversation being reviewed
+
+
+def speculate_referral_letter(model: str, summary: Dict, message_dicts: List[Dict]):
+    """Start generating the primary referral letter as soon as the summary is final."""
+    classification = summary["classification"]
+    # A degraded summary means the LLM is unavailable; without a classification the referral type is a guess
+    if summary["degraded"] or classification is None:
+        return
+    ReferralLetterAgent(model=model).start_speculative_letter(summary["text"], classification.decision(),
+                                                              message_dicts, classification)
+
+# Conversations abandoned mid-interview are forgotten after this long idle, or once there are too many
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "1800"))
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", "1000"))
+
+
+class SessionCache:
+    """Per-conversation state, least recently used first; idle or excess entries are evicted."""
+    def __init__(self, ttl_seconds: float = SESSION_TTL_SECONDS, max_entries: int = MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def prune(self):
+        now = time.monotonic()
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or now - next(iter(self._entries.values()))[0] > self.ttl_seconds):
+            self._entries.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.prune()
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._entries[key] = (time.monotonic(), entry[1])
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def __setitem__(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        self.prune()
+
+    def setdefault(self, key: str, default: Any) -> Any:
+        value = self.get(key)
+        if value is None:
+            self[key] = value = default
+        return value
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Rolling SBAR drafts for conversations in progress, keyed by conversation_id
+rolling_summaries = SessionCache()
+
+
+class TriageSession:
+    """Server-side state of a WebSocket conversation."""
+    def __init__(self, model: str, speculative_summary: bool):
+        self.agent = TriageAgent(model=model)
+        self.summarizer = SummarizationAgent(model=model)
+        self.rolling = RollingSummary()
+        self.messages: List[Dict[str, str]] = []
+        self.speculative_summary = speculative_summary
 
-app = FastAPI()
+# /summarize jobs by Idempotency-Key, so a retried request attaches to the running job
+SUMMARY_JOB_TTL_SECONDS = 600
+summary_jobs: Dict[str, asyncio.Task] = {}
+summary_job_started: Dict[str, float] = {}
+
+
+def prune_summary_jobs():
+    """Forget finished jobs older than SUMMARY_JOB_TTL_SECONDS."""
+    now = time.monotonic()
+    for key in [k for k, started in summary_job_started.items() if now - started > SUMMARY_JOB_TTL_SECONDS]:
+        if summary_jobs[key].done():
+            summary_jobs.pop(key)
+            summary_job_started.pop(key)
+
+# WebSocket conversations in progress, keyed by conversation_id so a dropped connection can resume
+triage_sessions = SessionCache()
+
+
+def checkpoint_summary(agent: TriageAgent, summarizer: SummarizationAgent, rolling: RollingSummary,
+                       message_dicts: List[Dict], speculative_summary: bool):
+    """Start background SBAR work after the agent has picked its next question."""
+    # Checkpoint the rolling summary in the background whenever a question block ends
+    block = get_question_block(agent.current_state)
+    if rolling.block and block != rolling.block:
+        summarizer.schedule_rolling_update(rolling, message_dicts)
+    rolling.block = block
+
+    # Speculatively summarise once only the last few questions remain
+    if speculative_summary:
+        summarizer.check_speculation(rolling, message_dicts)
+        if agent.current_state in SPECULATIVE_SUMMARY_STATES:
+            summarizer.start_speculative_summary(rolling, message_dicts)
 
 @app.get("/")
 def read_root():
@@ -35,29 +250,268 @@ async def ask_llm(request: PromptRequest):
     
     try:
         response_text = await agent.get_next_response(message_dicts)
-        return {"response": response_text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
 
+    if request.conversation_id:
+        rolling = rolling_summaries.setdefault(request.conversation_id, RollingSummary())
+        checkpoint_summary(agent, SummarizationAgent(model=request.model), rolling,
+                           message_dicts, request.speculative_summary)
+
+    return {"response": response_text}
+
 # --- ADD THIS NEW ENDPOINT ---
 @app.post("/summarize")
-async def summarize_conversation(request: PromptRequest):
+async def summarize_conversation(request: PromptRequest,
+                                 idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
     This endpoint takes the final conversation and generates the summary.
+    Requests sharing an Idempotency-Key get the result of the first one.
     """
     agent = SummarizationAgent(model=request.model)
     message_dicts = [msg.dict() for msg in request.messages]
-    
+
+    async def run():
+        rolling = rolling_summaries.pop(request.conversation_id, None) if request.conversation_id else None
+        summary = await agent.summarize_and_triage_structured(message_dicts, rolling)
+        speculate_referral_letter(request.model, summary, message_dicts)
+        result = summary_payload(summary)
+        if rolling is not None and request.speculative_summary:
+            result["speculation_saved_seconds"] = round(rolling.saved_seconds, 3)
+        return result
+
+    prune_summary_jobs()
+    if idempotency_key is None:
+        job = asyncio.ensure_future(run())
+    else:
+        job = summary_jobs.get(idempotency_key)
+        if job is None or (job.done() and job.exception() is not None):
+            job = asyncio.ensure_future(run())
+            summary_jobs[idempotency_key] = job
+            summary_job_started[idempotency_key] = time.monotonic()
+
     try:
-        summary_text = await agent.summarize_and_triage(message_dicts)
-        return {"response": summary_text}
+        # A dropped client must not cancel a job that a retry may attach to
+        return await asyncio.shield(job)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
 
+@app.post("/summarize/batch")
+async def summarize_batch(request: BatchSummarizeRequest):
+    """
+    Summarise many transcripts, streaming one NDJSON line per transcript as each completes
+    and a final {"type": "done"} line. Resume an interrupted run by passing the ids
+    already received as skip_ids.
+    """
+    skip = set(request.skip_ids)
+    pending = [t for t in request.transcripts if t.id not in skip]
+    concurrency = request.concurrency or get_llm_pool().sustainable_concurrency()
+    queue: asyncio.Queue = asyncio.Queue()
+    for transcript in pending:
+        queue.put_nowait(transcript)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def worker():
+        agent = SummarizationAgent(model=request.model)
+        while not queue.empty():
+            transcript = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                summary = await agent.summarize_and_triage_structured([msg.model_dump() for msg in transcript.messages])
+                line = {"type": "result", "id": transcript.id, "status": "ok", **summary_payload(summary)}
+            except Exception as e:
+                line = {"type": "result", "id": transcript.id, "status": "error", "detail": str(e)}
+            line["seconds"] = round(time.perf_counter() - started, 3)
+            await results.put(line)
+
+    async def stream():
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(pending)) or 1)]
+        counts = {"ok": 0, "error": 0, "degraded": 0}
+        try:
+            for _ in pending:
+                line = await results.get()
+                counts[line["status"]] += 1
+                counts["degraded"] += int(bool(line.get("degraded")))
+                yield json.dumps(line) + "\n"
+            yield json.dumps({"type": "done", "processed": len(pending), "skipped": len(request.transcripts) - len(pending),
+                              "concurrency": concurrency, **counts}) + "\n"
+        finally:
+            # Stop scheduling work if the client went away
+            for task in workers:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/referral-letter")
+async def referral_letter(request: ReferralLetterRequest):
+    """
+    Referral letter for a finished summary. Letters are stored once generated, and the
+    primary letter is started in the background when the summary completes, so this
+    usually returns a stored letter or joins the generation already running.
+    """
+    agent = ReferralLetterAgent(model=request.model)
+    classification = TriageClassification.model_validate(request.classification) if request.classification else None
+    triage_decision = request.triage_decision or (classification.decision() if classification else "")
+    referral_type = request.referral_type or agent._determine_referral_type(triage_decision, request.clinical_summary,
+                                                                            classification)
+    hits = agent.store.hits
+    letter = await agent.generate_referral_letter(request.clinical_summary, triage_decision,
+                                                  [msg.model_dump() for msg in request.messages], referral_type,
+                                                  classification)
+    if letter.startswith("Error:"):
+        raise HTTPException(status_code=503, detail=letter)
+    return {"referral_type": referral_type, "letter": letter, "cached": agent.store.hits > hits}
+
+@app.post("/similar-cases")
+async def similar_cases(request: SimilarCasesRequest):
+    """The k most similar past conversations and the pathway each was referred to."""
+    # Catching up the index and scoring are CPU and disk work, kept off the event loop
+    cases = await asyncio.to_thread(find_similar_cases, [msg.model_dump() for msg in request.messages], request.k,
+                                    request.exclude_conversation_id)
+    return {"cases": cases}
+
+@app.get("/stats/letters")
+def letter_stats():
+    """Referral letter store size and hit rate."""
+    return get_letter_store().stats()
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    started = startup_state["started_at"]
+    return {"status": "ok", "uptime_seconds": round(time.monotonic() - started, 1) if started else None}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: caches primed, every served model warm on a healthy backend, and the queue short enough."""
+    pool = get_llm_pool()
+    if pool.last_health_check is None or time.monotonic() - pool.last_health_check >= pool.health_interval:
+        await pool.check_health()  # /api/ps shows which models are actually resident
+    llm = pool.readiness(served_models(DEFAULT_MODEL))
+    summaries_running = sum(1 for job in summary_jobs.values() if not job.done())
+    breaker = pool.breaker.stats()["state"]
+    ready = (startup_state["caches_primed"] and llm["all_warm"] and breaker != "open"
+             and llm["queue_depth"] <= READY_MAX_QUEUE_DEPTH)
+    body = {
+        "ready": ready,
+        "caches_primed": startup_state["caches_primed"],
+        "llm_warm": llm["all_warm"],
+        "models": llm["models"],
+        "queue_depth": llm["queue_depth"],
+        "max_queue_depth": READY_MAX_QUEUE_DEPTH,
+        "summaries_running": summaries_running,
+        "circuit_breaker": breaker,
+        "warm_up": startup_state["warm_up"],
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/stats/speculation")
+def speculation_stats():
+    """Totals for speculative summarisation, including wall-clock saved."""
+    stats = dict(SPECULATION_STATS)
+    stats["mean_saved_seconds"] = stats["saved_seconds"] / stats["used"] if stats["used"] else 0.0
+    return stats
+
+@app.get("/stats/log-sink")
+def log_sink_stats():
+    """Queue depth, drops, blocking and write timings of the background log writer."""
+    return get_log_sink().stats()
+
+@app.get("/stats/llm")
+def llm_stats():
+    """Routing state of each Ollama backend, hedging and coalescing counters and the circuit breaker."""
+    pool = get_llm_pool()
+    return {
+        "strategy": pool.strategy,
+        "backends": pool.stats(),
+        "hedging": {"enabled": pool.hedging, "stages": pool.hedge_stats},
+        "coalesced": pool.coalesced,
+        "circuit_breaker": pool.breaker.stats(),
+        "cassette": pool.cassette.stats() if pool.cassette else None,
+    }
+
+@app.websocket("/ws/triage")
+async def triage_websocket(websocket: WebSocket, conversation_id: Optional[str] = None,
+                           model: str = "llama3.1:8b", speculative_summary: bool = False):
+    """
+    One connection per conversation. The client sends {"type": "message", "content": ...}
+    for each patient turn; the server replies {"type": "question", ...} and, once the
+    interview is complete, streams {"type": "summary_token", ...} then {"type": "summary_done", ...}.
+    """
+    await websocket.accept()
+    conversation_id = conversation_id or str(uuid.uuid4())
+    session = triage_sessions.get(conversation_id)
+    if session is None:
+        session = TriageSession(model, speculative_summary)
+        triage_sessions[conversation_id] = session
+
+    async def ask():
+        response_text = await session.agent.get_next_response(session.messages)
+        session.messages.append({"role": "assistant", "content": response_text})
+        await websocket.send_json({
+            "type": "question",
+            "conversation_id": conversation_id,
+            "state": session.agent.current_state,
+            "content": response_text,
+        })
+
+    try:
+        # Greet a new conversation, or repeat the last question to a resumed one
+        if session.messages:
+            await websocket.send_json({"type": "question", "conversation_id": conversation_id,
+                                       "state": session.agent.current_state,
+                                       "content": session.messages[-1]["content"]})
+        else:
+            await ask()
+
+        while True:
+            data = await websocket.receive_json()
+            if data.get("type") != "message" or not str(data.get("content", "")).strip():
+                await websocket.send_json({"type": "error", "detail": "Expected {\"type\": \"message\", \"content\": ...}"})
+                continue
+
+            session.messages.append({"role": "user", "content": data["content"]})
+            try:
+                await ask()
+            except Exception as e:
+                await websocket.send_json({"type": "error", "detail": f"An internal error occurred: {e}"})
+                continue
+
+            if session.agent.current_state != TriageState.COMPLETE:
+                checkpoint_summary(session.agent, session.summarizer, session.rolling,
+                                   list(session.messages), session.speculative_summary)
+                continue
+
+            parts = []
+            structured: Dict = {}
+            async for chunk in session.summarizer.stream_summarize_and_triage(session.messages, session.rolling,
+                                                                              structured):
+                parts.append(chunk)
+                await websocket.send_json({"type": "summary_token", "content": chunk})
+            result = {"type": "summary_done", "content": "".join(parts)}
+            for key in ("differential", "classification"):
+                result[key] = structured[key].model_dump() if structured.get(key) else None
+            result["degraded"] = structured["degraded"]
+            speculate_referral_letter(model, {"text": result["content"], **structured}, list(session.messages))
+            if CONVERSATION_EVENT_LOG:
+                # Never waits for the disk; a full queue drops the line and counts it
+                get_log_sink().submit(CONVERSATION_EVENT_LOG, json.dumps({
+                    "conversation_id": conversation_id, "completed_at": time.time(), "messages": session.messages,
+                    "classification": result["classification"], "degraded": result["degraded"]}) + "\n")
+            if session.speculative_summary:
+                result["speculation_saved_seconds"] = round(session.rolling.saved_seconds, 3)
+            await websocket.send_json(result)
+            triage_sessions.pop(conversation_id, None)
+            await websocket.close()
+            return
+    except WebSocketDisconnect:
+        # Keep the session so the client can reconnect with the same conversation_id
+        pass
+
 # --- ADD THIS MAIN BLOCK FOR NETWORK ACCESS ---
 if __name__ == "__main__":
     uvicorn.run(
-        "main:app",
+        "app.main:app",
         host="0.0.0.0",  # Bind to all network interfaces
         port=8000,
         reload=True,
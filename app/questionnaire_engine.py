@@ -141,6 +141,174 @@ def apply_aggregate(rule: Dict[str, Any], input_obj: Dict[str, Any],
                             reasons.setdefault(dx, []).append(('Total knee score aggregate', pts))
 
 
+# Scoring blocks applied by the engine, in order
+SCORING_BLOCKS = ['mechanism', 'onset_mechanism', 'symptoms', 'oa_index', 'knee_score',
+                  'symptoms_from_text', 'exam', 'imaging']
+
+
+def score_diagnoses(spec: Dict[str, Any], input_obj: Dict[str, Any]) -> Tuple[Dict[str, int], Dict[str, List[Tuple[str, int]]]]:
+    """Apply the spec's scoring blocks and return raw scores and reasons per diagnosis."""
+    dx_codes = spec['diagnoses']
+    scores = {dx: 0 for dx in dx_codes}
+    reasons: Dict[str, List[Tuple[str, int]]] = {}
+    
+    blocks = spec.get('scoring', {})
+    
+    # Apply scoring in order: mechanism, symptoms, oa_index, exam, imaging
+    for block_name in SCORING_BLOCKS:
+        for rule in blocks.get(block_name, []):
+            when = rule.get('when', {})
+            
+            # Handle special cases for aggregate rules
+            if 'aggregate' in rule:
+                if get_by_path(input_obj, 'oa_index') is not None or get_by_path(input_obj, 'knee_score') is not None:
+                    apply_aggregate(rule, input_obj, scores, reasons)
+            else:
+                if condition_match(input_obj, when):
+                    if 'add' in rule:
+                        add_points(scores, reasons, rule['add'], f"{block_name}:{when}")
+                    if 'add_all' in rule:
+                        addmap = {dx: int(rule['add_all']) for dx in dx_codes}
+                        add_points(scores, reasons, addmap, f"{block_name}:{when}")
+    
+    return scores, reasons
+
+
+# --- Compiled Rules ---
+# Point-scoring rules indexed by the input fields they test, so the triage agent can
+# ask which unanswered field would move the ranking most. Compiled once per spec.
+_COMPILED_RULES: Dict[int, Tuple[Dict[str, Any], Dict[str, List[Dict[str, Any]]]]] = {}
+
+
+def compile_scoring_rules(spec: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Index the spec's non-aggregate scoring rules by field, with their point weights."""
+    cached = _COMPILED_RULES.get(id(spec))
+    if cached is not None and cached[0] is spec:
+        return cached[1]
+    
+    index: Dict[str, List[Dict[str, Any]]] = {}
+    blocks = spec.get('scoring', {})
+    for block_name in SCORING_BLOCKS:
+        for rule in blocks.get(block_name, []):
+            if 'aggregate' in rule:
+                continue  # Aggregates score a whole form, not a single answer
+            addmap = {dx: int(pts) for dx, pts in rule.get('add', {}).items()}
+            if 'add_all' in rule:
+                addmap = {dx: int(rule['add_all']) for dx in spec['diagnoses']}
+            compiled = {'block': block_name, 'when': rule.get('when', {}), 'add': addmap}
+            for field in compiled['when']:
+                index.setdefault(field, []).append(compiled)
+    
+    _COMPILED_RULES[id(spec)] = (spec, index)
+    return index
+
+
+def _candidate_values(field: str, rules: List[Dict[str, Any]]) -> List[Any]:
+    """Answers for a field that some rule tests for."""
+    values = []
+    for rule in rules:
+        expected = rule['when'][field]
+        options = expected if isinstance(expected, list) else [expected]
+        for option in options:
+            if isinstance(option, str) and option.startswith(('>', '<', '=')):
+                continue  # Numeric thresholds are not categorical answers
+            if option not in values:
+                values.append(option)
+    return values
+
+
+def _with_answer(input_obj: Dict[str, Any], field: str, value: Any) -> Dict[str, Any]:
+    """Copy of input_obj with one field answered (phenotype answers are appended)."""
+    trial = deepcopy(input_obj)
+    parts = field.split('.')
+    cur = trial
+    for part in parts[:-1]:
+        if not isinstance(cur.get(part), dict):
+            cur[part] = {}
+        cur = cur[part]
+    if field == 'phenotype':
+        cur[parts[-1]] = list(cur.get(parts[-1]) or []) + [value]
+    else:
+        cur[parts[-1]] = value
+    return trial
+
+
+def field_answer_deltas(spec: Dict[str, Any], input_obj: Dict[str, Any], field: str) -> List[Dict[str, int]]:
+    """Points each possible answer to `field` would add, given the rest of the current input."""
+    rules = compile_scoring_rules(spec).get(field, [])
+    deltas = []
+    for value in _candidate_values(field, rules):
+        trial = _with_answer(input_obj, field, value)
+        delta: Dict[str, int] = {}
+        for rule in rules:
+            if condition_match(trial, rule['when']) and not condition_match(input_obj, rule['when']):
+                for dx, pts in rule['add'].items():
+                    delta[dx] = delta.get(dx, 0) + pts
+        deltas.append(delta)
+    return deltas
+
+
+def expected_discrimination(spec: Dict[str, Any], input_obj: Dict[str, Any], field: str,
+                            scores: Dict[str, int]) -> float:
+    """
+    Expected separation between diagnoses from answering `field`.
+    
+    Each possible answer (plus one that matches no rule) is weighted equally. An answer
+    counts the spread of points it adds across diagnoses, doubled if it changes the leader.
+    """
+    deltas = field_answer_deltas(spec, input_obj, field)
+    if not deltas or not scores:
+        return 0.0
+    
+    top = max(scores, key=scores.get)
+    total = 0.0
+    for delta in deltas:
+        spread = max(max(delta.values(), default=0), 0) - min(min(delta.values(), default=0), 0)
+        new_scores = {dx: sc + delta.get(dx, 0) for dx, sc in scores.items()}
+        if max(new_scores, key=new_scores.get) != top:
+            spread *= 2
+        total += spread
+    return total / (len(deltas) + 1)
+
+
+def top_diagnosis_locked(spec: Dict[str, Any], input_obj: Dict[str, Any], scores: Dict[str, int],
+                         open_fields: List[str]) -> bool:
+    """
+    True if no combination of answers to open_fields can change the leading diagnosis.
+    
+    Every rule that tests an open field and is not ruled out by the known answers is
+    assumed to fire (or not) in the worst case, so the bound is conservative.
+    """
+    if not scores:
+        return False
+    top = max(scores, key=scores.get)
+    if scores[top] <= 0:
+        return False
+    
+    compiled = compile_scoring_rules(spec)
+    open_set = set(open_fields)
+    gain = {dx: 0 for dx in scores}
+    loss = {dx: 0 for dx in scores}
+    seen = set()
+    for field in open_set:
+        for rule in compiled.get(field, []):
+            if id(rule) in seen:
+                continue
+            seen.add(id(rule))
+            known = {k: v for k, v in rule['when'].items() if k not in open_set}
+            if not condition_match(input_obj, known) or condition_match(input_obj, rule['when']):
+                continue  # Cannot fire, or already counted in the current scores
+            for dx, pts in rule['add'].items():
+                if dx in scores:
+                    if pts > 0:
+                        gain[dx] += pts
+                    else:
+                        loss[dx] += pts
+    
+    floor = scores[top] + loss[top]
+    return all(floor > scores[dx] + gain[dx] for dx in scores if dx != top)
+
+
 def run_questionnaire_engine(spec: Dict[str, Any], input_obj: Dict[str, Any]) -> Dict[str, Any]:
     """
     Run the questionnaire evaluation engine.
@@ -164,31 +332,8 @@ def run_questionnaire_engine(spec: Dict[str, Any], input_obj: Dict[str, Any]) ->
                 'message': 'Urgent same-day assessment recommended.'
             }
     
-    # 2. Initialize scores
-    dx_codes = spec['diagnoses']
-    scores = {dx: 0 for dx in dx_codes}
-    reasons: Dict[str, List[Tuple[str, int]]] = {}
-    
-    # 3. Apply scoring blocks
-    blocks = spec.get('scoring', {})
-    
-    # Apply scoring in order: mechanism, symptoms, oa_index, exam, imaging
-    for block_name in ['mechanism', 'onset_mechanism', 'symptoms', 'oa_index', 'knee_score', 
-                      'symptoms_from_text', 'exam', 'imaging']:
-        for rule in blocks.get(block_name, []):
-            when = rule.get('when', {})
-            
-            # Handle special cases for aggregate rules
-            if 'aggregate' in rule:
-                if get_by_path(input_obj, 'oa_index') is not None or get_by_path(input_obj, 'knee_score') is not None:
-                    apply_aggregate(rule, input_obj, scores, reasons)
-            else:
-                if condition_match(input_obj, when):
-                    if 'add' in rule:
-                        add_points(scores, reasons, rule['add'], f"{block_name}:{when}")
-                    if 'add_all' in rule:
-                        addmap = {dx: int(rule['add_all']) for dx in dx_codes}
-                        add_points(scores, reasons, addmap, f"{block_name}:{when}")
+    # 2-3. Score every diagnosis
+    scores, reasons = score_diagnoses(spec, input_obj)
     
     # 4. Rank results
     ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
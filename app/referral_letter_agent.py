@@ -1,17 +1,28 @@
-import httpx
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Optional
 from .questionnaire_engine import run_questionnaire_engine, get_diagnosis_display_name
 from .questionnaire_specs import get_questionnaire_form
 from .triage_agent import TriageAgent
+from .llm_client import get_llm_pool
+from .generation_profiles import get_generation_profile, referral_letter_stage
+from .transcript_compaction import compact_transcript
+from .letter_store import get_letter_store, letter_key
+from .letter_renderer import clinical_sections_prompt, letter_facts, llm_sections, parse_sections, render_letter
+from .triage_schemas import TriageClassification
+
+# Background letter generations, kept referenced until they finish
+speculative_letter_tasks = set()
 
 class ReferralLetterAgent:
     """
     Generates detailed referral letters for various specialties (SWLEOC, Physio, GP, etc.)
     based on clinical summaries and triage decisions.
     """
-    def __init__(self, model: str = "llama3.1:8b"):
+    def __init__(self, model: str = "llama3.1:8b", templated: bool = True):
         self.model = model
-        self.ollama_api_url = "http://localhost:11434/api/generate"
+        self.llm = get_llm_pool()
+        self.store = get_letter_store()
+        self.templated = templated  # False has the LLM write the whole letter from the templates below
         
         # Prompt for SWLEOC referral letter
         self.swleoc_referral_prompt_template = """You are an Orthopaedic Triage Clinician writing a detailed referral letter to SWLEOC (South West London Elective Orthopaedic Centre).
@@ -208,8 +219,13 @@ MSK Triage Service
         triage_agent = TriageAgent()
         return triage_agent._extract_patient_data(messages)
 
-    def _determine_referral_type(self, triage_decision: str, clinical_summary: str) -> str:
+    def _determine_referral_type(self, triage_decision: str, clinical_summary: str,
+                                 classification: Optional[TriageClassification] = None) -> str:
         """Determine the most appropriate referral type based on triage decision and clinical summary."""
+        # A validated classification carries the referral type; text scanning is only for free-text decisions
+        if classification is not None:
+            return classification.referral_type
+        
         triage_lower = triage_decision.lower()
         summary_lower = clinical_summary.lower()
         
@@ -238,78 +254,101 @@ MSK Triage Service
             return "gp"
 
     async def generate_referral_letter(self, clinical_summary: str, triage_decision: str, 
-                                     conversation_messages: List[Dict], referral_type: str = None) -> str:
+                                     conversation_messages: List[Dict], referral_type: str = None,
+                                     classification: Optional[TriageClassification] = None) -> str:
         """Generate a detailed referral letter based on the clinical summary and triage decision."""
         
         # Determine referral type if not specified
         if not referral_type:
-            referral_type = self._determine_referral_type(triage_decision, clinical_summary)
+            referral_type = self._determine_referral_type(triage_decision, clinical_summary, classification)
         
         # Extract patient data for additional context
         patient_data = self._extract_patient_data_from_conversation(conversation_messages)
         
-        # Create conversation excerpt (last 10 messages for context)
-        conversation_excerpt = "\n".join([
-            f"{msg['role'].upper()}: {msg['content']}" 
-            for msg in conversation_messages[-10:]
-        ])
-        
         # Select appropriate prompt template
         if referral_type == "swleoc":
-            prompt_template = self.swleoc_referral_prompt_template
+            letter_type, prompt_template = "swleoc", self.swleoc_referral_prompt_template
         elif referral_type == "physio":
-            prompt_template = self.physio_referral_prompt_template
+            letter_type, prompt_template = "physio", self.physio_referral_prompt_template
         elif referral_type == "gp":
-            prompt_template = self.gp_referral_prompt_template
+            letter_type, prompt_template = "gp", self.gp_referral_prompt_template
         else:
             # Default to SWLEOC for complex cases
-            prompt_template = self.swleoc_referral_prompt_template
+            letter_type, prompt_template = "swleoc", self.swleoc_referral_prompt_template
         
-        # Format the prompt
-        full_prompt = prompt_template.format(
-            clinical_summary=clinical_summary,
-            triage_decision=triage_decision,
-            conversation_excerpt=conversation_excerpt
-        )
+        stage = referral_letter_stage(letter_type)
+        profile = get_generation_profile(stage)
+        
+        # Most relevant exchanges that fit the letter's transcript budget
+        conversation_excerpt = compact_transcript(conversation_messages, profile.transcript_tokens)["text"]
+        
+        # Format the prompt; templated letters only ask for the clinical reasoning sections
+        if self.templated:
+            full_prompt = clinical_sections_prompt(letter_type, clinical_summary, triage_decision, conversation_excerpt)
+        else:
+            full_prompt = prompt_template.format(
+                clinical_summary=clinical_summary,
+                triage_decision=triage_decision,
+                conversation_excerpt=conversation_excerpt
+            )
+        
+        model = profile.model_for(self.model)
+        key = letter_key(letter_type, model, full_prompt, profile.options())
+        generated = self.store.get(key)
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    self.ollama_api_url,
-                    json={"model": self.model, "prompt": full_prompt, "stream": False},
-                )
-                response.raise_for_status()
-                ollama_response = response.json()
-                result = ollama_response.get("response", "Could not generate referral letter.").strip()
-                return result
+            if generated is None:
+                # A request for a letter still being generated speculatively joins that generation in the pool
+                result = await self.llm.generate(model, full_prompt, timeout=60.0, stage=stage,
+                                                 options=profile.options(), keep_alive=profile.keep_alive)
+                generated = result.strip()
+                if not generated:
+                    return "Could not generate referral letter."
+                self.store.put(key, generated, letter_type, clinical_summary)
+            if not self.templated:
+                return generated
+            # The deterministic sections are cheap to fill, so only the model's sections are stored
+            facts = letter_facts(conversation_messages, patient_data, classification)
+            return render_letter(letter_type, facts, parse_sections(generated, llm_sections(letter_type)))
         except Exception as e:
             print(f"Error during referral letter generation: {e}")
             print(f"Error type: {type(e)}")
             return f"Error: Could not generate referral letter. Error: {str(e)}"
 
     async def generate_all_referral_letters(self, clinical_summary: str, triage_decision: str, 
-                                          conversation_messages: List[Dict]) -> Dict[str, str]:
+                                          conversation_messages: List[Dict],
+                                          classification: Optional[TriageClassification] = None) -> Dict[str, str]:
         """Generate referral letters for all appropriate specialties."""
         referrals = {}
         
         # Determine primary referral type
-        primary_type = self._determine_referral_type(triage_decision, clinical_summary)
+        primary_type = self._determine_referral_type(triage_decision, clinical_summary, classification)
         
         # Generate primary referral
         referrals[primary_type] = await self.generate_referral_letter(
-            clinical_summary, triage_decision, conversation_messages, primary_type
+            clinical_summary, triage_decision, conversation_messages, primary_type, classification=classification
         )
         
         # Generate additional referrals if appropriate
         if primary_type == "swleoc":
             # Also generate physio referral for pre/post-op care
             referrals["physio"] = await self.generate_referral_letter(
-                clinical_summary, triage_decision, conversation_messages, "physio"
+                clinical_summary, triage_decision, conversation_messages, "physio", classification=classification
             )
         elif primary_type == "physio":
             # Also generate GP referral for ongoing management
             referrals["gp"] = await self.generate_referral_letter(
-                clinical_summary, triage_decision, conversation_messages, "gp"
+                clinical_summary, triage_decision, conversation_messages, "gp", classification=classification
             )
         
         return referrals
+
+    def start_speculative_letter(self, clinical_summary: str, triage_decision: str,
+                                 conversation_messages: List[Dict],
+                                 classification: Optional[TriageClassification] = None) -> asyncio.Task:
+        """Generate the primary referral letter in the background so it is stored before anyone asks."""
+        task = asyncio.create_task(self.generate_referral_letter(
+            clinical_summary, triage_decision, conversation_messages, classification=classification))
+        speculative_letter_tasks.add(task)
+        task.add_done_callback(speculative_letter_tasks.discard)
+        return task
@@ -0,0 +1,264 @@
+"""
+Similar-case retrieval over past conversations.
+
+Each stored conversation (the patient's turns and its summary) becomes a sparse
+vector of hashed unigrams and bigrams, tokenised like the triage guardrails; a
+negated token ("no fever") is a different feature from the affirmed one. Vectors
+are weighted by TF-IDF at query time, so conversations can be appended without
+re-weighting the ones already indexed, and a batch of queries is scored against
+every conversation with one vectorised cosine similarity per block of rows.
+
+With a path the index is a directory of flat arrays (CSR rows, document
+frequencies and ids) that are appended to and memory-mapped, so it is shared
+between processes and loads without reading everything into memory.
+
+The index lives at SIMILAR_CASE_INDEX (default similar_cases_index/) and catches
+up with the conversation store before each lookup, reading only the conversations
+recorded since the last one it indexed. Lookups run in worker threads, so adding
+and syncing are serialised by a lock.
+"""
+
+import os
+import threading
+import weakref
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .conversation_store import ConversationStore, get_conversation_store
+from .triage_guardrails import tokenize, negated_positions
+
+FEATURES = 2 ** 18
+# Conversations scored per block, bounding the temporary (queries x block nonzeros) array
+DOC_BLOCK = 4096
+
+
+def hashed_features(text: str, features: int = FEATURES) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted feature indices and sublinear term frequencies (1 + log tf) of a text."""
+    tokens = tokenize(text)
+    negated = negated_positions(tokens)
+    tokens = [("!" + token) if i in negated else token for i, token in enumerate(tokens)]
+    counts: Dict[int, int] = {}
+    for term in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        feature = zlib.crc32(term.encode()) % features
+        counts[feature] = counts.get(feature, 0) + 1
+    indices = np.array(sorted(counts), dtype=np.int32)
+    values = 1.0 + np.log(np.array([counts[i] for i in indices], dtype=np.float32))
+    return indices, values.astype(np.float32)
+
+
+def case_text(messages: List[Dict], summary: Optional[str] = None) -> str:
+    """What a conversation is compared on: the patient's turns and, once there is one, the summary."""
+    parts = [msg["content"] for msg in messages if msg["role"] == "user"]
+    if summary:
+        parts.append(summary)
+    return "\n".join(parts)
+
+
+class SimilarCaseIndex:
+    """Append-only TF-IDF index of conversations, in memory or memory-mapped from a directory."""
+    def __init__(self, path: Optional[str] = None, features: int = FEATURES):
+        self.path = path
+        self.features = features
+        self.ids: List[str] = []
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.data = np.zeros(0, dtype=np.float32)
+        self.df = np.zeros(features, dtype=np.float32)
+        self._norms: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+        # Last conversation store rowid indexed, per store
+        self._synced: "weakref.WeakKeyDictionary[ConversationStore, int]" = weakref.WeakKeyDictionary()
+        if path:
+            self._open()
+
+    # --- Files ---
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _map(self, name: str, dtype) -> np.ndarray:
+        if os.path.getsize(self._file(name)) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r")
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        if not os.path.exists(self._file("ids.txt")):
+            np.zeros(1, dtype=np.int64).tofile(self._file("indptr.i64"))
+            np.zeros(self.features, dtype=np.float32).tofile(self._file("df.f32"))
+            for name in ("indices.i32", "data.f32", "ids.txt"):
+                open(self._file(name), "wb").close()
+        if os.path.getsize(self._file("df.f32")) != self.features * 4:
+            raise ValueError(f"{self.path} was built with a different number of features")
+        with open(self._file("ids.txt"), "r", encoding="utf-8") as f:
+            self.ids = f.read().split()
+        self.indptr = self._map("indptr.i64", np.int64)
+        self.indices = self._map("indices.i32", np.int32)
+        self.data = self._map("data.f32", np.float32)
+        self.df = np.memmap(self._file("df.f32"), dtype=np.float32, mode="r+")
+
+    # --- Additions ---
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, items: Iterable[Tuple[str, str]]) -> int:
+        """Index (conversation id, text) pairs not already indexed; returns how many were added."""
+        with self._lock:
+            return self._add(items)
+
+    def _add(self, items: Iterable[Tuple[str, str]]) -> int:
+        known = set(self.ids)
+        ids, rows = [], []
+        for conversation_id, text in items:
+            indices, values = hashed_features(text, self.features)
+            if conversation_id in known or not len(indices):
+                continue
+            known.add(conversation_id)
+            ids.append(conversation_id)
+            rows.append((indices, values))
+        if not rows:
+            return 0
+
+        indices = np.concatenate([row[0] for row in rows])
+        data = np.concatenate([row[1] for row in rows])
+        ends = self.indptr[-1] + np.cumsum([len(row[0]) for row in rows], dtype=np.int64)
+        np.add.at(self.df, indices, 1)
+        if self.path:
+            # Rows are appended to the files and the maps re-opened; ids.txt last, so a partial write is ignored
+            for name, array in (("indices.i32", indices), ("data.f32", data), ("indptr.i64", ends)):
+                with open(self._file(name), "ab") as f:
+                    f.write(array.tobytes())
+            self.df.flush()
+            with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{conversation_id}\n" for conversation_id in ids))
+            self._open()
+        else:
+            self.ids.extend(ids)
+            self.indptr = np.concatenate([self.indptr, ends])
+            self.indices = np.concatenate([self.indices, indices])
+            self.data = np.concatenate([self.data, data])
+        self._norms = None
+        return len(rows)
+
+    def sync(self, store: ConversationStore) -> int:
+        """Add the conversations recorded in the store since the last sync (all of them the first time)."""
+        with self._lock:
+            rows = store.recorded_after(self._synced.get(store, 0))
+            if not rows:
+                return 0
+            known = set(self.ids)
+            added = self._add((conversation_id, case_text(store.messages(conversation_id), summary))
+                              for _, conversation_id, summary in rows if conversation_id not in known)
+            self._synced[store] = rows[-1][0]
+            return added
+
+    # --- Queries ---
+    def _idf(self) -> np.ndarray:
+        return (np.log((1.0 + len(self.ids)) / (1.0 + self.df)) + 1.0).astype(np.float32)
+
+    def query(self, texts: List[str], k: int = 5, exclude: Optional[Set[str]] = None) -> List[List[Tuple[str, float]]]:
+        """The k most similar conversations to each text, as (id, cosine similarity), best first."""
+        with self._lock:
+            n = len(self.ids)
+            if n == 0 or not texts:
+                return [[] for _ in texts]
+            indptr = np.asarray(self.indptr[:n + 1])
+            idf = self._idf()
+            weights = self.data[:indptr[-1]] * idf[self.indices[:indptr[-1]]]
+            if self._norms is None or len(self._norms) != n:
+                self._norms = np.sqrt(np.add.reduceat(weights ** 2, indptr[:-1]))
+
+            queries = np.zeros((len(texts), self.features), dtype=np.float32)
+            for row, text in enumerate(texts):
+                indices, values = hashed_features(text, self.features)
+                queries[row, indices] = values * idf[indices]
+            query_norms = np.linalg.norm(queries, axis=1)
+            query_norms[query_norms == 0] = 1.0
+
+            scores = np.empty((len(texts), n), dtype=np.float32)
+            for start in range(0, n, DOC_BLOCK):
+                end = min(n, start + DOC_BLOCK)
+                lo, hi = indptr[start], indptr[end]
+                products = queries[:, self.indices[lo:hi]] * weights[lo:hi]
+                scores[:, start:end] = np.add.reduceat(products, indptr[start:end] - lo, axis=1)
+            scores /= self._norms * query_norms[:, None]
+            if exclude:
+                for position, conversation_id in enumerate(self.ids):
+                    if conversation_id in exclude:
+                        scores[:, position] = -np.inf
+
+            k = min(k, n)
+            results = []
+            for row in scores:
+                top = np.argpartition(-row, k - 1)[:k]
+                top = top[np.argsort(-row[top])]
+                results.append([(self.ids[i], float(row[i])) for i in top if np.isfinite(row[i]) and row[i] > 0])
+            return results
+
+
+# --- Lookups ---
+def find_similar_cases(messages: List[Dict], k: int = 5, exclude_id: Optional[str] = None,
+                       index: Optional["SimilarCaseIndex"] = None,
+                       store: Optional[ConversationStore] = None) -> List[Dict[str, Any]]:
+    """The k most similar stored conversations to a transcript, with the pathway each was routed to."""
+    return similar_cases_for_text(case_text(messages), k, exclude_id, index, store)
+
+
+def similar_cases_for_text(text: str, k: int = 5, exclude_id: Optional[str] = None,
+                           index: Optional["SimilarCaseIndex"] = None,
+                           store: Optional[ConversationStore] = None) -> List[Dict[str, Any]]:
+    store = store or get_conversation_store()
+    index = index or get_similar_case_index()
+    index.sync(store)
+    cases = []
+    for conversation_id, score in index.query([text], k, {exclude_id} if exclude_id else None)[0]:
+        record = store.get(conversation_id, with_messages=False)
+        if record is None:
+            continue
+        complaint = (record["metadata"] or {}).get("presenting_complaint") or next(
+            (msg["content"] for msg in store.messages(conversation_id) if msg["role"] == "user"), None)
+        cases.append({
+            "conversation_id": conversation_id,
+            "similarity": round(score, 4),
+            "case_id": record["case_id"],
+            "title": record["title"],
+            "started_at": record["started_at"],
+            "pathway": record["pathway"],
+            "referral_type": record["referral_type"],
+            "expected_referral_type": record["expected_referral_type"],
+            "presenting_complaint": complaint,
+        })
+    return cases
+
+
+def similar_case_examples(clinical_summary: str, k: int) -> str:
+    """A prompt block listing similar past cases and where they were referred, or "" if there are none."""
+    lines = []
+    for case in similar_cases_for_text(clinical_summary, k):
+        # The case's expected triage is the clinician's answer; otherwise where it was routed
+        referral = case["expected_referral_type"] or case["referral_type"]
+        complaint = case["presenting_complaint"] or case["title"] or "not recorded"
+        lines.append(f"- {complaint[:200]} -> \"{referral}\"")
+    if not lines:
+        return ""
+    return "SIMILAR PAST CASES (for reference only; classify this case on its own summary):\n" + "\n".join(lines) + "\n"
+
+
+# --- Shared Index ---
+_similar_case_index: Optional[SimilarCaseIndex] = None
+
+
+def get_similar_case_index() -> SimilarCaseIndex:
+    """Return the process-wide index, opening SIMILAR_CASE_INDEX on first use."""
+    global _similar_case_index
+    if _similar_case_index is None:
+        _similar_case_index = SimilarCaseIndex(os.environ.get("SIMILAR_CASE_INDEX", "similar_cases_index"))
+    return _similar_case_index
+
+
+def configure_similar_case_index(path: Optional[str] = None) -> SimilarCaseIndex:
+    """Replace the process-wide index; None keeps it in memory (used by tests)."""
+    global _similar_case_index
+    _similar_case_index = SimilarCaseIndex(path)
+    return _similar_case_index
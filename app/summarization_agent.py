@@ -1,8 +1,58 @@
-import httpx
-from typing import List, Dict, Any
+import asyncio
+import os
+import time
+from typing import List, Dict, Any, Optional, AsyncIterator
 from .questionnaire_engine import run_questionnaire_engine, get_diagnosis_display_name
 from .questionnaire_specs import get_questionnaire_form
-from .triage_agent import TriageAgent
+from .triage_agent import TriageAgent, select_questionnaire
+from .triage_guardrails import apply_triage_guardrails, PATHWAY_LABELS, PATHWAY_REFERRAL_TYPES
+from .llm_client import get_llm_pool
+from .generation_profiles import get_generation_profile, SBAR_STAGE, ROLLING_SBAR_STAGE
+from .transcript_compaction import compact_transcript
+from .similar_cases import similar_case_examples
+from .triage_schemas import DiagnosisEntry, DifferentialDiagnosis, TriageClassification
+from pydantic import BaseModel, ValidationError
+
+class RollingSummary:
+    """
+    Running SBAR draft for a conversation that is still in progress.
+
+    The draft is brought up to date in the background after each question block,
+    so the final summary only has to merge the turns since the last checkpoint.
+    """
+    def __init__(self):
+        self.summary = ""          # Latest SBAR draft
+        self.covered = 0           # Number of messages already folded into the draft
+        self.block = None          # Question block the conversation was last in
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+        self.speculation: Optional["SpeculativeSummary"] = None
+        self.saved_seconds = 0.0   # Wall-clock saved by speculation for this conversation
+
+class SpeculativeSummary:
+    """
+    SBAR generation started on a partial transcript before the conversation completes.
+
+    Remembers the transcript prefix and triage pathway it was started from so the
+    result can be validated against the final transcript, and the rolling draft it
+    started from so it can be rolled back if the conversation diverges.
+    """
+    def __init__(self, prefix: List[Dict], pathway: str, rolling: RollingSummary):
+        self.prefix = list(prefix)
+        self.pathway = pathway
+        self.base_summary = rolling.summary
+        self.base_covered = rolling.covered
+        self.task: Optional[asyncio.Task] = None
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+# Running totals for speculative summarisation across all completed triages
+SPECULATION_STATS = {
+    "started": 0,
+    "used": 0,
+    "discarded": 0,
+    "saved_seconds": 0.0,
+}
 
 class SummarizationAgent:
     """
@@ -10,7 +60,9 @@ class SummarizationAgent:
     """
     def __init__(self, model: str = "llama3.1:8b"):
         self.model = model
-        self.ollama_api_url = "http://localhost:11434/api/generate"
+        self.llm = get_llm_pool()
+        # Past cases shown to the classification stage as examples (SIMILAR_CASE_EXAMPLES, default off)
+        self.similar_case_examples = int(os.environ.get("SIMILAR_CASE_EXAMPLES", "0"))
         
         # Prompt for SBAR clinical summary
         self.sbar_prompt_template = """You are an Orthopaedic Triage Clinician. Analyze the conversation and provide an SBAR clinical summary.
@@ -58,6 +110,25 @@ FORMAT:
 
 **Conversation:**
 {conversation_history}
+"""
+
+        # Prompt for folding new conversation turns into a running SBAR draft
+        self.sbar_update_prompt_template = """You are an Orthopaedic Triage Clinician maintaining a running SBAR clinical summary while a triage conversation is still in progress.
+
+Below is the current SBAR draft and the part of the conversation that has taken place since it was written. Rewrite the draft so that it reflects ALL of the information gathered so far.
+
+UPDATE RULES:
+- Keep the exact section structure and headings of the current draft
+- Add or correct details using the new conversation lines; keep facts from the draft that are still valid
+- Follow the same clinical rules as before (clinical language, locking classification, quantified functional metrics, imaging detail)
+- Where something has not been discussed yet, write "Not yet discussed"
+- Output only the updated SBAR summary
+
+**Current SBAR Draft:**
+{current_summary}
+
+**New Conversation Lines:**
+{conversation_delta}
 """
 
         # Prompt for differential diagnosis using questionnaire engine
@@ -115,6 +186,36 @@ FORMAT:
 **Specialty:** [Soft Tissue - Knee / Knee Arthroplasty]
 **Clinical Reasoning:** [Brief explanation of why this classification was chosen]
 
+**CLINICAL SUMMARY:**
+{clinical_summary}
+"""
+
+        # JSON versions of the two stages above, answered against the schemas in triage_schemas
+        self.structured_differential_prompt_template = """You are an Orthopaedic Triage Clinician. Based on the clinical summary below, provide a differential diagnosis.
+
+Reply with JSON only:
+- "diagnoses": up to 3 entries, most likely first, each with "diagnosis", "confidence" (High/Moderate/Low) and "supporting_features" (short phrases from the summary)
+- "red_flags": serious conditions that need to be ruled out (may be empty)
+- "follow_up": specific follow-up instructions based on the condition
+
+**CLINICAL SUMMARY:**
+{clinical_summary}
+"""
+
+        self.structured_classification_prompt_template = """You are an Orthopaedic Triage Clinician. Based on the clinical summary below, classify this case and choose the referral.
+
+CLASSIFICATION RULES:
+- "Soft Tissue": ligaments, tendons, muscles, cartilage or other soft tissue problems not needing joint replacement. Any ligament injury (ACL, PCL, MCL, LCL, MPFL) or meniscal tear is ALWAYS Soft Tissue.
+- "Arthroplasty": severe joint degeneration, end-stage arthritis, or possible joint replacement.
+
+REFERRAL TYPES:
+- "urgent_ed": red flags such as suspected infection, fracture, locked knee, neurovascular compromise or inability to weight bear
+- "swleoc": needs an orthopaedic surgical opinion (SWLEOC)
+- "physio": suitable for conservative MSK physiotherapy
+- "gp": manageable in primary care
+
+Reply with JSON only, with "category", "body_part", "specialty" (e.g. "Soft Tissue - Knee" or "Knee Arthroplasty"), "referral_type" and "clinical_reasoning" (one or two sentences).
+
 **CLINICAL SUMMARY:**
 {clinical_summary}
 """
@@ -162,130 +263,52 @@ FORMAT:
           - 'msk_physio'
           - 'gp_primary'
         """
-        import re
-        age = int(patient_data.get("patient", {}).get("age_years", 0))
-        sx   = (patient_data.get("symptoms") or "").lower()
-        fx   = (patient_data.get("functional_impact") or "").lower()
-        img  = (patient_data.get("imaging_history") or "").lower()
-        tx   = (patient_data.get("previous_treatment") or "").lower()
-        convo= (conversation_text or "").lower()
-
-        text = " ".join([sx, fx, img, tx, convo])
-
-        def has(pattern):
-            return re.search(pattern, text) is not None
-
-        def has_negated(term):
-            # e.g., "no true locking", "denies fever"
-            return re.search(rf"(no|den(y|ies)|without)\s+\b{term}\b", text) is not None
-
-        def present(term):
-            # present only if not explicitly negated
-            return (term in text) and not has_negated(term)
-
-        # ---------- URGENT FLAGS ----------
-        urgent = 0
-        # septic arthritis / infection
-        if any(present(t) for t in ["fever", "rigors", "chills", "hot swollen joint", "erythema", "sepsis", "septic"]):
-            urgent += 3
-        # fracture / dislocation / unable to weight-bear after trauma
-        if any(present(t) for t in ["deformity", "audible crack", "unable to weight-bear", "dislocation"]) or has(r"\bfracture\b"):
-            urgent += 3
-        # neurovascular
-        if any(present(t) for t in ["numbness", "foot drop", "pins and needles", "cold foot", "pale foot", "weak pulse"]):
-            urgent += 2
-        # DVT/PE risk
-        if any(present(t) for t in ["calf swelling", "calf tenderness", "sudden breathlessness", "pleuritic chest pain"]):
-            urgent += 2
-        # cancer red flags
-        if any(present(t) for t in ["unexplained weight loss", "night sweats", "history of cancer"]) and any(present(t) for t in ["night pain", "rest pain"]):
-            urgent += 2
-        if urgent >= 3:
-            return "urgent_ed"
-
-        # ---------- SOFT-TISSUE ORTHO ----------
-        soft_tissue = 0
-        # instability / giving way / dislocation / patellar instability
-        if any(present(t) for t in ["instability", "giving way", "dislocation", "pops out", "kneecap out", "patellar instability"]):
-            soft_tissue += 3
-        # true mechanical block
-        if (present("true locking") or present("won't move") or present("completely stuck")) and not present("no true locking"):
-            soft_tissue += 3
-        # traumatic mechanism with persistent symptoms >6–12 weeks
-        if any(present(t) for t in ["pivot", "twist", "dashboard", "skiing", "tackle", "contact injury"]):
-            soft_tissue += 2
-        if any(present(t) for t in ["acl", "pcl", "mcl", "lcl", "mpfl", "meniscal tear", "bucket handle", "rupture", "torn ligament", "ligament tear", "posterolateral corner"]):
-            soft_tissue += 3
-        if any(present(t) for t in ["failed physio", "failed physiotherapy", "completed 12 weeks physio", "persistent despite rehab"]):
-            soft_tissue += 2
-        # age bias (younger patients more likely soft tissue pathway)
-        if age < 50:
-            soft_tissue += 1
-
-        # ---------- ARTHROPLASTY ----------
-        arthro = 0
-        # radiographic OA markers
-        if any(present(t) for t in [
-            "kellgren", "joint space narrowing", "osteophytes", "tricompartmental oa",
-            "bone-on-bone", "end-stage", "severe degenerative osteoarthritis", "advanced oa"
-        ]) or ("osteoarthritis" in text and any(present(t) for t in ["severe", "advanced", "end-stage"])):
-            arthro += 3
-        # age and severity
-        if age >= 55:
-            arthro += 1
-        # functional collapse
-        if any(present(t) for t in ["daily function severely limited", "unable to manage stairs", "housebound", "walking distance < 200m", "needs two sticks"]):
-            arthro += 2
-        # persistent night/rest pain most nights
-        if present("night pain") or present("rest pain"):
-            arthro += 1
-        # failed non-op incl. injections / multiple physio rounds
-        if any(present(t) for t in ["failed conservative", "failed non-operative", "steroid injection with short-lived relief", "multiple courses of physio"]):
-            arthro += 1
-
-        # ---------- MSK PHYSIO ----------
-        physio = 0
-        if any(present(t) for t in ["patellofemoral pain", "pfps", "chondromalacia", "iliotibial band", "itbs", "tendinopathy", "pes anserine", "bursitis"]):
-            physio += 2
-        if any(present(t) for t in ["degenerative meniscal tear", "meniscal signal", "small tear"]) and present("no true locking"):
-            physio += 2
-        if any(present(t) for t in ["mild symptoms", "manageable", "can still work", "no instability", "no giving way"]):
-            physio += 1
-        # short duration or early rehab
-        if any(present(t) for t in ["< 12 weeks", "six weeks", "8 weeks"]) or any(present(t) for t in ["early rehab", "starting physio", "conservative management"]):
-            physio += 1
-        if age < 55 and not any(present(t) for t in ["night pain", "rest pain"]):
-            physio += 1
-
-        # ---------- GP / PRIMARY ----------
-        gp = 0
-        if "osteoarthritis" in text and arthro < 3:
-            gp += 2  # likely OA management optimization rather than surgery
-        if any(present(t) for t in ["analgesia review", "weight loss", "activity modification", "home exercise", "injection discussion"]):
-            gp += 1
-        if not any(present(t) for t in ["instability", "giving way", "true locking"]) and physio == 0:
-            gp += 1
-
-        # ---------- PICK PATHWAY WITH PRIORITY ----------
-        # Priority order: urgent_ed > soft_tissue > arthroplasty > msk_physio > gp_primary
-        scores = {
-            "orthopaedic_soft_tissue": soft_tissue,
-            "arthroplasty": arthro,
-            "msk_physio": physio,
-            "gp_primary": gp,
-        }
+        return apply_triage_guardrails(patient_data, conversation_text)
 
-        # If any strong soft-tissue signal, prefer that over arthro if age <55 and no OA imaging
-        if soft_tissue >= 4 and not ("advanced" in text or "end-stage" in text or "bone-on-bone" in text):
-            best = "orthopaedic_soft_tissue"
-        else:
-            best = max(scores, key=scores.get)
+    def _format_conversation(self, messages: List[Dict], stage: str) -> str:
+        """Format conversation messages as 'ROLE: content' lines, compacted to the stage's transcript budget."""
+        return compact_transcript(messages, get_generation_profile(stage).transcript_tokens)["text"]
 
-        # Safe default if everything is low-signal
-        if all(v == 0 for v in scores.values()):
-            return "msk_physio"
+    async def _generate(self, prompt: str, fallback: str, label: str) -> str:
+        """Send a prompt to Ollama and return the generated text, or an error string."""
+        profile = get_generation_profile(label)
+        try:
+            result = await self.llm.generate(profile.model_for(self.model), prompt, timeout=30.0, stage=label,
+                                             options=profile.options(), keep_alive=profile.keep_alive)
+            return result.strip() or f"Could not generate {fallback}."
+        except Exception as e:
+            print(f"Error during {label} generation: {e}")
+            print(f"Error type: {type(e)}")
+            return f"Error: Could not generate {fallback}."
 
-        return best
+    async def _generate_stream(self, prompt: str, fallback: str, label: str) -> AsyncIterator[str]:
+        """Stream generated text from Ollama chunk by chunk, or yield an error string."""
+        profile = get_generation_profile(label)
+        try:
+            async for chunk in self.llm.generate_stream(profile.model_for(self.model), prompt, timeout=30.0,
+                                                        options=profile.options(), keep_alive=profile.keep_alive):
+                yield chunk
+        except Exception as e:
+            print(f"Error during {label} generation: {e}")
+            print(f"Error type: {type(e)}")
+            yield f"Error: Could not generate {fallback}."
+
+    async def _generate_structured(self, prompt: str, schema: type, label: str, attempts: int = 2) -> Optional[BaseModel]:
+        """Ask Ollama for JSON matching schema and validate it; None if no valid reply came back."""
+        profile = get_generation_profile(label)
+        for attempt in range(attempts):
+            try:
+                result = await self.llm.generate(profile.model_for(self.model), prompt, timeout=30.0, stage=label,
+                                                 options=profile.options(), keep_alive=profile.keep_alive,
+                                                 format=schema.model_json_schema())
+                return schema.model_validate_json(result)
+            except ValidationError as e:
+                print(f"Invalid {label} JSON (attempt {attempt + 1}): {e}")
+            except Exception as e:
+                print(f"Error during {label} generation: {e}")
+                print(f"Error type: {type(e)}")
+                return None
+        return None
 
     async def generate_sbar_summary(self, messages: List[Dict]) -> str:
         """Generate SBAR clinical summary from conversation."""
@@ -299,82 +322,319 @@ FORMAT:
         imaging_context = self._enhance_imaging_specificity(patient_data.get("imaging_history", ""))
         
         # Format conversation history
-        conversation_history = "\n".join([f"{msg['role'].upper()}: {msg['content']}" for msg in messages])
+        conversation_history = self._format_conversation(messages, SBAR_STAGE)
         
         # Create the full prompt
         full_prompt = self.sbar_prompt_template.format(
             conversation_history=conversation_history
         )
         
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.ollama_api_url,
-                    json={"model": self.model, "prompt": full_prompt, "stream": False},
-                )
-                response.raise_for_status()
-                ollama_response = response.json()
-                result = ollama_response.get("response", "Could not generate SBAR summary.").strip()
-                return result
-        except Exception as e:
-            print(f"Error during SBAR summary generation: {e}")
-            print(f"Error type: {type(e)}")
-            return "Error: Could not generate SBAR summary."
+        return await self._generate(full_prompt, "SBAR summary", "SBAR summary")
+
+    async def generate_structured_differential(self, clinical_summary: str) -> Optional[DifferentialDiagnosis]:
+        """Generate a validated differential diagnosis from the clinical summary."""
+        prompt = self.structured_differential_prompt_template.format(clinical_summary=clinical_summary)
+        return await self._generate_structured(prompt, DifferentialDiagnosis, "differential diagnosis")
+
+    async def generate_structured_classification(self, clinical_summary: str) -> Optional[TriageClassification]:
+        """Generate a validated triage classification, including the referral type."""
+        prompt = self.structured_classification_prompt_template.format(clinical_summary=clinical_summary)
+        if self.similar_case_examples:
+            examples = await asyncio.to_thread(similar_case_examples, clinical_summary, self.similar_case_examples)
+            if examples:
+                prompt = prompt.replace("\n**CLINICAL SUMMARY:**", f"\n{examples}\n**CLINICAL SUMMARY:**", 1)
+        return await self._generate_structured(prompt, TriageClassification, "triage classification")
 
     async def generate_differential_diagnosis(self, clinical_summary: str) -> str:
-        """Generate differential diagnosis from clinical summary."""
+        """Generate differential diagnosis from clinical summary (free-text markdown)."""
         full_prompt = self.differential_prompt_template.format(
             clinical_summary=clinical_summary
         )
         
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.ollama_api_url,
-                    json={"model": self.model, "prompt": full_prompt, "stream": False},
-                )
-                response.raise_for_status()
-                ollama_response = response.json()
-                result = ollama_response.get("response", "Could not generate differential diagnosis.").strip()
-                return result
-        except Exception as e:
-            print(f"Error during differential diagnosis generation: {e}")
-            print(f"Error type: {type(e)}")
-            return "Error: Could not generate differential diagnosis."
+        return await self._generate(full_prompt, "differential diagnosis", "differential diagnosis")
 
     async def generate_triage_classification(self, clinical_summary: str) -> str:
-        """Generate soft tissue vs arthroplasty triage classification."""
+        """Generate soft tissue vs arthroplasty triage classification (free-text markdown)."""
         full_prompt = self.triage_classification_prompt_template.format(
             clinical_summary=clinical_summary
         )
         
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.ollama_api_url,
-                    json={"model": self.model, "prompt": full_prompt, "stream": False},
+        return await self._generate(full_prompt, "triage classification", "triage classification")
+
+    async def update_rolling_summary(self, rolling: RollingSummary, messages: List[Dict]) -> str:
+        """Fold the messages not yet covered by the rolling draft into it."""
+        async with rolling.lock:
+            delta = messages[rolling.covered:]
+            if not any(msg['role'] == 'user' and msg['content'].strip() for msg in delta):
+                return rolling.summary
+            
+            if rolling.summary:
+                prompt = self.sbar_update_prompt_template.format(
+                    current_summary=rolling.summary,
+                    conversation_delta=self._format_conversation(delta, ROLLING_SBAR_STAGE)
                 )
-                response.raise_for_status()
-                ollama_response = response.json()
-                result = ollama_response.get("response", "Could not generate triage classification.").strip()
-                return result
-        except Exception as e:
-            print(f"Error during triage classification generation: {e}")
-            print(f"Error type: {type(e)}")
-            return "Error: Could not generate triage classification."
+            else:
+                prompt = self.sbar_prompt_template.format(
+                    conversation_history=self._format_conversation(delta, ROLLING_SBAR_STAGE)
+                )
+            
+            result = await self._generate(prompt, "SBAR summary", "rolling SBAR summary")
+            # Keep the previous draft if the update failed; the delta is retried next time
+            if not result.startswith("Error:"):
+                rolling.summary = result
+                rolling.covered = len(messages)
+            return rolling.summary
+
+    def schedule_rolling_update(self, rolling: RollingSummary, messages: List[Dict]) -> asyncio.Task:
+        """Start a background update of the rolling draft at the end of a question block."""
+        rolling.task = asyncio.create_task(self.update_rolling_summary(rolling, list(messages)))
+        return rolling.task
+
+    def _current_pathway(self, messages: List[Dict]) -> str:
+        """Guardrail pathway for the transcript as it stands."""
+        patient_data = self._extract_patient_data_from_conversation(messages)
+        # Only the patient's words count - the red flag question itself lists "fever", "chills", ...
+        patient_text = " ".join(msg['content'] for msg in messages if msg['role'] == 'user')
+        return self._apply_triage_guardrails(patient_data, patient_text)
+
+    def start_speculative_summary(self, rolling: RollingSummary, messages: List[Dict]) -> Optional[SpeculativeSummary]:
+        """Start bringing the SBAR up to date on the partial transcript in the background."""
+        if rolling.speculation is not None:
+            return None
+        
+        speculation = SpeculativeSummary(messages, self._current_pathway(messages), rolling)
+        
+        async def run():
+            try:
+                await self.update_rolling_summary(rolling, speculation.prefix)
+            finally:
+                speculation.finished_at = time.perf_counter()
+        
+        speculation.task = asyncio.create_task(run())
+        rolling.speculation = speculation
+        SPECULATION_STATS["started"] += 1
+        return speculation
+
+    def _speculation_diverged(self, speculation: SpeculativeSummary, messages: List[Dict]) -> bool:
+        """A speculation is invalid if the transcript was rewritten or the pathway has changed."""
+        if messages[:len(speculation.prefix)] != speculation.prefix:
+            return True
+        return self._current_pathway(messages) != speculation.pathway
+
+    def check_speculation(self, rolling: RollingSummary, messages: List[Dict]) -> bool:
+        """Cancel the speculative summary if the conversation has diverged from it."""
+        speculation = rolling.speculation
+        if speculation is None or not self._speculation_diverged(speculation, messages):
+            return False
+        
+        if speculation.task and not speculation.task.done():
+            speculation.task.cancel()
+        # Roll the draft back to where it was before speculating
+        if rolling.covered >= len(speculation.prefix):
+            rolling.summary = speculation.base_summary
+            rolling.covered = speculation.base_covered
+        rolling.speculation = None
+        SPECULATION_STATS["discarded"] += 1
+        return True
+
+    async def finalize_rolling_summary(self, rolling: RollingSummary, messages: List[Dict]) -> str:
+        """Merge the last delta into the rolling draft and return the final SBAR summary."""
+        speculation = rolling.speculation
+        if speculation is not None:
+            finalize_started = time.perf_counter()
+            if self.check_speculation(rolling, messages):
+                speculation = None
+            else:
+                try:
+                    await speculation.task
+                except asyncio.CancelledError:
+                    speculation = None
+                if speculation is not None:
+                    # Work done before /summarize arrived is off the critical path
+                    finished = min(speculation.finished_at or finalize_started, finalize_started)
+                    rolling.saved_seconds = max(0.0, finished - speculation.started_at)
+                    SPECULATION_STATS["used"] += 1
+                    SPECULATION_STATS["saved_seconds"] += rolling.saved_seconds
+        
+        if rolling.task and not rolling.task.done():
+            try:
+                await rolling.task
+            except Exception as e:
+                print(f"Error during rolling SBAR update: {e}")
+        
+        summary = await self.update_rolling_summary(rolling, messages)
+        if not summary:
+            # Nothing was checkpointed yet (or every update failed) - summarize in one go
+            summary = await self.generate_sbar_summary(messages)
+        return summary
+
+    # --- Degraded summary ---
+    def build_degraded_summary(self, messages: List[Dict]) -> Dict[str, Any]:
+        """
+        Deterministic summary from the extracted data, questionnaire engine and guardrail
+        pathway, used when the LLM is unavailable. Same shape as summarize_and_triage_structured.
+        """
+        patient_data = self._extract_patient_data_from_conversation(messages)
+        user_messages = [msg['content'] for msg in messages if msg['role'] == 'user']
+        patient_text = " ".join(user_messages)
+        pathway = self._apply_triage_guardrails(patient_data, patient_text)
+        questionnaire = select_questionnaire(user_messages[0] if user_messages else "")
+        engine = self._run_questionnaire_analysis(patient_data, questionnaire)
+        
+        # Differential from the engine ranking
+        bands = {"high": "High", "moderate": "Moderate"}
+        if engine.get("route") == "urgent":
+            diagnoses = [DiagnosisEntry(diagnosis=get_diagnosis_display_name(engine.get("provisional_diagnosis") or "unknown"),
+                                        confidence="Moderate", supporting_features=engine.get("urgent_reason", []))]
+        else:
+            diagnoses = [
+                DiagnosisEntry(diagnosis=get_diagnosis_display_name(dx["diagnosis_code"]),
+                               confidence=bands.get(dx["confidence_band"], "Low"),
+                               supporting_features=dx["key_drivers"])
+                for dx in engine.get("top", [])
+            ]
+        if not diagnoses:
+            diagnoses = [DiagnosisEntry(diagnosis="Undifferentiated knee pain", confidence="Low")]
+        red_flags = list(engine.get("safety_net", []))
+        if pathway == "urgent_ed":
+            red_flags.append("Urgent features reported by the patient")
+        differential = DifferentialDiagnosis(diagnoses=diagnoses, red_flags=red_flags,
+                                             follow_up="Clinician review of this automatically generated summary")
+        
+        classification = TriageClassification(
+            category="Arthroplasty" if pathway == "arthroplasty" else "Soft Tissue",
+            body_part="Shoulder" if questionnaire == "shoulder_generic" else "Knee",
+            specialty="Knee Arthroplasty" if pathway == "arthroplasty" else "Soft Tissue - Knee",
+            referral_type=PATHWAY_REFERRAL_TYPES[pathway],
+            clinical_reasoning=f"Rule-based guardrail pathway: {PATHWAY_LABELS[pathway]}.",
+        )
+        
+        patient = patient_data.get("patient", {})
+        demographics = ", ".join(str(v) for v in [
+            f"{patient['age_years']} years" if patient.get("age_years") else None, patient.get("gender")] if v)
+        complaint = user_messages[0][:300] if user_messages else "Not recorded"
+        lines = [
+            "---",
+            "**DEGRADED SUMMARY:** The language model was unavailable, so this summary was built from the "
+            "extracted answers and rule-based triage only. Please review the transcript.",
+            "",
+            "**SITUATION:**",
+            f"- **Patient Demographics:** {demographics or 'Not recorded'}",
+            f"- **Presenting Complaint:** {complaint}",
+            f"- **Body Part Affected:** {' '.join(v for v in [patient_data.get('laterality'), classification.body_part.lower()] if v)}",
+            "",
+            "**BACKGROUND:**",
+            f"- **Onset & Duration:** {patient_data.get('duration_class') or 'Not recorded'}",
+            f"- **Mechanism of Injury:** {patient_data.get('mechanism') or 'Not recorded'}",
+            "",
+            "**ASSESSMENT:**",
+            f"- **Pain Severity:** {str(patient_data['severity']) + '/10' if patient_data.get('severity') is not None else 'Not recorded'}",
+            f"- **Leading Diagnosis (questionnaire engine):** {diagnoses[0].diagnosis} ({diagnoses[0].confidence})",
+            "",
+            "**RECOMMENDATION:**",
+            f"- **Pathway:** {PATHWAY_LABELS[pathway]}",
+            "- **Next Step:** Clinician to confirm the pathway from the transcript",
+        ]
+        sbar_summary = "\n".join(lines)
+        return {
+            "text": f"{sbar_summary}\n\n{differential.to_markdown()}\n\n{classification.to_markdown()}",
+            "sbar": sbar_summary,
+            "differential": differential,
+            "classification": classification,
+            "degraded": True,
+        }
 
-    async def summarize_and_triage(self, messages: List[Dict]) -> str:
+    async def summarize_and_triage(self, messages: List[Dict], rolling: Optional[RollingSummary] = None) -> str:
         """Generate complete clinical summary with SBAR, differential diagnosis, and triage classification."""
-        # Generate SBAR summary
-        sbar_summary = await self.generate_sbar_summary(messages)
+        result = await self.summarize_and_triage_structured(messages, rolling)
+        return result["text"]
+
+    async def summarize_and_triage_structured(self, messages: List[Dict],
+                                              rolling: Optional[RollingSummary] = None) -> Dict[str, Any]:
+        """
+        Summarise and triage, keeping the typed stage outputs.
+
+        Returns {"text", "sbar", "differential", "classification", "degraded"}; the typed
+        fields are None when the model never produced valid JSON, in which case the text
+        falls back to the free-text prompts. While the LLM circuit breaker is open, or if
+        the SBAR fails, the deterministic degraded summary is returned instead.
+        """
+        if self.llm.breaker.is_open():
+            return self.build_degraded_summary(messages)
         
-        # Generate differential diagnosis
-        differential_diagnosis = await self.generate_differential_diagnosis(sbar_summary)
+        # Generate SBAR summary, reusing the rolling draft when one has been maintained
+        if rolling is not None:
+            sbar_summary = await self.finalize_rolling_summary(rolling, messages)
+        else:
+            sbar_summary = await self.generate_sbar_summary(messages)
+        if sbar_summary.startswith("Error:"):
+            return self.build_degraded_summary(messages)
         
-        # Generate triage classification
-        triage_classification = await self.generate_triage_classification(sbar_summary)
+        differential = await self.generate_structured_differential(sbar_summary)
+        classification = await self.generate_structured_classification(sbar_summary)
+        degraded = None
+        if (differential is None or classification is None) and self.llm.breaker.is_open():
+            # The breaker opened part-way through; use the rule-based stages rather than wait on it
+            degraded = self.build_degraded_summary(messages)
+            differential = differential or degraded["differential"]
+            classification = classification or degraded["classification"]
+        differential_text = (differential.to_markdown() if differential
+                             else await self.generate_differential_diagnosis(sbar_summary))
+        classification_text = (classification.to_markdown() if classification
+                               else await self.generate_triage_classification(sbar_summary))
         
-        # Combine all results
-        full_summary = f"{sbar_summary}\n\n{differential_diagnosis}\n\n{triage_classification}"
+        return {
+            "text": f"{sbar_summary}\n\n{differential_text}\n\n{classification_text}",
+            "sbar": sbar_summary,
+            "differential": differential,
+            "classification": classification,
+            "degraded": degraded is not None,
+        }
+
+    async def stream_summarize_and_triage(self, messages: List[Dict], rolling: Optional[RollingSummary] = None,
+                                          structured: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Same output as summarize_and_triage, yielded as it is generated. The SBAR streams
+        token by token; the JSON stages arrive whole once validated. If a dict is passed
+        as structured, the typed differential and classification are stored in it, with
+        "degraded" set when the LLM circuit breaker is open and the rule-based summary is sent.
+        """
+        if structured is not None:
+            structured["degraded"] = False
+        if self.llm.breaker.is_open():
+            degraded = self.build_degraded_summary(messages)
+            if structured is not None:
+                structured.update(differential=degraded["differential"], classification=degraded["classification"],
+                                  degraded=True)
+            yield degraded["text"]
+            return
+        
+        if rolling is not None:
+            # The rolling draft only needs the last delta merged, so it arrives in one piece
+            sbar_summary = await self.finalize_rolling_summary(rolling, messages)
+            yield sbar_summary
+        else:
+            prompt = self.sbar_prompt_template.format(conversation_history=self._format_conversation(messages, SBAR_STAGE))
+            parts = []
+            async for chunk in self._generate_stream(prompt, "SBAR summary", "SBAR summary"):
+                parts.append(chunk)
+                yield chunk
+            sbar_summary = "".join(parts).strip()
         
-        return full_summary
+        stages = [
+            ("differential", self.generate_structured_differential,
+             self.differential_prompt_template, "differential diagnosis"),
+            ("classification", self.generate_structured_classification,
+             self.triage_classification_prompt_template, "triage classification"),
+        ]
+        for key, generate_structured, template, label in stages:
+            yield "\n\n"
+            result = await generate_structured(sbar_summary)
+            if structured is not None:
+                structured[key] = result
+            if result is not None:
+                yield result.to_markdown()
+                continue
+            prompt = template.format(clinical_summary=sbar_summary)
+            async for chunk in self._generate_stream(prompt, label, label):
+                yield chunk
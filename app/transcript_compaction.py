@@ -0,0 +1,181 @@
+"""
+Token-budgeted transcript compaction for LLM prompts.
+
+The bot's questions are canned (see TriageAgent._get_prompt_for_state), so in a
+prompt they are replaced with a short "[Asked about ...]" label and the closing
+message is dropped. Patient sentences already given in an earlier answer (the
+simulator often repeats the presenting complaint) are removed, except short replies
+like "Yes." and answers to the pinned and guardrail questions. If the transcript is
+still over the stage's transcript_tokens budget, the exchanges with the fewest
+informative words per token are dropped first. The introduction and the red flag
+screen are always kept, and answers the referral guardrails read (duration,
+mechanism, locking, phenotype) are dropped last.
+
+Token counts are estimated at four characters per token, which is close enough
+for budgeting against num_ctx.
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+from .triage_agent import TriageState, PATHWAY_STATES, bot_question_texts
+
+# Short labels for questions whose state name alone would read badly
+QUESTION_LABELS = {
+    TriageState.GREETING: "name, age, gender and date of birth",
+    TriageState.SELECT_BODY_PART: "presenting complaint and body part",
+    TriageState.GATHER_DURATION: "duration (acute <2 weeks, subacute 2-12 weeks, chronic >12 weeks)",
+    TriageState.GATHER_SEVERITY: "pain severity (0-10)",
+    TriageState.GATHER_KNEE_SCORE: "knee function (walking, stairs, squatting)",
+    TriageState.GATHER_OA_INDEX_DETAILED: ("difficulty with stairs down/up, rising from a chair, bending, "
+                                           "car, socks, bath and heavy domestic work"),
+    TriageState.GATHER_LOCKING_TYPE: "true locking (stuck) vs catching (click that pops and goes)",
+    TriageState.GATHER_PHENOTYPE_SYMPTOMS: "giving way, locking/catching, anterior knee pain",
+    TriageState.GATHER_RED_FLAGS: "red flags (fever, chills, weight loss, severe weakness)",
+    TriageState.GATHER_SURGERY_INTEREST: "interest in surgery",
+}
+
+# Exchanges that are never dropped to meet a budget
+PINNED_STATES = {TriageState.GREETING, TriageState.SELECT_BODY_PART, TriageState.GATHER_RED_FLAGS}
+
+# Words that carry no clinical information when scoring an answer
+FILLER_WORDS = {
+    "a", "an", "and", "the", "i", "i'm", "im", "it", "it's", "its", "my", "me", "to", "of", "in", "on", "at",
+    "is", "was", "be", "been", "have", "had", "has", "do", "does", "did", "that", "this", "but", "or", "so",
+    "just", "really", "very", "quite", "yes", "no", "not", "um", "well", "like", "you", "know", "think",
+    "about", "with", "for", "when", "if", "any", "some", "there", "they", "what", "would", "can", "bit",
+}
+
+
+# A repeated sentence is only dropped if it carries at least this many informative words;
+# short replies such as "Yes." answer a different question each time
+MIN_REPEAT_INFORMATIVE_WORDS = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def format_transcript(messages: List[Dict]) -> str:
+    return "\n".join(f"{msg['role'].upper()}: {msg['content']}" for msg in messages)
+
+
+# --- Known Bot Prompts ---
+_question_states: Optional[Dict[str, TriageState]] = None
+
+
+def question_state(text: str) -> Optional[TriageState]:
+    """The state whose canned question (or closing message) is exactly this text."""
+    global _question_states
+    if _question_states is None:
+        _question_states = {question: state for state, question in bot_question_texts().items()}
+    return _question_states.get(text.strip())
+
+
+def question_label(state: TriageState) -> str:
+    return QUESTION_LABELS.get(state) or state.value.replace("GATHER_", "").replace("_", " ").lower()
+
+
+def answers_by_state(messages: List[Dict]) -> Dict[TriageState, str]:
+    """The patient's reply to each canned question, as typed (the latest if a question was repeated)."""
+    answers: Dict[TriageState, str] = {}
+    state = None
+    for msg in messages:
+        if msg["role"] == "assistant":
+            state = question_state(msg["content"])
+        elif state is not None and msg["content"].strip():
+            answers[state] = msg["content"].strip().strip('"').strip()
+            state = None
+    return answers
+
+
+# --- Compaction ---
+def _normalise(sentence: str) -> str:
+    return re.sub(r"[^a-z0-9/ ]", "", sentence.lower()).strip()
+
+
+def _informative_words(text: str) -> int:
+    words = {w for w in re.findall(r"[a-z0-9'/]+", text.lower()) if w not in FILLER_WORDS}
+    return len(words)
+
+
+def _exchanges(messages: List[Dict]) -> List[Dict[str, Any]]:
+    """Group the transcript into question/answer exchanges, abbreviating canned questions."""
+    exchanges: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for msg in messages:
+        if msg["role"] == "assistant":
+            state = question_state(msg["content"])
+            if state == TriageState.COMPLETE:
+                continue
+            content = f"[Asked about {question_label(state)}]" if state else msg["content"]
+            current = {"state": state, "messages": [{"role": "assistant", "content": content}]}
+            exchanges.append(current)
+        else:
+            if current is None:
+                current = {"state": None, "messages": []}
+                exchanges.append(current)
+            current["messages"].append(dict(msg))
+    return exchanges
+
+
+def _drop_repeated_sentences(exchanges: List[Dict[str, Any]]):
+    """
+    Remove patient sentences that repeat an earlier answer word for word. Short
+    sentences are kept, and so are all answers to the pinned and guardrail
+    questions, so a "Yes." to the red flag screen is never lost.
+    """
+    seen = set()
+    for exchange in exchanges:
+        protected = exchange["state"] in PINNED_STATES or exchange["state"] in PATHWAY_STATES
+        for msg in exchange["messages"]:
+            if msg["role"] != "user":
+                continue
+            kept = []
+            for sentence in re.split(r"(?<=[.!?])\s+", msg["content"].strip().strip('"')):
+                key = _normalise(sentence)
+                if (key and key in seen and not protected
+                        and _informative_words(sentence) >= MIN_REPEAT_INFORMATIVE_WORDS):
+                    continue
+                seen.add(key)
+                kept.append(sentence)
+            msg["content"] = " ".join(kept)
+        exchange["messages"] = [msg for msg in exchange["messages"] if msg["role"] != "user" or msg["content"]]
+
+
+def compact_transcript(messages: List[Dict], budget: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Compact a transcript for a prompt and report the saving.
+
+    Returns {"text", "original_tokens", "tokens", "dropped_exchanges"}; with no budget
+    nothing is dropped, only abbreviated and de-duplicated.
+    """
+    original_tokens = estimate_tokens(format_transcript(messages))
+    exchanges = _exchanges(messages)
+    _drop_repeated_sentences(exchanges)
+    for index, exchange in enumerate(exchanges):
+        exchange["index"] = index
+        exchange["tokens"] = estimate_tokens(format_transcript(exchange["messages"])) + 1
+        answers = " ".join(msg["content"] for msg in exchange["messages"] if msg["role"] == "user")
+        exchange["density"] = _informative_words(answers) / exchange["tokens"]
+        exchange["pinned"] = index == 0 or exchange["state"] in PINNED_STATES
+
+    kept = list(exchanges)
+    tokens = sum(exchange["tokens"] for exchange in kept)
+    if budget is not None and tokens > budget:
+        # Guardrail answers last, then the least informative per token first; among equals, earlier go first
+        droppable = sorted((e for e in exchanges if not e["pinned"]),
+                           key=lambda e: (e["state"] in PATHWAY_STATES, e["density"], e["index"]))
+        for exchange in droppable:
+            if tokens <= budget:
+                break
+            kept.remove(exchange)
+            tokens -= exchange["tokens"]
+
+    text = format_transcript([msg for exchange in kept for msg in exchange["messages"]])
+    return {
+        "text": text,
+        "original_tokens": original_tokens,
+        "tokens": estimate_tokens(text),
+        "dropped_exchanges": len(exchanges) - len(kept),
+    }
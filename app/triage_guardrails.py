@@ -0,0 +1,218 @@
+"""
+Referral pathway guardrails for the MSK triage system.
+
+Keyword rules over the patient's answers that pick one of the referral pathways.
+Shared by the summarisation agent (final routing) and the triage agent (stopping
+the interview once the pathway is settled).
+"""
+
+import re
+from typing import Any, Dict, List, Set
+
+# Most points each pathway can score, i.e. the sum of its rule weights below
+MAX_PATHWAY_SCORES = {
+    "orthopaedic_soft_tissue": 14,
+    "arthroplasty": 8,
+    "msk_physio": 7,
+    "gp_primary": 4,
+}
+
+# How each pathway reads in a summary, and the referral letter it leads to
+PATHWAY_LABELS = {
+    "urgent_ed": "Urgent same-day assessment (ED)",
+    "orthopaedic_soft_tissue": "SWLEOC Orthopaedic Soft Tissue clinic",
+    "arthroplasty": "SWLEOC Arthroplasty clinic",
+    "msk_physio": "MSK Physiotherapy",
+    "gp_primary": "GP / primary care management",
+}
+PATHWAY_REFERRAL_TYPES = {
+    "urgent_ed": "urgent_ed",
+    "orthopaedic_soft_tissue": "swleoc",
+    "arthroplasty": "swleoc",
+    "msk_physio": "physio",
+    "gp_primary": "gp",
+}
+
+
+# --- Text Matching ---
+# Shared with the conversation search index so a search reads the text the way the rules do
+# Words that negate the term straight after them, e.g. "no true locking", "denies fever"
+NEGATION_WORDS = ("no", "deny", "denies", "without")
+NEGATION_PATTERN = "(" + "|".join(NEGATION_WORDS) + ")"
+TOKEN_PATTERN = re.compile(r"[a-z0-9<]+(?:['/.-][a-z0-9]+)*")
+
+
+def normalise_text(text: str) -> str:
+    return (text or "").lower()
+
+
+def term_negated(text: str, term: str) -> bool:
+    """True if the (normalised) text negates the term, e.g. "no true locking"."""
+    return re.search(rf"{NEGATION_PATTERN}\s+\b{term}\b", text) is not None
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(normalise_text(text))
+
+
+def negated_positions(tokens: List[str]) -> Set[int]:
+    """Positions of the tokens a negation word negates: the token straight after it, as in term_negated."""
+    return {i for i in range(1, len(tokens)) if tokens[i - 1] in NEGATION_WORDS}
+
+
+def score_triage_guardrails(patient_data: Dict[str, Any], conversation_text: str) -> Dict[str, Any]:
+    """
+    Score each referral pathway and pick one of:
+      - 'urgent_ed'
+      - 'orthopaedic_soft_tissue'
+      - 'arthroplasty'
+      - 'msk_physio'
+      - 'gp_primary'
+    """
+    age = int(patient_data.get("patient", {}).get("age_years") or 0)
+    sx   = normalise_text(patient_data.get("symptoms"))
+    fx   = normalise_text(patient_data.get("functional_impact"))
+    img  = normalise_text(patient_data.get("imaging_history"))
+    tx   = normalise_text(patient_data.get("previous_treatment"))
+    convo= normalise_text(conversation_text)
+
+    text = " ".join([sx, fx, img, tx, convo])
+
+    def has(pattern):
+        return re.search(pattern, text) is not None
+
+    def has_negated(term):
+        # e.g., "no true locking", "denies fever"
+        return term_negated(text, term)
+
+    def present(term):
+        # present only if not explicitly negated
+        return (term in text) and not has_negated(term)
+
+    # ---------- URGENT FLAGS ----------
+    urgent = 0
+    # septic arthritis / infection
+    if any(present(t) for t in ["fever", "rigors", "chills", "hot swollen joint", "erythema", "sepsis", "septic"]):
+        urgent += 3
+    # fracture / dislocation / unable to weight-bear after trauma
+    if any(present(t) for t in ["deformity", "audible crack", "unable to weight-bear", "dislocation"]) or has(r"\bfracture\b"):
+        urgent += 3
+    # neurovascular
+    if any(present(t) for t in ["numbness", "foot drop", "pins and needles", "cold foot", "pale foot", "weak pulse"]):
+        urgent += 2
+    # DVT/PE risk
+    if any(present(t) for t in ["calf swelling", "calf tenderness", "sudden breathlessness", "pleuritic chest pain"]):
+        urgent += 2
+    # cancer red flags
+    if any(present(t) for t in ["unexplained weight loss", "night sweats", "history of cancer"]) and any(present(t) for t in ["night pain", "rest pain"]):
+        urgent += 2
+    if urgent >= 3:
+        return {"pathway": "urgent_ed", "urgent": urgent, "age": age, "scores": {}}
+
+    # ---------- SOFT-TISSUE ORTHO ----------
+    soft_tissue = 0
+    # instability / giving way / dislocation / patellar instability
+    if any(present(t) for t in ["instability", "giving way", "dislocation", "pops out", "kneecap out", "patellar instability"]):
+        soft_tissue += 3
+    # true mechanical block
+    if (present("true locking") or present("won't move") or present("completely stuck")) and not present("no true locking"):
+        soft_tissue += 3
+    # traumatic mechanism with persistent symptoms >6–12 weeks
+    if any(present(t) for t in ["pivot", "twist", "dashboard", "skiing", "tackle", "contact injury"]):
+        soft_tissue += 2
+    if any(present(t) for t in ["acl", "pcl", "mcl", "lcl", "mpfl", "meniscal tear", "bucket handle", "rupture", "torn ligament", "ligament tear", "posterolateral corner"]):
+        soft_tissue += 3
+    if any(present(t) for t in ["failed physio", "failed physiotherapy", "completed 12 weeks physio", "persistent despite rehab"]):
+        soft_tissue += 2
+    # age bias (younger patients more likely soft tissue pathway)
+    if age < 50:
+        soft_tissue += 1
+
+    # ---------- ARTHROPLASTY ----------
+    arthro = 0
+    # radiographic OA markers
+    if any(present(t) for t in [
+        "kellgren", "joint space narrowing", "osteophytes", "tricompartmental oa",
+        "bone-on-bone", "end-stage", "severe degenerative osteoarthritis", "advanced oa"
+    ]) or ("osteoarthritis" in text and any(present(t) for t in ["severe", "advanced", "end-stage"])):
+        arthro += 3
+    # age and severity
+    if age >= 55:
+        arthro += 1
+    # functional collapse
+    if any(present(t) for t in ["daily function severely limited", "unable to manage stairs", "housebound", "walking distance < 200m", "needs two sticks"]):
+        arthro += 2
+    # persistent night/rest pain most nights
+    if present("night pain") or present("rest pain"):
+        arthro += 1
+    # failed non-op incl. injections / multiple physio rounds
+    if any(present(t) for t in ["failed conservative", "failed non-operative", "steroid injection with short-lived relief", "multiple courses of physio"]):
+        arthro += 1
+
+    # ---------- MSK PHYSIO ----------
+    physio = 0
+    if any(present(t) for t in ["patellofemoral pain", "pfps", "chondromalacia", "iliotibial band", "itbs", "tendinopathy", "pes anserine", "bursitis"]):
+        physio += 2
+    if any(present(t) for t in ["degenerative meniscal tear", "meniscal signal", "small tear"]) and present("no true locking"):
+        physio += 2
+    if any(present(t) for t in ["mild symptoms", "manageable", "can still work", "no instability", "no giving way"]):
+        physio += 1
+    # short duration or early rehab
+    if any(present(t) for t in ["< 12 weeks", "six weeks", "8 weeks"]) or any(present(t) for t in ["early rehab", "starting physio", "conservative management"]):
+        physio += 1
+    if age < 55 and not any(present(t) for t in ["night pain", "rest pain"]):
+        physio += 1
+
+    # ---------- GP / PRIMARY ----------
+    gp = 0
+    if "osteoarthritis" in text and arthro < 3:
+        gp += 2  # likely OA management optimization rather than surgery
+    if any(present(t) for t in ["analgesia review", "weight loss", "activity modification", "home exercise", "injection discussion"]):
+        gp += 1
+    if not any(present(t) for t in ["instability", "giving way", "true locking"]) and physio == 0:
+        gp += 1
+
+    # ---------- PICK PATHWAY WITH PRIORITY ----------
+    # Priority order: urgent_ed > soft_tissue > arthroplasty > msk_physio > gp_primary
+    scores = {
+        "orthopaedic_soft_tissue": soft_tissue,
+        "arthroplasty": arthro,
+        "msk_physio": physio,
+        "gp_primary": gp,
+    }
+
+    # If any strong soft-tissue signal, prefer that over arthro if age <55 and no OA imaging
+    if soft_tissue >= 4 and not ("advanced" in text or "end-stage" in text or "bone-on-bone" in text):
+        best = "orthopaedic_soft_tissue"
+    else:
+        best = max(scores, key=scores.get)
+
+    # Safe default if everything is low-signal
+    if all(v == 0 for v in scores.values()):
+        best = "msk_physio"
+
+    return {"pathway": best, "urgent": urgent, "age": age, "scores": scores}
+
+
+def apply_triage_guardrails(patient_data: Dict[str, Any], conversation_text: str) -> str:
+    """Return the referral pathway for the patient data and conversation text."""
+    return score_triage_guardrails(patient_data, conversation_text)["pathway"]
+
+
+def pathway_locked(guardrails: Dict[str, Any]) -> bool:
+    """
+    True if no further answer can move the patient to another pathway.
+
+    Later answers only add text, so a rival could at most reach its maximum score.
+    Any other leader can still be overridden by soft-tissue evidence, so only a
+    clear soft-tissue pathway is ever locked. The age rules can flip once the age
+    is known, so an unknown age never locks. An urgent score never locks either:
+    its keywords ignore history ("a fracture 20 years ago"), so the triage agent
+    only trusts one from the red flag answer itself.
+    """
+    if guardrails["pathway"] != "orthopaedic_soft_tissue" or not guardrails["age"]:
+        return False
+
+    soft_tissue = guardrails["scores"]["orthopaedic_soft_tissue"]
+    return all(soft_tissue > MAX_PATHWAY_SCORES[pathway]
+               for pathway in guardrails["scores"] if pathway != "orthopaedic_soft_tissue")
@@ -0,0 +1,69 @@
+"""
+Typed outputs for the structured LLM stages.
+
+The differential diagnosis and triage classification are requested from Ollama as
+JSON matching these models, validated, and rendered back to the markdown layout
+the UI and conversation logs already use.
+"""
+
+from typing import List, Literal
+from pydantic import BaseModel, Field
+
+REFERRAL_TYPES = ["urgent_ed", "swleoc", "physio", "gp"]
+
+
+class DiagnosisEntry(BaseModel):
+    diagnosis: str
+    confidence: Literal["High", "Moderate", "Low"]
+    supporting_features: List[str] = Field(default_factory=list)
+
+
+class DifferentialDiagnosis(BaseModel):
+    diagnoses: List[DiagnosisEntry] = Field(min_length=1, max_length=3)
+    red_flags: List[str] = Field(default_factory=list)
+    follow_up: str = ""
+
+    def to_markdown(self) -> str:
+        lines = ["---", "**DIFFERENTIAL DIAGNOSIS (Top 3):**", ""]
+        for rank, (title, entry) in enumerate(zip(["PRIMARY", "SECONDARY", "TERTIARY"], self.diagnoses), 1):
+            lines += [
+                f"**{rank}. {title} DIAGNOSIS:**",
+                f"- **Diagnosis:** {entry.diagnosis}",
+                f"- **Confidence:** {entry.confidence}",
+                f"- **Key Supporting Features:** {', '.join(entry.supporting_features) or 'Not specified'}",
+                "",
+            ]
+        lines.append("**RED FLAG CONSIDERATIONS:**")
+        lines += [f"- {flag}" for flag in self.red_flags] or ["- None identified"]
+        lines += [
+            "",
+            "**SAFETY NET:**",
+            "- **Urgent Care:** If symptoms worsen suddenly, or new red flags occur (severe weakness, fever, "
+            "bladder/bowel problems, severe pain), seek urgent care immediately.",
+            f"- **Follow-up:** {self.follow_up or 'As advised by the receiving service'}",
+        ]
+        return "\n".join(lines)
+
+
+class TriageClassification(BaseModel):
+    category: Literal["Soft Tissue", "Arthroplasty"]
+    body_part: str
+    specialty: str
+    referral_type: Literal["urgent_ed", "swleoc", "physio", "gp"]
+    clinical_reasoning: str
+
+    def decision(self) -> str:
+        """One-line triage decision for referral letter prompts."""
+        return f"Category: {self.category} - {self.specialty} (referral: {self.referral_type})"
+
+    def to_markdown(self) -> str:
+        return "\n".join([
+            "---",
+            "**TRIAGE CLASSIFICATION:**",
+            "",
+            f"**Category:** {self.category}",
+            f"**Body Part:** {self.body_part}",
+            f"**Specialty:** {self.specialty}",
+            f"**Referral:** {self.referral_type}",
+            f"**Clinical Reasoning:** {self.clinical_reasoning}",
+        ])
@@ -1,14 +1,55 @@
 import streamlit as st
-import requests
 import json
+import uuid
+from websockets.sync.client import connect
+
+TRIAGE_WS_URL = "ws://triage_app:8000/ws/triage"
 
 # Set the title for the Streamlit app
 st.title("SWLEOC MSK Triage Chatbot")
 st.markdown("**AI-Powered Musculoskeletal Assessment with Questionnaire-Based Triage**")
 
-# Initialize chat history in session state
+# Conversation id lets the backend keep the session (and a rolling summary) while we chat
+if "conversation_id" not in st.session_state:
+    st.session_state.conversation_id = str(uuid.uuid4())
+
+
+def open_connection():
+    """Open the conversation WebSocket and return it with the question the server is waiting on."""
+    ws = connect(f"{TRIAGE_WS_URL}?conversation_id={st.session_state.conversation_id}&model=llama3.1:8b")
+    st.session_state.ws = ws
+    return ws, json.loads(ws.recv())["content"]
+
+
+def send_message(content: str) -> dict:
+    """Send a patient message over the WebSocket, reconnecting once if the connection dropped."""
+    try:
+        st.session_state.ws.send(json.dumps({"type": "message", "content": content}))
+    except Exception:
+        open_connection()  # The server repeats its last question on resume
+        st.session_state.ws.send(json.dumps({"type": "message", "content": content}))
+    return json.loads(st.session_state.ws.recv())
+
+
+def summary_tokens():
+    """Yield streamed summary tokens until the server reports the summary is done."""
+    while True:
+        event = json.loads(st.session_state.ws.recv())
+        if event["type"] == "summary_token":
+            yield event["content"]
+        elif event["type"] in ("summary_done", "error"):
+            st.session_state.summary_event = event
+            return
+
+
+# Initialize chat history in session state with the server's greeting
 if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Hello! I'm Leo, an AI assistant from SWLEOC. I'll help you with a structured musculoskeletal assessment using specialized questionnaires. To start, could you please describe your main musculoskeletal problem or concern?"}]
+    try:
+        _, greeting = open_connection()
+    except Exception as e:
+        st.error(f"Could not connect to the backend: {e}")
+        st.stop()
+    st.session_state.messages = [{"role": "assistant", "content": greeting}]
 
 # Display prior chat messages
 for message in st.session_state.messages:
@@ -25,42 +66,34 @@ if prompt := st.chat_input("Describe your musculoskeletal problem..."):
     # --- This is the main logic block ---
     with st.chat_message("assistant"):
         # 1. Get the next question from the conversational agent
+        event = {}
         with st.spinner("Analyzing your response..."):
             try:
-                ask_url = "http://triage_app:8000/ask"
-                payload = {"messages": st.session_state.messages, "model": "llama3.1:8b"}
-                response = requests.post(ask_url, json=payload)
-                response.raise_for_status()
-                
-                assistant_response = response.json().get("response", "Sorry, I encountered an error.")
+                event = send_message(prompt)
+                if event["type"] == "error":
+                    assistant_response = f"Error: {event['detail']}"
+                else:
+                    assistant_response = event["content"]
                 st.markdown(assistant_response)
                 st.session_state.messages.append({"role": "assistant", "content": assistant_response})
 
-            except requests.exceptions.RequestException as e:
+            except Exception as e:
                 st.error(f"Could not connect to the backend: {e}")
                 assistant_response = "Error: Could not connect to the backend."
                 st.session_state.messages.append({"role": "assistant", "content": assistant_response})
 
-        # 2. Check if the conversation is now complete
-        if "clinical summary with differential diagnosis will be prepared" in assistant_response:
-            # 3. If so, automatically call the summarization agent
-            with st.spinner("Assessment complete. Generating SBAR clinical summary and differential diagnosis..."):
-                try:
-                    summarize_url = "http://triage_app:8000/summarize"
-                    payload = {"messages": st.session_state.messages, "model": "llama3.1:8b"}
-                    summary_response = requests.post(summarize_url, json=payload)
-                    summary_response.raise_for_status()
-
-                    summary_text = summary_response.json().get("response", "Could not generate summary.")
-                    
-                    # Display the final summary with better formatting
-                    st.markdown("---") # Add a separator for clarity
-                    st.markdown("## 📋 Clinical Assessment Summary")
-                    st.markdown(summary_text)
-                    st.session_state.messages.append({"role": "assistant", "content": summary_text})
-
-                except requests.exceptions.RequestException as e:
-                    st.error(f"Could not connect to the summarization service: {e}")
+        # 2. Once the conversation is complete the server streams the summary straight away
+        if event.get("state") == "COMPLETE":
+            st.markdown("---") # Add a separator for clarity
+            st.markdown("## 📋 Clinical Assessment Summary")
+            try:
+                summary_text = st.write_stream(summary_tokens())
+                st.session_state.messages.append({"role": "assistant", "content": summary_text})
+                if st.session_state.get("summary_event", {}).get("degraded"):
+                    st.warning("The language model is currently unavailable. This summary was built from rule-based "
+                               "triage only - please review the conversation.")
+            except Exception as e:
+                st.error(f"Could not receive the clinical summary: {e}")
 
 # Add sidebar with information about the system
 with st.sidebar:
@@ -86,5 +119,8 @@ with st.sidebar:
     """)
     
     if st.button("🔄 Start New Assessment"):
-        st.session_state.messages = [{"role": "assistant", "content": "Hello! I'm Leo, an AI assistant from SWLEOC. I'll help you with a structured musculoskeletal assessment using specialized questionnaires. To start, could you please describe your main musculoskeletal problem or concern?"}]
+        if st.session_state.get("ws") is not None:
+            st.session_state.ws.close()
+        del st.session_state.messages
+        st.session_state.conversation_id = str(uuid.uuid4())
         st.rerun()
\ No newline at end of file
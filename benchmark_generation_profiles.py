@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark generation profiles against a running Ollama.
+
+Each stage (SBAR, differential, classification, referral letters, patient turns)
+is run several times under each preset on the same saved conversation, and the
+latency and output stability (how similar repeated outputs are) are compared.
+
+Usage: python benchmark_generation_profiles.py [--presets default fast] [--repeats 5]
+
+Add --cassette run.jsonl.gz to record the run; add --replay (and --zero-latency) to
+re-run it offline from the recording.
+"""
+
+import argparse
+import asyncio
+import difflib
+import glob
+import json
+import os
+import re
+import sys
+import time
+from itertools import combinations
+from typing import Awaitable, Callable, Dict, List
+
+# Add the app directory to the path so we can import the agents directly
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from app.generation_profiles import (
+    configure_generation_profiles, get_generation_profile, SBAR_STAGE, DIFFERENTIAL_STAGE,
+    CLASSIFICATION_STAGE, PATIENT_TURN_STAGE, REFERRAL_LETTER_TYPES, referral_letter_stage,
+)
+from app.llm_cassette import configure_cassette
+from app.summarization_agent import SummarizationAgent
+from app.referral_letter_agent import ReferralLetterAgent
+from patient_simulator_ollama import PatientSimulator, load_patient_cases, parse_conversation_log
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def stability(outputs: List[str]) -> float:
+    """Mean pairwise similarity of repeated outputs (1.0 = identical every time)."""
+    if len(outputs) < 2:
+        return 1.0
+    ratios = [difflib.SequenceMatcher(None, a, b).ratio() for a, b in combinations(outputs, 2)]
+    return sum(ratios) / len(ratios)
+
+
+def category_agreement(outputs: List[str]) -> float:
+    """Share of classification outputs that agree with the most common category."""
+    categories = []
+    for output in outputs:
+        match = re.search(r"\*\*Category:\*\*\s*([^\n*]+)", output)
+        categories.append(match.group(1).strip().lower() if match else "")
+    most_common = max(set(categories), key=categories.count)
+    return categories.count(most_common) / len(categories)
+
+
+async def as_text(structured: Awaitable) -> str:
+    """Render a structured stage result for comparison; invalid JSON counts as an error."""
+    result = await structured
+    return result.to_markdown() if result is not None else "Error: no valid JSON"
+
+
+async def time_stage(run: Callable[[], Awaitable[str]], repeats: int) -> Dict:
+    latencies, outputs = [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        outputs.append(await run())
+        latencies.append(time.perf_counter() - started)
+    return {
+        "mean_s": sum(latencies) / len(latencies),
+        "p50_s": percentile(latencies, 0.5),
+        "p95_s": percentile(latencies, 0.95),
+        "stability": stability(outputs),
+        "errors": sum(1 for output in outputs if output.startswith("Error")),
+        "outputs": outputs,
+    }
+
+
+async def benchmark_preset(preset: str, messages: List[Dict[str, str]], repeats: int) -> Dict[str, Dict]:
+    configure_generation_profiles(preset)
+    summarizer = SummarizationAgent()
+    letters = ReferralLetterAgent()
+    simulator = PatientSimulator()
+    simulator.load_patient_data(load_patient_cases("patient_cases.json")[0])
+    first_question = next((m["content"] for m in messages if m["role"] == "assistant"), "How can I help?")
+
+    results = {SBAR_STAGE: await time_stage(lambda: summarizer.generate_sbar_summary(messages), repeats)}
+    # Later stages read the same summary so only the profile varies between presets
+    summary = results[SBAR_STAGE]["outputs"][0]
+    results[DIFFERENTIAL_STAGE] = await time_stage(
+        lambda: as_text(summarizer.generate_structured_differential(summary)), repeats)
+    results[CLASSIFICATION_STAGE] = await time_stage(
+        lambda: as_text(summarizer.generate_structured_classification(summary)), repeats)
+    results[CLASSIFICATION_STAGE]["category_agreement"] = category_agreement(results[CLASSIFICATION_STAGE]["outputs"])
+    classification = results[CLASSIFICATION_STAGE]["outputs"][0]
+    for letter_type in REFERRAL_LETTER_TYPES:
+        results[referral_letter_stage(letter_type)] = await time_stage(
+            lambda: letters.generate_referral_letter(summary, classification, messages, letter_type), repeats)
+    results[PATIENT_TURN_STAGE] = await time_stage(lambda: simulator.get_patient_response(first_question), repeats)
+    return results
+
+
+def print_report(all_results: Dict[str, Dict[str, Dict]]):
+    print(f"\n{'Stage':<26}{'Preset':<10}{'Model':<14}{'Mean s':>8}{'p50 s':>8}{'p95 s':>8}{'Stable':>8}{'Errors':>8}")
+    stages = next(iter(all_results.values())).keys()
+    for stage in stages:
+        for preset, results in all_results.items():
+            configure_generation_profiles(preset)
+            model = get_generation_profile(stage).model_for("llama3.1:8b")
+            r = results[stage]
+            print(f"{stage:<26}{preset:<10}{model:<14}{r['mean_s']:>8.2f}{r['p50_s']:>8.2f}"
+                  f"{r['p95_s']:>8.2f}{r['stability']:>8.2f}{r['errors']:>8}")
+            if "category_agreement" in r:
+                print(f"{'':<50}category agreement {r['category_agreement']:.0%}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare generation profiles per stage")
+    parser.add_argument("--presets", nargs="+", default=["default", "fast"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--log", help="Conversation log to benchmark on (default: first in conversation_logs/)")
+    parser.add_argument("--output", help="Write full results, including outputs, to this JSON file")
+    parser.add_argument("--cassette", help="Record LLM calls to this cassette (or replay them with --replay)")
+    parser.add_argument("--replay", action="store_true", help="Serve LLM calls from --cassette instead of Ollama")
+    parser.add_argument("--zero-latency", action="store_true", help="With --replay, skip the recorded latencies")
+    args = parser.parse_args()
+
+    if args.cassette:
+        configure_cassette(args.cassette, "replay" if args.replay else "record",
+                           "zero" if args.zero_latency else "original")
+
+    log_path = args.log or sorted(glob.glob(os.path.join("conversation_logs", "*.txt")))[0]
+    messages = parse_conversation_log(log_path)
+    print(f"Benchmarking {', '.join(args.presets)} on {os.path.basename(log_path)} ({args.repeats} repeats per stage)")
+
+    all_results = {}
+    for preset in args.presets:
+        print(f"Running preset '{preset}'...")
+        all_results[preset] = await benchmark_preset(preset, messages, args.repeats)
+
+    print_report(all_results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(all_results, f, indent=2)
+        print(f"\nFull results written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Compare templated referral letters with letters written entirely by the LLM.
+
+Each letter type is generated both ways for each saved conversation, and the
+latency and generated tokens are reported. The letter store is cleared before
+every letter so nothing is served from cache. Set LLM_CASSETTE to replay a
+recorded run instead of calling Ollama.
+
+--offline needs no model: for each letter it reports the prompt sizes of both
+variants and the tokens the templated letter fills in without the model, with
+the decode time that saves at --decode-tps (an assumed rate, not a measurement).
+
+Usage: python benchmark_referral_letters.py [--logs 3] [--types swleoc physio gp] [--offline [--decode-tps 25]]
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+from typing import Dict, List
+
+# Add the app directory to the path so we can import the agents directly
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from app.generation_profiles import get_generation_profile
+from app.letter_renderer import clinical_sections_prompt, letter_facts, llm_sections, render_letter
+from app.letter_store import configure_letter_store
+from app.referral_letter_agent import ReferralLetterAgent, referral_letter_stage
+from app.transcript_compaction import compact_transcript, estimate_tokens
+from patient_simulator_ollama import parse_conversation_log
+
+
+async def time_letter(templated: bool, messages: List[Dict], letter_type: str) -> Dict:
+    store = configure_letter_store(None)
+    agent = ReferralLetterAgent(templated=templated)
+    # The summary stands in for the SBAR; both variants get the same one
+    summary = "\n".join(msg["content"] for msg in messages if msg["role"] == "user")[:2000]
+    started = time.perf_counter()
+    letter = await agent.generate_referral_letter(summary, "Referral", messages, letter_type)
+    seconds = time.perf_counter() - started
+    generated = next(iter(store.letters.values()), {}).get("letter", "")
+    return {"seconds": seconds, "generated_tokens": estimate_tokens(generated), "letter_tokens": estimate_tokens(letter),
+            "error": letter.startswith("Error")}
+
+
+def letter_costs(messages: List[Dict], letter_type: str) -> Dict:
+    """Prompt tokens of each variant and the letter tokens the templates fill in, without calling the model."""
+    agent = ReferralLetterAgent()
+    summary = "\n".join(msg["content"] for msg in messages if msg["role"] == "user")[:2000]
+    excerpt = compact_transcript(messages, get_generation_profile(referral_letter_stage(letter_type)).transcript_tokens)["text"]
+    free_prompt = getattr(agent, f"{letter_type}_referral_prompt_template").format(
+        clinical_summary=summary, triage_decision="Referral", conversation_excerpt=excerpt)
+    templated_prompt = clinical_sections_prompt(letter_type, summary, "Referral", excerpt)
+
+    started = time.perf_counter()
+    facts = letter_facts(messages, agent._extract_patient_data_from_conversation(messages))
+    placeholder = "Not available from the triage assessment."
+    rendered = render_letter(letter_type, facts, {heading: placeholder for heading in llm_sections(letter_type)})
+    render_ms = (time.perf_counter() - started) * 1000
+    filled = estimate_tokens(rendered) - len(llm_sections(letter_type)) * estimate_tokens(placeholder)
+    return {"free_prompt": estimate_tokens(free_prompt), "templated_prompt": estimate_tokens(templated_prompt),
+            "filled_tokens": filled, "render_ms": render_ms}
+
+
+def report_offline(logs: List[str], types: List[str], decode_tps: float):
+    print(f"{'Case':<40}{'Type':<8}{'Prompt free':>12}{'Prompt tmpl':>12}{'Not generated':>14}"
+          f"{'Render ms':>10}{'Saved s':>9}")
+    rows = []
+    for log_path in logs:
+        messages = parse_conversation_log(log_path)
+        for letter_type in types:
+            r = letter_costs(messages, letter_type)
+            rows.append(r)
+            print(f"{os.path.basename(log_path)[:38]:<40}{letter_type:<8}{r['free_prompt']:>12}{r['templated_prompt']:>12}"
+                  f"{r['filled_tokens']:>14}{r['render_ms']:>10.2f}{r['filled_tokens'] / decode_tps:>9.1f}")
+    if rows:
+        filled = sum(r["filled_tokens"] for r in rows) / len(rows)
+        print(f"\nMean per letter: {filled:.0f} tokens filled from templates instead of generated, "
+              f"{sum(r['render_ms'] for r in rows) / len(rows):.2f} ms to render them; "
+              f"about {filled / decode_tps:.1f}s of decoding saved at an assumed {decode_tps:g} tokens/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Templated vs free-form referral letters")
+    parser.add_argument("--logs", type=int, default=3, help="Number of conversation logs to use")
+    parser.add_argument("--types", nargs="+", default=["swleoc", "physio", "gp"])
+    parser.add_argument("--offline", action="store_true", help="Report prompt and template sizes without a model")
+    parser.add_argument("--decode-tps", type=float, default=25.0, help="Assumed decode rate for --offline")
+    args = parser.parse_args()
+
+    logs = sorted(glob.glob(os.path.join("conversation_logs", "*.txt")))[:args.logs]
+    if args.offline:
+        report_offline(logs, args.types, args.decode_tps)
+        return
+    totals = {mode: {"seconds": 0.0, "generated_tokens": 0, "letters": 0} for mode in ("free-form", "templated")}
+    print(f"{'Case':<40}{'Type':<8}{'Mode':<11}{'Seconds':>9}{'Generated':>11}{'Letter':>8}")
+    for log_path in logs:
+        messages = parse_conversation_log(log_path)
+        for letter_type in args.types:
+            for mode in ("free-form", "templated"):
+                r = await time_letter(mode == "templated", messages, letter_type)
+                flag = "  (error)" if r["error"] else ""
+                print(f"{os.path.basename(log_path)[:38]:<40}{letter_type:<8}{mode:<11}{r['seconds']:>9.1f}"
+                      f"{r['generated_tokens']:>11}{r['letter_tokens']:>8}{flag}")
+                if not r["error"]:
+                    totals[mode]["seconds"] += r["seconds"]
+                    totals[mode]["generated_tokens"] += r["generated_tokens"]
+                    totals[mode]["letters"] += 1
+
+    print()
+    for mode, t in totals.items():
+        if t["letters"]:
+            print(f"{mode:<11} mean {t['seconds'] / t['letters']:.1f}s, "
+                  f"{t['generated_tokens'] / t['letters']:.0f} generated tokens per letter")
+    free, templated = totals["free-form"], totals["templated"]
+    if free["letters"] and templated["letters"]:
+        print(f"Templated letters: {1 - (templated['seconds'] / templated['letters']) / (free['seconds'] / free['letters']):.0%} "
+              f"less time, {1 - (templated['generated_tokens'] / templated['letters']) / (free['generated_tokens'] / free['letters']):.0%} "
+              f"fewer generated tokens")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
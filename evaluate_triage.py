@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end evaluation of triage routing.
+
+Every case in patient_cases.json (interviewed with scripted answers) and, with
+--store, every stored conversation that has an expected triage (e.g. imported
+logs) is run through extraction, the questionnaire engine and the guardrails in
+parallel worker processes, then through the summary stages: rule-based ("fake"),
+replayed from an LLM cassette, recorded against Ollama, or skipped.
+
+The report is a confusion matrix of the expected referral (from each case's
+expected_triage) against the pathway produced, the classifier's referral accuracy
+(replay and record only: the fake summary's referral is the guardrail pathway, so
+it is timed but not scored), and latency percentiles per stage. Runs are saved as JSON so two can be diffed:
+
+  python evaluate_triage.py --output before.json
+  (change a spec or the guardrails)
+  python evaluate_triage.py --output after.json
+  python evaluate_triage.py --diff before.json after.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Add the app directory to the path so we can import the agents directly
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from app.conversation_store import expected_referral_type, configure_conversation_store
+from app.llm_cassette import configure_cassette
+from app.questionnaire_engine import run_questionnaire_engine
+from app.questionnaire_specs import get_questionnaire_form
+from app.summarization_agent import SummarizationAgent
+from app.triage_agent import TriageAgent, select_questionnaire
+from app.triage_guardrails import score_triage_guardrails, PATHWAY_LABELS, PATHWAY_REFERRAL_TYPES
+from benchmark_generation_profiles import percentile
+from patient_simulator_ollama import load_patient_cases, replay_case
+
+LLM_MODES = ["none", "fake", "replay", "record"]
+# Modes where a real classifier picks the referral; "fake" only repeats the guardrails
+CLASSIFIER_MODES = ["replay", "record"]
+REFERRAL_TYPES = ["urgent_ed", "swleoc", "physio", "gp"]
+PATHWAYS = list(PATHWAY_LABELS)
+
+
+# --- Cases ---
+def load_cases(cases_file: Optional[str], store_path: Optional[str]) -> List[Dict[str, Any]]:
+    """Evaluation items: scripted patient cases, then stored conversations with an expected triage."""
+    items = []
+    if cases_file:
+        for case in load_patient_cases(cases_file):
+            items.append({"id": case.case_id, "source": cases_file, "expected_triage": case.expected_triage,
+                          "case": case})
+    if store_path:
+        store = configure_conversation_store(store_path)
+        for row in store.find():
+            if row["expected_triage"]:
+                items.append({"id": row["id"], "source": f"store:{row['case_id'] or ''}",
+                              "expected_triage": row["expected_triage"],
+                              "messages": [{"role": m["role"], "content": m["content"]}
+                                           for m in store.messages(row["id"])]})
+    return items
+
+
+# --- Stages ---
+def _timed(timings: Dict[str, float], stage: str, run):
+    started = time.perf_counter()
+    result = run()
+    timings[stage] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def evaluate_case(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one case through the deterministic stages; runs in the worker processes."""
+    timings: Dict[str, float] = {}
+    messages = item.get("messages")
+    if messages is None:
+        messages = _timed(timings, "interview", lambda: replay_case(item["case"]))
+    user_messages = [msg["content"] for msg in messages if msg["role"] == "user"]
+
+    patient_data = _timed(timings, "extraction", lambda: TriageAgent()._extract_patient_data(messages))
+
+    def engine():
+        form = get_questionnaire_form(select_questionnaire(user_messages[0] if user_messages else ""))
+        try:
+            return run_questionnaire_engine(form["spec"], patient_data) if form else {}
+        except Exception as e:
+            return {"error": str(e)}
+    engine_output = _timed(timings, "engine", engine)
+    guardrails = _timed(timings, "guardrails", lambda: score_triage_guardrails(patient_data, " ".join(user_messages)))
+
+    return {
+        "id": item["id"],
+        "source": item["source"],
+        "expected_triage": item["expected_triage"],
+        "expected": expected_referral_type(item["expected_triage"]),
+        "pathway": guardrails["pathway"],
+        "referral_type": PATHWAY_REFERRAL_TYPES[guardrails["pathway"]],
+        "engine_route": engine_output.get("route"),
+        "engine_error": engine_output.get("error"),
+        "timings_ms": timings,
+        "messages": messages,
+    }
+
+
+async def run_llm_stage(results: List[Dict[str, Any]], mode: str, concurrency: int):
+    """Add the summary stage's latency to each result, and its classification if a real classifier ran."""
+    agent = SummarizationAgent()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def summarise(result):
+        async with semaphore:
+            started = time.perf_counter()
+            if mode == "fake":
+                summary = agent.build_degraded_summary(result["messages"])
+            else:
+                summary = await agent.summarize_and_triage_structured(result["messages"])
+            result["timings_ms"]["summary"] = (time.perf_counter() - started) * 1000
+        if mode not in CLASSIFIER_MODES:
+            return
+        classification = summary["classification"]
+        result["llm_referral_type"] = classification.referral_type if classification else None
+        result["llm_degraded"] = summary["degraded"]
+
+    await asyncio.gather(*(summarise(result) for result in results))
+
+
+# --- Reports ---
+def confusion_matrix(results: List[Dict[str, Any]], column: str, columns: List[str]) -> Dict[str, Dict[str, int]]:
+    """Counts of expected referral type (rows, "unknown" if unmapped) against a produced column."""
+    matrix: Dict[str, Dict[str, int]] = {}
+    for result in results:
+        row = matrix.setdefault(result["expected"] or "unknown", {name: 0 for name in columns})
+        value = result.get(column) or "none"
+        row[value] = row.get(value, 0) + 1
+    return matrix
+
+
+def accuracy(results: List[Dict[str, Any]], column: str) -> Optional[float]:
+    scored = [r for r in results if r["expected"] and r.get(column) is not None]
+    if not scored:
+        return None
+    return sum(1 for r in scored if r[column] == r["expected"]) / len(scored)
+
+
+def latency_percentiles(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    stages: Dict[str, List[float]] = {}
+    for result in results:
+        for stage, ms in result["timings_ms"].items():
+            stages.setdefault(stage, []).append(ms)
+    return {stage: {"n": len(values), "mean_ms": round(sum(values) / len(values), 3),
+                    "p50_ms": round(percentile(values, 0.5), 3), "p95_ms": round(percentile(values, 0.95), 3),
+                    "p99_ms": round(percentile(values, 0.99), 3), "max_ms": round(max(values), 3)}
+            for stage, values in stages.items()}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def evaluate(items: List[Dict[str, Any]], llm: str = "fake", workers: Optional[int] = None,
+             concurrency: int = 4) -> Dict[str, Any]:
+    """Run every item and build the run report (cases, confusion matrices, accuracy, latency)."""
+    started = time.perf_counter()
+    if workers == 1:
+        results = [evaluate_case(item) for item in items]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(evaluate_case, items, chunksize=4))
+    if llm != "none":
+        asyncio.run(run_llm_stage(results, llm, concurrency))
+    for result in results:
+        result.pop("messages")
+
+    return {
+        "run": {"at": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "llm": llm,
+                "cases": len(results), "seconds": round(time.perf_counter() - started, 2)},
+        "accuracy": {"guardrails": accuracy(results, "referral_type"),
+                     "classification": accuracy(results, "llm_referral_type")},
+        "confusion": {"pathway": confusion_matrix(results, "pathway", PATHWAYS),
+                      "classification": confusion_matrix(results, "llm_referral_type", REFERRAL_TYPES)
+                      if llm in CLASSIFIER_MODES else None},
+        "latency": latency_percentiles(results),
+        "cases": results,
+    }
+
+
+def print_matrix(title: str, matrix: Dict[str, Dict[str, int]]):
+    columns = list(dict.fromkeys(name for row in matrix.values() for name in row))
+    print(f"\n{title} (rows: expected, columns: produced)")
+    print(f"{'':<12}" + "".join(f"{name[:12]:>13}" for name in columns))
+    for expected in REFERRAL_TYPES + ["unknown"]:
+        if expected in matrix:
+            print(f"{expected:<12}" + "".join(f"{matrix[expected].get(name, 0):>13}" for name in columns))
+
+
+def print_report(report: Dict[str, Any]):
+    run = report["run"]
+    print(f"Evaluated {run['cases']} cases in {run['seconds']}s (llm: {run['llm']}, commit {run['commit']})")
+    for name, value in report["accuracy"].items():
+        if value is not None:
+            print(f"{name.title()} referral accuracy: {value:.1%}")
+    print_matrix("Guardrail pathway", report["confusion"]["pathway"])
+    if report["confusion"]["classification"]:
+        print_matrix("Classifier referral type", report["confusion"]["classification"])
+    print(f"\n{'Stage':<12}{'n':>5}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in report["latency"].items():
+        print(f"{stage:<12}{stats['n']:>5}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+
+# --- Diffs ---
+def diff_runs(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """Accuracy and latency changes between two runs, and the cases whose routing changed."""
+    old_cases = {case["id"]: case for case in before["cases"]}
+    changed = []
+    for case in after["cases"]:
+        old = old_cases.get(case["id"])
+        if old is None:
+            continue
+        for column in ("pathway", "llm_referral_type"):
+            if old.get(column) != case.get(column):
+                expected_column = "referral_type" if column == "pathway" else column
+                changed.append({
+                    "id": case["id"], "stage": column, "before": old.get(column), "after": case.get(column),
+                    "expected": case["expected"],
+                    "effect": ("fixed" if case.get(expected_column) == case["expected"]
+                               else "broken" if old.get(expected_column) == case["expected"] else "changed"),
+                })
+    latency = {}
+    for stage, stats in after["latency"].items():
+        old = before["latency"].get(stage)
+        if old:
+            latency[stage] = {key: round(stats[key] - old[key], 3) for key in ("p50_ms", "p95_ms", "p99_ms")}
+    accuracy_change = {}
+    for name, value in after["accuracy"].items():
+        old = before["accuracy"].get(name)
+        accuracy_change[name] = None if value is None or old is None else round(value - old, 4)
+    return {"accuracy": accuracy_change, "latency": latency, "changed": changed}
+
+
+def print_diff(before: Dict[str, Any], after: Dict[str, Any]):
+    diff = diff_runs(before, after)
+    print(f"Diff {before['run']['commit']} ({before['run']['at']}) -> {after['run']['commit']} ({after['run']['at']})")
+    for name, change in diff["accuracy"].items():
+        if change is not None:
+            print(f"{name.title()} accuracy: {before['accuracy'][name]:.1%} -> {after['accuracy'][name]:.1%} "
+                  f"({change:+.1%})")
+    print(f"\n{'Stage':<12}{'Δp50 ms':>10}{'Δp95 ms':>10}{'Δp99 ms':>10}")
+    for stage, delta in diff["latency"].items():
+        print(f"{stage:<12}{delta['p50_ms']:>+10.2f}{delta['p95_ms']:>+10.2f}{delta['p99_ms']:>+10.2f}")
+    print(f"\n{len(diff['changed'])} routing change(s)")
+    for change in diff["changed"]:
+        print(f"  [{change['effect']}] {change['id']} {change['stage']}: {change['before']} -> {change['after']} "
+              f"(expected {change['expected']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline accuracy and latency evaluation of triage routing")
+    parser.add_argument("--cases", default="patient_cases.json", help="Patient cases file ('' to skip)")
+    parser.add_argument("--store", help="Also evaluate stored conversations with an expected triage")
+    parser.add_argument("--llm", choices=LLM_MODES, default="fake",
+                        help="Summary stage: rule-based (fake, timed only), replay/record a --cassette, or none")
+    parser.add_argument("--cassette", help="LLM cassette for --llm replay/record")
+    parser.add_argument("--workers", type=int, help="Worker processes for the deterministic stages")
+    parser.add_argument("--concurrency", type=int, default=4, help="Summaries generated at once")
+    parser.add_argument("--output", help="Write the run report to this JSON file")
+    parser.add_argument("--diff", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two saved runs")
+    args = parser.parse_args()
+
+    if args.diff:
+        with open(args.diff[0]) as f_before, open(args.diff[1]) as f_after:
+            print_diff(json.load(f_before), json.load(f_after))
+        return
+
+    if args.llm in ("replay", "record"):
+        if not args.cassette:
+            parser.error("--llm replay/record needs --cassette")
+        configure_cassette(args.cassette, args.llm, "zero" if args.llm == "replay" else "original")
+
+    items = load_cases(args.cases, args.store)
+    report = evaluate(items, args.llm, args.workers, args.concurrency)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRun written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
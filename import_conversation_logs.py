@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Import saved MSK triage conversation logs into the structured conversation store.
+
+Reads the "MSK TRIAGE BOT CONVERSATION LOG" text format (both the original and the
+questionnaire-based layout) from directories, single .txt files and .zip archives;
+zip members are streamed without extracting. Each log becomes one record: the header,
+demographics, timestamped turns, clinical notes, SBAR summary and referral letters.
+Logs are parsed and analysed in parallel worker processes and written to the store
+from this process.
+
+A log is identified by a hash of its content, so the same log found in two places
+(e.g. in a folder and in the zip) is only stored once and re-running an import
+skips what is already there.
+
+Usage: python import_conversation_logs.py [paths ...] [--db conversations.db] [--workers 4]
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Add the app directory to the path so we can import the agents directly
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from app.conversation_store import ConversationStore, analyse_conversation, get_conversation_store, \
+    configure_conversation_store
+from patient_simulator_ollama import parse_conversation_turns
+
+DEFAULT_PATHS = ["conversation_logs", "conversation_logs copy", "ai_generated_conversation_logs.zip"]
+
+LOG_TITLE = "MSK TRIAGE BOT CONVERSATION LOG"
+
+# Section headings and the record field each one fills
+SECTION_HEADINGS = {
+    "PATIENT DEMOGRAPHICS:": "demographics",
+    "PRESENTING COMPLAINT:": "presenting_complaint",
+    "CONVERSATION:": "conversation",
+    "CLINICAL NOTES:": "clinical_notes",
+    "EXPANDED CLINIC LETTER:": "clinic_letter",
+    "SBAR CLINICAL SUMMARY & TRIAGE CLASSIFICATION:": "summary",
+    "CLINICAL SUMMARY": "summary",
+    "REFERRAL LETTERS:": "referral_letters",
+}
+LETTER_HEADING = re.compile(r"^REFERRAL LETTER - ([A-Z_]+):$")
+# Section underlines and separators; short markdown rules ("---") inside a summary are kept
+RULE = re.compile(r"^(={20,}|-{20,})$")
+KEY_VALUE = re.compile(r"^([A-Za-z][A-Za-z ]*): ?(.*)$")
+
+LogSource = Tuple[str, Optional[str]]  # (file or zip path, zip member)
+
+
+# --- Sources ---
+def iter_log_sources(paths: Iterable[str]) -> Iterator[LogSource]:
+    """Every log file under the given directories, files and zip archives, in name order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".txt"):
+                    yield os.path.join(path, name), None
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for member in sorted(archive.namelist()):
+                    if member.endswith(".txt") and not member.startswith("__MACOSX/"):
+                        yield path, member
+        elif os.path.isfile(path):
+            yield path, None
+        else:
+            print(f"Skipping {path}: not found")
+
+
+def source_name(source: LogSource) -> str:
+    path, member = source
+    return f"{path}!{member}" if member else path
+
+
+def iter_lines(source: LogSource) -> Iterator[str]:
+    """Stream a log's lines, reading zip members in place."""
+    path, member = source
+    if member is None:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            yield from f
+    else:
+        with zipfile.ZipFile(path) as archive, archive.open(member) as raw:
+            yield from io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+
+# --- Parsing ---
+def _key(label: str) -> str:
+    return label.strip().lower().replace(" ", "_")
+
+
+def parse_log_lines(lines: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """
+    Parse one log into a record, or None if it is not a triage conversation log.
+
+    Turns get an ISO "at" from the log's date and the turn's time; the record's
+    "content_hash" identifies the log wherever it is stored.
+    """
+    digest = hashlib.sha256()
+    header: Dict[str, str] = {}
+    sections: Dict[str, List[str]] = {}
+    letters: Dict[str, List[str]] = {}
+    section, letter, log_format = None, None, None
+
+    for raw_line in lines:
+        digest.update(raw_line.encode("utf-8"))
+        line = raw_line.rstrip("\r\n")
+        if log_format is None:
+            if not line.strip():
+                continue
+            if not line.startswith(LOG_TITLE):
+                return None
+            log_format = "questionnaire" if "QUESTIONNAIRE" in line else "legacy"
+            section = "header"
+            continue
+        if line.strip() in SECTION_HEADINGS:
+            section = SECTION_HEADINGS[line.strip()]
+            sections.setdefault(section, [])
+            continue
+        if RULE.match(line):
+            continue
+        if section == "header":
+            pair = KEY_VALUE.match(line)
+            if pair:
+                header[_key(pair.group(1))] = pair.group(2).strip()
+        elif section == "referral_letters":
+            heading = LETTER_HEADING.match(line)
+            if heading:
+                letter = heading.group(1).lower()
+                letters[letter] = []
+            elif letter:
+                letters[letter].append(line)
+        else:
+            sections[section].append(line)
+
+    if log_format is None:
+        return None
+
+    demographics = {}
+    for line in sections.get("demographics", []):
+        pair = KEY_VALUE.match(line)
+        if pair:
+            demographics[_key(pair.group(1))] = pair.group(2).strip()
+
+    def text(name: str) -> Optional[str]:
+        body = "\n".join(sections.get(name, [])).strip()
+        return body or None
+
+    logged_at = header.get("date", "").replace(" ", "T") or None
+    messages = parse_conversation_turns(sections.get("conversation", []), with_times=True)
+    for msg in messages:
+        turn_time = msg.pop("time")
+        if logged_at:
+            msg["at"] = f"{logged_at[:10]}T{turn_time}"
+
+    return {
+        "content_hash": digest.hexdigest()[:32],
+        "format": log_format,
+        "case_id": header.get("case_id"),
+        "title": header.get("title"),
+        "logged_at": logged_at,
+        "started_at": next((msg["at"] for msg in messages if msg.get("at")), logged_at),
+        "expected_triage": demographics.pop("expected_triage", None),
+        "demographics": demographics,
+        "presenting_complaint": text("presenting_complaint"),
+        "messages": messages,
+        "clinical_notes": text("clinical_notes"),
+        "clinic_letter": text("clinic_letter"),
+        "summary": text("summary"),
+        "referral_letters": {name: "\n".join(body).strip() for name, body in letters.items()} or None,
+    }
+
+
+def load_log(source: LogSource, analyse: bool = True) -> Optional[Dict[str, Any]]:
+    """Parse (and analyse) one log; run in the worker processes."""
+    try:
+        record = parse_log_lines(iter_lines(source))
+    except (OSError, UnicodeDecodeError, zipfile.BadZipFile) as e:
+        print(f"Error reading {source_name(source)}: {e}")
+        return None
+    if record is None:
+        return None
+    record["path"] = source_name(source)
+    if analyse and record["messages"]:
+        record["analysis"] = analyse_conversation(record["messages"])
+    return record
+
+
+def _load_analysed(source: LogSource) -> Optional[Dict[str, Any]]:
+    return load_log(source)
+
+
+# --- Import ---
+def store_record(store: ConversationStore, record: Dict[str, Any]) -> str:
+    metadata = {
+        "path": record["path"],
+        "format": record["format"],
+        "logged_at": record["logged_at"],
+        "demographics": record["demographics"],
+        "presenting_complaint": record["presenting_complaint"],
+        "clinical_notes": record["clinical_notes"],
+        "clinic_letter": record["clinic_letter"],
+    }
+    return store.record_conversation(
+        record["messages"], case_id=record["case_id"], title=record["title"],
+        expected_triage=record["expected_triage"], started_at=record["started_at"], summary=record["summary"],
+        referral_letters=record["referral_letters"], source=f"log:{record['content_hash']}", metadata=metadata,
+        analysis=record.get("analysis"))
+
+
+def import_logs(paths: Iterable[str], store: ConversationStore, workers: Optional[int] = None,
+                chunksize: int = 8) -> Dict[str, Any]:
+    """Parse every log under paths in a process pool and store the new ones; returns counts and timing."""
+    started = time.perf_counter()
+    sources = list(iter_log_sources(paths))
+    counts = {"logs": len(sources), "imported": 0, "duplicates": 0, "skipped": 0}
+
+    def write(records):
+        for record in records:
+            if record is None or not record["messages"]:
+                counts["skipped"] += 1
+            elif store.has_source(f"log:{record['content_hash']}"):
+                counts["duplicates"] += 1
+            else:
+                store_record(store, record)
+                counts["imported"] += 1
+
+    if workers == 1:
+        write(_load_analysed(source) for source in sources)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            write(pool.map(_load_analysed, sources, chunksize=chunksize))
+
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import conversation logs into the conversation store")
+    parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS,
+                        help="Log directories, .txt files or .zip archives (default: the bundled logs)")
+    parser.add_argument("--db", help="Conversation store to import into (default: CONVERSATION_STORE)")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: one per CPU; 1 parses inline)")
+    args = parser.parse_args()
+
+    store = configure_conversation_store(args.db) if args.db else get_conversation_store()
+    counts = import_logs(args.paths, store, args.workers)
+    print(f"Imported {counts['imported']} of {counts['logs']} logs into {store.path} in {counts['seconds']}s "
+          f"({counts['duplicates']} already stored, {counts['skipped']} skipped)")
+
+
+if __name__ == "__main__":
+    main()
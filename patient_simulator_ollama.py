@@ -7,7 +7,7 @@ pre-defined patient cases and Ollama LLM for generating patient responses.
 """
 
 import asyncio
-import httpx
+import io
 import json
 import time
 import os
@@ -17,12 +17,21 @@ from typing import Dict, List, Optional
 from dataclasses import dataclass
 from colorama import init, Fore, Back, Style
 import random
+import re
+import glob
 
 # Add the app directory to the path so we can import the agents directly
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
-from app.triage_agent import TriageAgent
+from app.triage_agent import TriageAgent, TriageState, SCORED_STATE_FIELDS, PATHWAY_STATES
+from app.triage_guardrails import apply_triage_guardrails
+from app.transcript_compaction import question_state
+from app.generation_profiles import get_generation_profile, PATIENT_TURN_STAGE
+from app.llm_client import LLMPool
+from app.llm_cassette import get_cassette
 from app.summarization_agent import SummarizationAgent
 from app.referral_letter_agent import ReferralLetterAgent
+from app.conversation_store import get_conversation_store
+from app.log_sink import get_log_sink
 
 # Initialize colorama for colored terminal output
 init(autoreset=True)
@@ -42,18 +51,34 @@ class PatientData:
     expanded_clinic_letter: str = ""
 
 class PatientSimulator:
-    """Simulates a patient conversation with the MSK triage bot using Ollama"""
+    """
+    Simulates a patient conversation with the MSK triage bot using Ollama, or with
+    the rule-based patient (responder="rules", or PATIENT_RESPONDER=rules), which
+    answers from the case fields in well under a millisecond per turn.
+    """
     
     def __init__(self, triage_bot_url: str = "http://localhost:8000", 
-                 ollama_url: str = "http://localhost:11434"):
+                 ollama_url: str = "http://localhost:11434",
+                 responder: Optional[str] = None, noise: Optional[float] = None, seed: Optional[int] = None):
         self.triage_bot_url = triage_bot_url
         self.ollama_url = ollama_url
+        self.patient_llm = LLMPool([ollama_url], cassette=get_cassette())
+        self.responder = responder or os.environ.get("PATIENT_RESPONDER", "llm")
+        self.noise = noise if noise is not None else float(os.environ.get("PATIENT_NOISE", "0"))
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.rule_patient = None
+        self.max_exchanges = 30  # Prevent infinite loops; the longest questionnaire has 28 questions
+        # Pause between turns so a live run can be followed; rule-based runs are for speed
+        self.turn_delay = 0.0 if self.responder == "rules" else 1.0
         self.conversation_history = []
         self.patient_data = None
         self.conversation_index = 0
         self.conversation_log = []  # Store all conversation messages for saving
         self.generated_summary = ""  # Store the generated SBAR summary
         self.generated_referral_letters = {}  # Store the generated referral letters
+        self.triage_classification = None  # Validated TriageClassification, if the JSON stage succeeded
+        self.summary_degraded = False  # The summary was rule-based because the LLM was unavailable
         
         # Initialize the agents directly
         self.triage_agent = TriageAgent(model="llama3.1:8b")
@@ -63,9 +88,13 @@ class PatientSimulator:
     def load_patient_data(self, patient_data: PatientData):
         """Load patient data for simulation"""
         self.patient_data = patient_data
+        if self.responder == "rules":
+            self.rule_patient = RuleBasedPatient(patient_data, self.noise, self.rng.randrange(2 ** 32))
         self.conversation_history = []
         self.conversation_log = []
         self.conversation_index = 0
+        self.triage_classification = None
+        self.summary_degraded = False
         
         # Reset the triage agent state for each new simulation
         self.triage_agent = TriageAgent(model="llama3.1:8b")
@@ -146,27 +175,19 @@ PATIENT RESPONSE:"""
         return "\n".join(formatted)
     
     async def get_patient_response(self, bot_question: str) -> str:
-        """Get patient response using Ollama"""
+        """Get patient response using Ollama, or from the case fields with the rule-based responder"""
+        if self.rule_patient is not None:
+            return self.rule_patient.respond(bot_question)
+        
         prompt = self.create_patient_prompt(bot_question)
+        profile = get_generation_profile(PATIENT_TURN_STAGE)
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.ollama_url}/api/generate",
-                    json={
-                        "model": "llama3.1:8b",
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.7,
-                            "top_p": 0.9,
-                            "max_tokens": 100
-                        }
-                    }
-                )
-                response.raise_for_status()
-                ollama_response = response.json()
-                return ollama_response.get("response", "No response from patient LLM.").strip()
+            # Through a pool of its own so patient turns can be recorded and replayed like the agents' calls
+            response = await self.patient_llm.generate(profile.model_for("llama3.1:8b"), prompt, timeout=60.0,
+                                                       stage=PATIENT_TURN_STAGE, options=profile.options(),
+                                                       keep_alive=profile.keep_alive)
+            return response.strip() or "No response from patient LLM."
         except Exception as e:
             return f"Error generating patient response: {e}"
     
@@ -192,10 +213,13 @@ PATIENT RESPONSE:"""
             print(f"{Fore.CYAN}Generating clinical summary...")
             
             # Use the summarization agent directly
-            summary = await self.summarization_agent.summarize_and_triage(self.conversation_history)
+            result = await self.summarization_agent.summarize_and_triage_structured(self.conversation_history)
+            summary = result["text"]
             
             # Store the summary for saving to file
             self.generated_summary = summary
+            self.triage_classification = result["classification"]
+            self.summary_degraded = result["degraded"]
             
             print(f"{Fore.MAGENTA}{'='*60}")
             print(f"{Fore.MAGENTA}SBAR CLINICAL SUMMARY & DIFFERENTIAL DIAGNOSIS")
@@ -214,12 +238,16 @@ PATIENT RESPONSE:"""
         try:
             print(f"{Fore.CYAN}Generating referral letters...")
             
-            # Extract triage decision from the summary
-            triage_decision = self._extract_triage_decision(clinical_summary)
+            # Use the validated classification when there is one, otherwise scrape the summary text
+            classification = self.triage_classification
+            if classification is not None:
+                triage_decision = classification.decision()
+            else:
+                triage_decision = self._extract_triage_decision(clinical_summary)
             
             # Generate referral letters
             referral_letters = await self.referral_letter_agent.generate_all_referral_letters(
-                clinical_summary, triage_decision, self.conversation_history
+                clinical_summary, triage_decision, self.conversation_history, classification
             )
             
             # Display each referral letter
@@ -269,18 +297,120 @@ PATIENT RESPONSE:"""
         
         self.conversation_log.append({
             "timestamp": timestamp,
+            "at": datetime.now().isoformat(timespec="milliseconds"),
             "role": role,
             "content": clean_content
         })
     
-    def save_conversation_to_file(self, output_dir: str = "conversation_logs"):
-        """Save the conversation to a text file"""
+    def save_conversation_to_store(self) -> Optional[str]:
+        """Record the conversation, its analysis, summary and letters in the conversation store"""
         if not self.patient_data or not self.conversation_log:
             print(f"{Fore.RED}No conversation data to save!")
             return None
         
-        # Create output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
+        messages = [{"role": "assistant" if msg["role"] == "BOT" else "user", "content": msg["content"], "at": msg["at"]}
+                    for msg in self.conversation_log]
+        try:
+            conversation_id = get_conversation_store().record_conversation(
+                messages,
+                case_id=self.patient_data.case_id,
+                title=self.patient_data.title,
+                expected_triage=self.patient_data.expected_triage,
+                summary=self.generated_summary or None,
+                classification=self.triage_classification.model_dump() if self.triage_classification else None,
+                referral_letters=self.generated_referral_letters or None,
+                degraded=self.summary_degraded,
+                metadata={"demographics": self.patient_data.demographics},
+            )
+            print(f"{Fore.GREEN}Conversation stored as {conversation_id}")
+            return conversation_id
+        except Exception as e:
+            print(f"{Fore.RED}Error storing conversation: {e}")
+            return None
+    
+    def format_conversation_log(self) -> str:
+        """Render the conversation as a text log"""
+        f = io.StringIO()
+        # Write header information
+        f.write("MSK TRIAGE BOT CONVERSATION LOG (QUESTIONNAIRE-BASED)\n")
+        f.write("=" * 60 + "\n\n")
+        f.write(f"Case ID: {self.patient_data.case_id}\n")
+        f.write(f"Title: {self.patient_data.title}\n")
+        f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"Assessment Type: Questionnaire-Based MSK Triage\n")
+        f.write(f"Output Format: SBAR Clinical Summary + Differential Diagnoses + Referral Letters\n\n")
+        
+        # Write patient demographics
+        f.write("PATIENT DEMOGRAPHICS:\n")
+        f.write("-" * 20 + "\n")
+        for key, value in self.patient_data.demographics.items():
+            f.write(f"{key.title()}: {value}\n")
+        f.write(f"Expected Triage: {self.patient_data.expected_triage}\n\n")
+        
+        # Write presenting complaint
+        f.write("PRESENTING COMPLAINT:\n")
+        f.write("-" * 20 + "\n")
+        f.write(f"{self.patient_data.presenting_complaint}\n\n")
+        
+        # Write conversation
+        f.write("CONVERSATION:\n")
+        f.write("-" * 20 + "\n")
+        for msg in self.conversation_log:
+            f.write(f"[{msg['timestamp']}] {msg['role']}: {msg['content']}\n\n")
+        
+        # Write clinical notes if available
+        if self.patient_data.clinical_notes:
+            f.write("CLINICAL NOTES:\n")
+            f.write("-" * 20 + "\n")
+            f.write(f"{self.patient_data.clinical_notes}\n\n")
+        
+        # Write expanded clinic letter if available
+        if hasattr(self.patient_data, 'expanded_clinic_letter') and self.patient_data.expanded_clinic_letter:
+            f.write("EXPANDED CLINIC LETTER:\n")
+            f.write("-" * 20 + "\n")
+            f.write(f"{self.patient_data.expanded_clinic_letter}\n\n")
+        
+        # Write SBAR summary and triage classification (excluding differential diagnosis)
+        if self.generated_summary:
+            f.write("SBAR CLINICAL SUMMARY & TRIAGE CLASSIFICATION:\n")
+            f.write("=" * 60 + "\n")
+        
+            # Split the summary into sections
+            sections = self.generated_summary.split("---")
+            if len(sections) >= 1:
+                # Write the SBAR section (first part before the first ---)
+                f.write(sections[0].strip())
+                f.write("\n\n")
+        
+            # Find and write the triage classification section
+            triage_section = None
+            for section in sections[1:]:  # Skip the first section (SBAR)
+                if "TRIAGE CLASSIFICATION:" in section:
+                    triage_section = section
+                    break
+        
+            if triage_section:
+                f.write("---\n\n")
+                f.write(triage_section.strip())
+                f.write("\n\n")
+        
+        # Write referral letters if available
+        if hasattr(self, 'generated_referral_letters') and self.generated_referral_letters:
+            f.write("REFERRAL LETTERS:\n")
+            f.write("=" * 60 + "\n")
+        
+            for referral_type, letter in self.generated_referral_letters.items():
+                f.write(f"\nREFERRAL LETTER - {referral_type.upper()}:\n")
+                f.write("-" * 40 + "\n")
+                f.write(letter)
+                f.write("\n\n")
+        return f.getvalue()
+    
+    async def save_conversation_to_file(self, output_dir: str = "conversation_logs"):
+        """Queue the conversation's text log for writing by the background log sink"""
+        if not self.patient_data or not self.conversation_log:
+            print(f"{Fore.RED}No conversation data to save!")
+            return None
         
         # Generate filename with timestamp and case info
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -289,82 +419,9 @@ PATIENT RESPONSE:"""
         filepath = os.path.join(output_dir, filename)
         
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                # Write header information
-                f.write("MSK TRIAGE BOT CONVERSATION LOG (QUESTIONNAIRE-BASED)\n")
-                f.write("=" * 60 + "\n\n")
-                f.write(f"Case ID: {self.patient_data.case_id}\n")
-                f.write(f"Title: {self.patient_data.title}\n")
-                f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Assessment Type: Questionnaire-Based MSK Triage\n")
-                f.write(f"Output Format: SBAR Clinical Summary + Differential Diagnoses + Referral Letters\n\n")
-                
-                # Write patient demographics
-                f.write("PATIENT DEMOGRAPHICS:\n")
-                f.write("-" * 20 + "\n")
-                for key, value in self.patient_data.demographics.items():
-                    f.write(f"{key.title()}: {value}\n")
-                f.write(f"Expected Triage: {self.patient_data.expected_triage}\n\n")
-                
-                # Write presenting complaint
-                f.write("PRESENTING COMPLAINT:\n")
-                f.write("-" * 20 + "\n")
-                f.write(f"{self.patient_data.presenting_complaint}\n\n")
-                
-                # Write conversation
-                f.write("CONVERSATION:\n")
-                f.write("-" * 20 + "\n")
-                for msg in self.conversation_log:
-                    f.write(f"[{msg['timestamp']}] {msg['role']}: {msg['content']}\n\n")
-                
-                # Write clinical notes if available
-                if self.patient_data.clinical_notes:
-                    f.write("CLINICAL NOTES:\n")
-                    f.write("-" * 20 + "\n")
-                    f.write(f"{self.patient_data.clinical_notes}\n\n")
-                
-                # Write expanded clinic letter if available
-                if hasattr(self.patient_data, 'expanded_clinic_letter') and self.patient_data.expanded_clinic_letter:
-                    f.write("EXPANDED CLINIC LETTER:\n")
-                    f.write("-" * 20 + "\n")
-                    f.write(f"{self.patient_data.expanded_clinic_letter}\n\n")
-                
-                # Write SBAR summary and triage classification (excluding differential diagnosis)
-                if self.generated_summary:
-                    f.write("SBAR CLINICAL SUMMARY & TRIAGE CLASSIFICATION:\n")
-                    f.write("=" * 60 + "\n")
-                    
-                    # Split the summary into sections
-                    sections = self.generated_summary.split("---")
-                    if len(sections) >= 1:
-                        # Write the SBAR section (first part before the first ---)
-                        f.write(sections[0].strip())
-                        f.write("\n\n")
-                    
-                    # Find and write the triage classification section
-                    triage_section = None
-                    for section in sections[1:]:  # Skip the first section (SBAR)
-                        if "TRIAGE CLASSIFICATION:" in section:
-                            triage_section = section
-                            break
-                    
-                    if triage_section:
-                        f.write("---\n\n")
-                        f.write(triage_section.strip())
-                        f.write("\n\n")
-                
-                # Write referral letters if available
-                if hasattr(self, 'generated_referral_letters') and self.generated_referral_letters:
-                    f.write("REFERRAL LETTERS:\n")
-                    f.write("=" * 60 + "\n")
-                    
-                    for referral_type, letter in self.generated_referral_letters.items():
-                        f.write(f"\nREFERRAL LETTER - {referral_type.upper()}:\n")
-                        f.write("-" * 40 + "\n")
-                        f.write(letter)
-                        f.write("\n\n")
-            
-            print(f"{Fore.GREEN}Conversation saved to: {filepath}")
+            # The sink creates the directory and writes off the event loop
+            await get_log_sink().write(filepath, self.format_conversation_log())
+            print(f"{Fore.GREEN}Conversation queued for: {filepath}")
             return filepath
             
         except Exception as e:
@@ -394,20 +451,8 @@ PATIENT RESPONSE:"""
         self.conversation_history.append({"role": "assistant", "content": bot_response})
         self.print_message("BOT", bot_response)
         
-        # Generate realistic name and DOB
-        import random
-        first_names = ["John", "Sarah", "Michael", "Emma", "David", "Lisa", "James", "Anna", "Robert", "Maria", "William", "Jennifer", "Richard", "Linda", "Charles", "Elizabeth", "Joseph", "Patricia", "Thomas", "Susan", "Christopher", "Jessica", "Daniel", "Sarah", "Matthew", "Ashley", "Anthony", "Emily", "Mark", "Michelle"]
-        last_names = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson"]
-        
-        first_name = random.choice(first_names)
-        last_name = random.choice(last_names)
-        age = int(self.patient_data.demographics.get('age', '30'))
-        current_year = 2024
-        birth_year = current_year - age
-        dob = f"{random.randint(1, 28)}/{random.randint(1, 12)}/{birth_year}"
-        
         # Patient responds to greeting with demographics and initial complaint
-        initial_message = f"I'm {first_name} {last_name}, {age} years old, {self.patient_data.demographics.get('gender', 'person')}, and my date of birth is {dob}. I have {self.patient_data.presenting_complaint.lower()}"
+        initial_message = self.opening_message()
         self.conversation_history.append({"role": "user", "content": initial_message})
         self.print_message("PATIENT", initial_message)
         
@@ -417,12 +462,12 @@ PATIENT RESPONSE:"""
         self.print_message("BOT", bot_response)
         
         # Continue conversation until completion
-        max_exchanges = 20  # Prevent infinite loops
+        max_exchanges = self.max_exchanges
         exchange_count = 0
         
         while exchange_count < max_exchanges:
             # Check if conversation is complete
-            if "clinical summary with differential diagnosis will be prepared" in bot_response.lower() or "summary will be prepared" in bot_response.lower():
+            if conversation_complete(bot_response):
                 print(f"{Fore.GREEN}Conversation completed! Bot is preparing SBAR clinical summary and differential diagnosis...")
                 
                 # Generate the clinical summary
@@ -442,7 +487,8 @@ PATIENT RESPONSE:"""
             exchange_count += 1
             
             # Small delay for readability
-            await asyncio.sleep(1)
+            if self.turn_delay:
+                await asyncio.sleep(self.turn_delay)
         
         if exchange_count >= max_exchanges:
             print(f"{Fore.YELLOW}Conversation stopped after {max_exchanges} exchanges")
@@ -451,10 +497,31 @@ PATIENT RESPONSE:"""
         print(f"{Fore.MAGENTA}CONVERSATION COMPLETED")
         print(f"{Fore.MAGENTA}{'='*60}")
         
-        # Save conversation to file
-        saved_file = self.save_conversation_to_file()
-        if saved_file:
-            print(f"{Fore.CYAN}Conversation log saved successfully!")
+        # Record the conversation in the structured store, off the event loop
+        await asyncio.to_thread(self.save_conversation_to_store)
+        
+        # Free-text logs are only written on request now that conversations are stored
+        if os.environ.get("CONVERSATION_TEXT_LOGS") == "1":
+            saved_file = await self.save_conversation_to_file()
+            if saved_file:
+                print(f"{Fore.CYAN}Conversation log saved successfully!")
+    
+    def opening_message(self) -> str:
+        """The patient's reply to the greeting: a made-up name and date of birth, age, gender and complaint"""
+        # Generate realistic name and DOB
+        first_names = ["John", "Sarah", "Michael", "Emma", "David", "Lisa", "James", "Anna", "Robert", "Maria", "William", "Jennifer", "Richard", "Linda", "Charles", "Elizabeth", "Joseph", "Patricia", "Thomas", "Susan", "Christopher", "Jessica", "Daniel", "Sarah", "Matthew", "Ashley", "Anthony", "Emily", "Mark", "Michelle"]
+        last_names = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson"]
+        
+        first_name = self.rng.choice(first_names)
+        last_name = self.rng.choice(last_names)
+        age = int(self.patient_data.demographics.get('age', '30'))
+        current_year = 2024
+        birth_year = current_year - age
+        dob = f"{self.rng.randint(1, 28)}/{self.rng.randint(1, 12)}/{birth_year}"
+        
+        initial_message = f"I'm {first_name} {last_name}, {age} years old, {self.patient_data.demographics.get('gender', 'person')}, and my date of birth is {dob}. I have {self.patient_data.presenting_complaint.lower()}"
+        return initial_message
+
 
 def load_patient_cases(file_path: str) -> List[PatientData]:
     """Load patient cases from JSON file"""
@@ -479,6 +546,374 @@ def load_patient_cases(file_path: str) -> List[PatientData]:
     
     return cases
 
+LOG_TURN_PATTERN = re.compile(r'^\[(\d{2}:\d{2}:\d{2})\] (BOT|PATIENT): ?(.*)$')
+
+def parse_conversation_turns(lines, with_times: bool = False) -> List[Dict[str, str]]:
+    """Turn the lines of a log's CONVERSATION section into chat messages (with their "HH:MM:SS" if asked)"""
+    messages = []
+    for line in lines:
+        line = line.rstrip("\n")
+        turn = LOG_TURN_PATTERN.match(line)
+        if turn:
+            role = "assistant" if turn.group(2) == "BOT" else "user"
+            message = {"role": role, "content": turn.group(3)}
+            if with_times:
+                message["time"] = turn.group(1)
+            messages.append(message)
+        elif messages and line.strip() and not line.startswith("---"):
+            # Turns can wrap over several lines
+            messages[-1]["content"] += "\n" + line
+    
+    for msg in messages:
+        msg["content"] = msg["content"].strip()
+    return messages
+
+def parse_conversation_log(file_path: str) -> List[Dict[str, str]]:
+    """Read the CONVERSATION section of a saved log back into chat messages"""
+    with open(file_path, 'r') as f:
+        text = f.read()
+    
+    if "CONVERSATION:" not in text:
+        return []
+    section = text.split("CONVERSATION:", 1)[1]
+    section = section.split("\nCLINICAL NOTES:", 1)[0]
+    return parse_conversation_turns(section.splitlines())
+
+def count_turns_with_multi_slot(messages: List[Dict[str, str]], adaptive: bool = True) -> int:
+    """Count the bot questions a logged conversation would still need with multi-slot parsing.
+
+    A logged question is skipped if the patient had already answered its slot
+    with enough confidence earlier in the conversation, or (with adaptive ordering)
+    if it only feeds the diagnosis ranking and the leading diagnosis is already settled.
+    """
+    agent = TriageAgent(multi_slot=True, adaptive=adaptive)
+    turns = 0
+    for i, msg in enumerate(messages):
+        if msg["role"] != "assistant":
+            continue
+        state = agent._state_for_question(msg["content"])
+        if state is not None:
+            patient_data = agent._extract_patient_data(messages[:i])
+            if agent._slot_satisfied(state, patient_data):
+                continue
+            if adaptive and state in SCORED_STATE_FIELDS and state not in PATHWAY_STATES:
+                agent._determine_current_state(messages[:i])  # Picks the questionnaire
+                open_states = agent._open_scored_states(agent._state_sequence(), patient_data)
+                if agent._diagnosis_settled(open_states, patient_data):
+                    continue
+        turns += 1
+    return turns
+
+def report_turn_reduction(log_dir: str = "conversation_logs"):
+    """Replay saved conversations and report average bot turns per case before and after multi-slot parsing"""
+    
+    log_files = sorted(glob.glob(os.path.join(log_dir, "*.txt")))
+    if not log_files:
+        print(f"{Fore.RED}No conversation logs found in {log_dir}")
+        return None
+    
+    before_total = 0
+    multi_slot_total = 0
+    after_total = 0
+    cases = 0
+    for log_file in log_files:
+        messages = parse_conversation_log(log_file)
+        before = sum(1 for msg in messages if msg["role"] == "assistant")
+        if before == 0:
+            continue
+        multi_slot = count_turns_with_multi_slot(messages, adaptive=False)
+        after = count_turns_with_multi_slot(messages)
+        before_total += before
+        multi_slot_total += multi_slot
+        after_total += after
+        cases += 1
+        print(f"{os.path.basename(log_file)}: {before} -> {multi_slot} (multi-slot) -> {after} (adaptive) bot turns")
+    
+    if cases == 0:
+        print(f"{Fore.RED}No conversations found in {log_dir}")
+        return None
+    
+    before_avg = before_total / cases
+    multi_slot_avg = multi_slot_total / cases
+    after_avg = after_total / cases
+    reduction = (before_avg - after_avg) / before_avg * 100
+    print(f"\n{Fore.CYAN}Cases replayed: {cases}")
+    print(f"{Fore.CYAN}Average bot turns per case: {before_avg:.1f} -> {multi_slot_avg:.1f} (multi-slot) "
+          f"-> {after_avg:.1f} (adaptive) ({reduction:.1f}% fewer)")
+    return {"cases": cases, "before": before_avg, "multi_slot": multi_slot_avg,
+            "after": after_avg, "reduction_percent": reduction}
+
+# Case fields that answer each question when a case is replayed without an LLM
+SCRIPTED_ANSWER_FIELDS = {
+    TriageState.SELECT_BODY_PART: ["socrates.site"],
+    TriageState.GATHER_LATERALITY: ["socrates.site"],
+    TriageState.GATHER_DURATION: ["socrates.onset"],
+    TriageState.GATHER_MECHANISM: ["triage_info.injury_mechanism"],
+    TriageState.GATHER_SYMPTOMS: ["presenting_complaint"],
+    TriageState.GATHER_PAIN_CHARACTER: ["socrates.character"],
+    TriageState.GATHER_RADIATION: ["socrates.radiation"],
+    TriageState.GATHER_ASSOCIATED_SYMPTOMS: ["socrates.associations"],
+    TriageState.GATHER_TIMING: ["socrates.timing"],
+    TriageState.GATHER_EXACERBATING_RELIEVING: ["socrates.exacerbating", "socrates.relieving"],
+    TriageState.GATHER_SEVERITY: ["socrates.severity"],
+    TriageState.GATHER_KNEE_SCORE: ["triage_info.functional_impact"],
+    TriageState.GATHER_FUNCTIONAL_IMPACT: ["triage_info.functional_impact"],
+    TriageState.GATHER_PREVIOUS_TREATMENT: ["triage_info.previous_treatment"],
+    TriageState.GATHER_TREATMENT_RESPONSE: ["triage_info.previous_treatment"],
+    TriageState.GATHER_LOCKING_TYPE: ["socrates.associations"],
+    TriageState.GATHER_OVERUSE_CONTEXT: ["socrates.onset"],
+    TriageState.GATHER_PHENOTYPE_SYMPTOMS: ["socrates.associations"],
+    TriageState.GATHER_IMAGING_HISTORY: ["triage_info.previous_treatment"],
+    TriageState.GATHER_SMOKING_STATUS: ["demographics.comorbidities"],
+    TriageState.GATHER_CONSERVATIVE_TREATMENT_FAILURE: ["triage_info.previous_treatment"],
+    TriageState.GATHER_RED_FLAGS: ["triage_info.red_flags"],
+}
+
+def scripted_answer(case: PatientData, state: TriageState,
+                    fields: Dict[TriageState, List[str]] = SCRIPTED_ANSWER_FIELDS) -> str:
+    """Answer a question straight from the case fields"""
+    if state == TriageState.GREETING:
+        return (f"I'm {case.demographics.get('age')} years old, {case.demographics.get('gender')}. "
+                f"{case.presenting_complaint}")
+    if state == TriageState.GATHER_AGE:
+        return f"I'm {case.demographics.get('age')} years old."
+    
+    parts = []
+    for field in fields.get(state, []):
+        section, _, key = field.partition('.')
+        value = getattr(case, section)
+        if key:
+            value = value.get(key, "")
+        if value:
+            parts.append(value.rstrip('.') + '.')
+    return " ".join(parts) or "I'm not sure."
+
+def replay_case(case: PatientData, early_stop: bool = True, max_turns: int = 40) -> List[Dict[str, str]]:
+    """Run a case through the triage state machine with scripted answers, one fresh agent per turn like /ask"""
+    messages = []
+    for _ in range(max_turns):
+        agent = TriageAgent(early_stop=early_stop)
+        state = agent._determine_current_state(messages)
+        if state == TriageState.COMPLETE:
+            break
+        messages.append({"role": "assistant", "content": agent._question_text(state)})
+        messages.append({"role": "user", "content": scripted_answer(case, state)})
+    return messages
+
+def report_early_termination(cases_file: str = "patient_cases.json"):
+    """Report bot turns per case with and without stopping once the pathway is settled"""
+    
+    try:
+        cases = load_patient_cases(cases_file)
+    except Exception as e:
+        print(f"{Fore.RED}Error loading patient cases: {e}")
+        return None
+    
+    agent = TriageAgent()
+    full_total = 0
+    early_total = 0
+    changed = 0
+    for case in cases:
+        full = replay_case(case, early_stop=False)
+        early = replay_case(case, early_stop=True)
+        full_turns = sum(1 for msg in full if msg["role"] == "assistant")
+        early_turns = sum(1 for msg in early if msg["role"] == "assistant")
+        
+        # The pathway the guardrails pick must not depend on the skipped questions
+        pathways = []
+        for messages in (full, early):
+            patient_text = " ".join(msg["content"] for msg in messages if msg["role"] == "user")
+            pathways.append(apply_triage_guardrails(agent._extract_patient_data(messages), patient_text))
+        if pathways[0] != pathways[1]:
+            changed += 1
+        
+        full_total += full_turns
+        early_total += early_turns
+        print(f"{case.case_id} ({case.title}): {full_turns} -> {early_turns} bot turns, "
+              f"pathway {pathways[1]}{'' if pathways[0] == pathways[1] else ' (was ' + pathways[0] + ')'}")
+    
+    full_avg = full_total / len(cases)
+    early_avg = early_total / len(cases)
+    print(f"\n{Fore.CYAN}Cases replayed: {len(cases)}")
+    print(f"{Fore.CYAN}Average bot turns per case: {full_avg:.1f} -> {early_avg:.1f} "
+          f"({(full_avg - early_avg) / full_avg * 100:.1f}% fewer), pathway changed in {changed} case(s)")
+    return {"cases": len(cases), "before": full_avg, "after": early_avg, "pathway_changed": changed}
+
+# --- Rule-Based Patient ---
+# Questions the scripted answers leave unanswered, answered from the nearest case field
+RULE_ANSWER_FIELDS = {
+    **SCRIPTED_ANSWER_FIELDS,
+    TriageState.GATHER_STIFFNESS: ["socrates.timing"],
+    TriageState.GATHER_EXAM_FINDINGS: ["socrates.associations"],
+    TriageState.GATHER_IMAGING: ["triage_info.previous_treatment"],
+    TriageState.GATHER_DETAILED_TREATMENT_HISTORY: ["triage_info.previous_treatment"],
+    TriageState.GATHER_PREVIOUS_INJURY_SURGERY: ["triage_info.injury_mechanism"],
+    TriageState.GATHER_OA_INDEX_DETAILED: ["triage_info.functional_impact"],
+}
+
+# Answers no case field holds; kept neutral so they do not hint at the expected pathway
+RULE_FIXED_ANSWERS = {
+    TriageState.GATHER_SURGERY_INTEREST: "I'd consider it if a specialist recommended it.",
+}
+
+# Words in a free-text question that point to a state, for questions that are not the canned text
+QUESTION_KEYWORDS = [
+    (TriageState.GATHER_RED_FLAGS, ["fever", "chills", "weight loss"]),
+    (TriageState.GATHER_SEVERITY, ["scale", "0 to 10", "rate your pain"]),
+    (TriageState.GATHER_LATERALITY, ["which side", "left or right"]),
+    (TriageState.GATHER_DURATION, ["how long"]),
+    (TriageState.GATHER_SMOKING_STATUS, ["smoke", "tobacco"]),
+    (TriageState.GATHER_IMAGING_HISTORY, ["x-ray", "mri", "scan", "imaging"]),
+    (TriageState.GATHER_LOCKING_TYPE, ["locking", "catching", "giving way"]),
+    (TriageState.GATHER_PREVIOUS_TREATMENT, ["treatment", "tried"]),
+    (TriageState.GATHER_MECHANISM, ["how did", "injury"]),
+    (TriageState.GATHER_RADIATION, ["spread", "radiate"]),
+    (TriageState.GATHER_FUNCTIONAL_IMPACT, ["daily", "work", "hobbies"]),
+    (TriageState.GATHER_EXACERBATING_RELIEVING, ["better or worse", "worse"]),
+    (TriageState.GATHER_PAIN_CHARACTER, ["feel like", "sharp", "dull"]),
+    (TriageState.GATHER_AGE, ["your age", "how old"]),
+    (TriageState.GREETING, ["date of birth", "your name"]),
+    (TriageState.SELECT_BODY_PART, ["which part", "brings you"]),
+]
+
+# Words that mark a sample conversation line as an answer to a state's question
+SAMPLE_KEYWORDS = {
+    TriageState.GATHER_DURATION: ["ago", "started", "since", "first happened", "began"],
+    TriageState.GATHER_OVERUSE_CONTEXT: ["running", "training", "kneeling", "standing", "started"],
+    TriageState.GATHER_MECHANISM: ["playing", "during", "fell", "twist", "pivot", "lifting", "kneeling"],
+    TriageState.GATHER_SEVERITY: ["/10", "baseline", "pain is", "pain goes"],
+    TriageState.GATHER_PAIN_CHARACTER: ["sharp", "dull", "ache", "burning"],
+    TriageState.GATHER_ASSOCIATED_SYMPTOMS: ["swell", "stiff", "numb", "weak", "catch", "lock"],
+    TriageState.GATHER_LOCKING_TYPE: ["lock", "catch", "stuck", "click"],
+    TriageState.GATHER_PHENOTYPE_SYMPTOMS: ["gives way", "giving way", "lock", "catch", "dislocat"],
+    TriageState.GATHER_EXACERBATING_RELIEVING: ["worse", "worst", "better", "helps"],
+    TriageState.GATHER_FUNCTIONAL_IMPACT: ["work", "stopped", "affecting", "can't", "cannot"],
+    TriageState.GATHER_KNEE_SCORE: ["stairs", "walk", "squat", "kneel"],
+    TriageState.GATHER_PREVIOUS_TREATMENT: ["physio", "injection", "brace", "tablets", "painkillers"],
+    TriageState.GATHER_TREATMENT_RESPONSE: ["helped", "didn't", "no difference", "improved"],
+    TriageState.GATHER_CONSERVATIVE_TREATMENT_FAILURE: ["physio", "injection", "helped", "didn't"],
+    TriageState.GATHER_IMAGING_HISTORY: ["mri", "x-ray", "scan", "ultrasound"],
+    TriageState.GATHER_IMAGING: ["mri", "x-ray", "scan", "ultrasound"],
+}
+
+PARAPHRASE_OPENERS = ["Um, ", "Well, ", "Hmm, ", "So, ", "Let me think... "]
+PARAPHRASE_CONTRACTIONS = [("I am", "I'm"), ("do not", "don't"), ("cannot", "can't"),
+                           ("It is", "It's"), ("did not", "didn't"), ("I have", "I've")]
+
+def guess_question_state(question: str) -> Optional[TriageState]:
+    """The state a question most likely asks about: its canned text, else the first keyword match"""
+    state = question_state(question)
+    if state is not None:
+        return state
+    text = question.lower()
+    for state, words in QUESTION_KEYWORDS:
+        if any(word in text for word in words):
+            return state
+    return None
+
+class RuleBasedPatient:
+    """
+    Answers the triage bot from a case's fields without an LLM. With noise > 0 that
+    fraction of answers is paraphrased: the case's own sample conversation line for
+    the question is used where one fits, with fillers and contractions varied, all
+    drawn from a seeded generator so a run can be repeated exactly.
+    """
+    def __init__(self, case: PatientData, noise: float = 0.0, seed: Optional[int] = None):
+        self.case = case
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.used_samples = set()
+    
+    def answer(self, state: Optional[TriageState]) -> str:
+        """The plain answer to a state's question, as replay_case gives it"""
+        if state is None:
+            return "Sorry, I'm not sure what you mean."
+        if state in RULE_FIXED_ANSWERS:
+            return RULE_FIXED_ANSWERS[state]
+        return scripted_answer(self.case, state, RULE_ANSWER_FIELDS)
+    
+    def sample_line(self, state: Optional[TriageState]) -> Optional[str]:
+        """The unused sample conversation line with the most keywords for the state, if any"""
+        words = SAMPLE_KEYWORDS.get(state, [])
+        best, best_hits = None, 0
+        for i, line in enumerate(self.case.sample_conversation or []):
+            hits = sum(1 for word in words if word in line.lower())
+            if i not in self.used_samples and hits > best_hits:
+                best, best_hits = i, hits
+        if best is None:
+            return None
+        self.used_samples.add(best)
+        return self.case.sample_conversation[best]
+    
+    def paraphrase(self, answer: str, state: Optional[TriageState]) -> str:
+        answer = self.sample_line(state) or answer
+        for formal, casual in PARAPHRASE_CONTRACTIONS:
+            if self.rng.random() < 0.5:
+                answer = answer.replace(formal, casual)
+            else:
+                answer = answer.replace(casual, formal)
+        if self.rng.random() < 0.5:
+            # Keep capitals that are not just sentence case ("I", "MRI", "ACL")
+            first = answer[:1].lower() if answer[1:2].islower() else answer[:1]
+            answer = self.rng.choice(PARAPHRASE_OPENERS) + first + answer[1:]
+        return answer
+    
+    def respond(self, bot_question: str) -> str:
+        state = guess_question_state(bot_question)
+        answer = self.answer(state)
+        if self.noise > 0 and self.rng.random() < self.noise:
+            answer = self.paraphrase(answer, state)
+        return answer
+
+def conversation_complete(bot_response: str) -> bool:
+    """Whether the bot has closed the interview"""
+    text = bot_response.lower()
+    return "clinical summary with differential diagnosis will be prepared" in text or "summary will be prepared" in text
+
+async def benchmark_triage_backend(cases_file: str = "patient_cases.json", rounds: int = 3,
+                                   noise: float = 0.0, seed: int = 0):
+    """Interview every case with rule-based patients and report how fast the triage agent answers"""
+    
+    try:
+        cases = load_patient_cases(cases_file)
+    except Exception as e:
+        print(f"{Fore.RED}Error loading patient cases: {e}")
+        return None
+    
+    simulator = PatientSimulator(responder="rules", noise=noise, seed=seed)
+    bot_seconds = []
+    patient_seconds = []
+    conversations = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for case in cases:
+            simulator.load_patient_data(case)
+            await simulator.get_bot_response("")
+            patient_response = simulator.opening_message()
+            for _ in range(simulator.max_exchanges + 1):
+                turn_start = time.perf_counter()
+                bot_response = await simulator.get_bot_response(patient_response)
+                bot_seconds.append(time.perf_counter() - turn_start)
+                if conversation_complete(bot_response):
+                    conversations += 1
+                    break
+                turn_start = time.perf_counter()
+                patient_response = await simulator.get_patient_response(bot_response)
+                patient_seconds.append(time.perf_counter() - turn_start)
+    elapsed = time.perf_counter() - started
+    
+    ordered = sorted(bot_seconds)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000
+    patient_ms = sum(patient_seconds) / max(1, len(patient_seconds)) * 1000
+    print(f"{Fore.CYAN}Conversations: {conversations}/{rounds * len(cases)} completed, "
+          f"{len(bot_seconds)} bot turns in {elapsed:.2f}s")
+    print(f"{Fore.CYAN}Throughput: {len(bot_seconds) / elapsed:.0f} turns/s, {conversations / elapsed:.1f} conversations/s")
+    print(f"{Fore.CYAN}Bot turn latency: p50 {p50:.3f} ms, p95 {p95:.3f} ms; patient turn {patient_ms:.3f} ms")
+    return {"conversations": conversations, "bot_turns": len(bot_seconds), "seconds": elapsed,
+            "turns_per_second": len(bot_seconds) / elapsed, "bot_p50_ms": p50, "bot_p95_ms": p95,
+            "patient_ms": patient_ms}
+
 async def run_single_simulation():
     """Run a single simulation with a randomly selected case"""
     
@@ -502,6 +937,8 @@ async def run_single_simulation():
     
     # Start simulation
     await simulator.simulate_conversation()
+    # Wait for queued log writes before the event loop closes
+    await get_log_sink().close()
 
 async def run_all_simulations():
     """Run simulations for all patient cases"""
@@ -532,15 +969,26 @@ async def run_all_simulations():
         # Ask if user wants to continue
         if i < len(cases) - 1:
             input("\nPress Enter to continue to next simulation...")
+    
+    await get_log_sink().close()
 
 if __name__ == "__main__":
     print("Choose simulation mode:")
     print("1. Single random case")
     print("2. All cases")
+    print("3. Turn reduction report (replay saved logs)")
+    print("4. Early termination report (replay patient_cases.json)")
+    print("5. Triage backend throughput (rule-based patients, no LLM)")
     
-    choice = input("Enter choice (1-2): ").strip()
+    choice = input("Enter choice (1-5): ").strip()
     
     if choice == "2":
         asyncio.run(run_all_simulations())
+    elif choice == "3":
+        report_turn_reduction()
+    elif choice == "4":
+        report_early_termination()
+    elif choice == "5":
+        asyncio.run(benchmark_triage_backend())
     else:
         asyncio.run(run_single_simulation())
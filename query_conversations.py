@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Query the structured conversation store.
+
+Examples:
+  python query_conversations.py --case case_1
+  python query_conversations.py --since 2025-10-01 --until 2025-11-01 --pathway arthroplasty
+  python query_conversations.py --mismatched
+  python query_conversations.py --search '"true locking" AND pivot*'
+  python query_conversations.py --show <conversation id>
+"""
+
+import argparse
+import json
+import os
+import sys
+
+# Add the app directory to the path so we can import the store directly
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from app.conversation_store import configure_conversation_store
+from app.conversation_index import QueryError
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query stored triage conversations")
+    parser.add_argument("--db", default=os.environ.get("CONVERSATION_STORE", "conversations.db"))
+    parser.add_argument("--case", help="Case id, e.g. case_1")
+    parser.add_argument("--since", help="ISO date or timestamp (inclusive)")
+    parser.add_argument("--until", help="ISO date or timestamp (exclusive)")
+    parser.add_argument("--pathway", help="Guardrail pathway, e.g. orthopaedic_soft_tissue")
+    parser.add_argument("--mismatched", action="store_true", help="Only conversations routed differently than expected")
+    parser.add_argument("--search", metavar="QUERY",
+                        help='Full-text query over patient turns and summaries, e.g. \'"true locking" AND pivot*\'')
+    parser.add_argument("--include-negated", action="store_true",
+                        help="With --search, also match negated mentions (\"no true locking\")")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--show", metavar="ID", help="Print one conversation in full as JSON")
+    args = parser.parse_args()
+
+    store = configure_conversation_store(args.db)
+    if args.show:
+        print(json.dumps(store.get(args.show), indent=2))
+        return
+
+    if args.search:
+        try:
+            rows = store.search(args.search, include_negated=args.include_negated, limit=args.limit)
+        except QueryError as e:
+            print(f"Invalid query: {e}")
+            return
+    else:
+        rows = store.find(case_id=args.case, since=args.since, until=args.until, pathway=args.pathway,
+                          mismatched=True if args.mismatched else None, limit=args.limit)
+    print(f"{'Started':<20}{'Case':<10}{'Expected':<11}{'Routed':<11}{'Pathway':<26}Id")
+    for row in rows:
+        flag = " *" if row["mismatch"] else ""
+        print(f"{row['started_at'][:19]:<20}{row['case_id'] or '':<10}{row['expected_referral_type'] or '?':<11}"
+              f"{row['referral_type']:<11}{row['pathway']:<26}{row['id']}{flag}")
+    print(f"\n{len(rows)} conversations ({store.stats()['conversations']} stored)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Report how much transcript compaction shrinks the prompts for saved conversations.
+
+For each conversation log, prints the estimated transcript tokens before and after
+compaction for each stage that reads the transcript, at that stage's budget.
+
+Usage: python report_transcript_compaction.py [conversation_logs ...]
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+# Add the app directory to the path so we can import the agents directly
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from app.generation_profiles import get_generation_profile, SBAR_STAGE, REFERRAL_LETTER_TYPES, referral_letter_stage
+from app.transcript_compaction import compact_transcript
+from patient_simulator_ollama import parse_conversation_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt-token reduction from transcript compaction")
+    parser.add_argument("paths", nargs="*", default=["conversation_logs"], help="Log files or directories of logs")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        files.extend(sorted(glob.glob(os.path.join(path, "*.txt"))) if os.path.isdir(path) else [path])
+
+    stages = [SBAR_STAGE] + [referral_letter_stage(t) for t in REFERRAL_LETTER_TYPES]
+
+    totals = {stage: [0, 0] for stage in stages}
+    print(f"{'Case':<50}{'Stage':<24}{'Before':>8}{'After':>8}{'Saved':>8}{'Dropped':>9}")
+    for file_path in files:
+        messages = parse_conversation_log(file_path)
+        if not messages:
+            continue
+        for stage in stages:
+            result = compact_transcript(messages, get_generation_profile(stage).transcript_tokens)
+            before, after = result["original_tokens"], result["tokens"]
+            totals[stage][0] += before
+            totals[stage][1] += after
+            print(f"{os.path.basename(file_path)[:48]:<50}{stage:<24}{before:>8}{after:>8}"
+                  f"{1 - after / before:>8.0%}{result['dropped_exchanges']:>9}")
+
+    for stage, (before, after) in totals.items():
+        if before:
+            print(f"\n{stage}: {before} -> {after} estimated tokens ({1 - after / before:.0%} saved)", end="")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Re-summarise stored conversations through the /summarize/batch endpoint.
+
+Inputs are conversation log files (.txt, as saved by the simulator), directories of
+them, or .jsonl files with one {"id": ..., "messages": [...]} object per line. The
+transcript id of a log file is its file name.
+
+Results are appended to the output NDJSON file as they arrive. Running the same
+command again resumes: transcripts with an "ok", non-degraded result in the output
+file are skipped.
+
+Usage: python summarize_batch.py conversation_logs --output resummarised.ndjson
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import Dict, List, Set
+
+import httpx
+
+# Add the app directory to the path so we can import the log parser
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+from patient_simulator_ollama import parse_conversation_log
+
+
+def load_transcripts(paths: List[str]) -> List[Dict]:
+    """Collect {"id", "messages"} transcripts from log files, directories and JSONL files."""
+    transcripts = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.txt"))) if os.path.isdir(path) else [path]
+        for file_path in files:
+            if file_path.endswith(".jsonl"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    transcripts.extend(json.loads(line) for line in f if line.strip())
+            else:
+                messages = parse_conversation_log(file_path)
+                if messages:
+                    transcripts.append({"id": os.path.basename(file_path), "messages": messages})
+    return transcripts
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids already summarised successfully in an earlier run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short when the last run was interrupted
+            if result.get("type") == "result" and result.get("status") == "ok" and not result.get("degraded"):
+                done.add(result["id"])
+    return done
+
+
+def end_partial_line(output_path: str):
+    """Terminate a line cut short by an interrupted run, so the next result starts on its own line."""
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def run_batch(transcripts: List[Dict], url: str, output_path: str, model: str,
+              concurrency: int = None, chunk_size: int = 100):
+    done = completed_ids(output_path)
+    remaining = [t for t in transcripts if t["id"] not in done]
+    print(f"{len(transcripts)} transcripts, {len(done)} already done, {len(remaining)} to summarise")
+
+    end_partial_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as out:
+        # Chunks keep request bodies bounded; each chunk still runs at full concurrency
+        for start in range(0, len(remaining), chunk_size):
+            chunk = remaining[start:start + chunk_size]
+            body = {"transcripts": chunk, "model": model}
+            if concurrency:
+                body["concurrency"] = concurrency
+            with httpx.stream("POST", f"{url}/summarize/batch", json=body, timeout=None) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    if result["type"] == "done":
+                        print(f"Chunk done: {result['ok']} ok, {result['error']} failed, "
+                              f"{result['degraded']} degraded (concurrency {result['concurrency']})")
+                        continue
+                    out.write(line + "\n")
+                    out.flush()
+                    flag = " (degraded)" if result.get("degraded") else ""
+                    print(f"  {result['status']:<5} {result['seconds']:>7.1f}s  {result['id']}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk re-summarisation via /summarize/batch")
+    parser.add_argument("inputs", nargs="+", help="Log files, directories of logs, or .jsonl transcript files")
+    parser.add_argument("--output", default="batch_summaries.ndjson")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--model", default="llama3.1:8b")
+    parser.add_argument("--concurrency", type=int, help="Default: chosen by the server from its healthy backends")
+    parser.add_argument("--chunk-size", type=int, default=100)
+    args = parser.parse_args()
+
+    run_batch(load_transcripts(args.inputs), args.url.rstrip("/"), args.output, args.model,
+              args.concurrency, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Tests for /summarize/batch and the resumable batch CLI, without a running Ollama server.
+Summaries are replaced with a fake that records which transcripts were processed.
+"""
+
+import asyncio
+import json
+import sys
+import os
+import tempfile
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.summarization_agent import SummarizationAgent
+from summarize_batch import completed_ids, end_partial_line
+
+
+def test_batch_streams_ndjson_and_skips_done_ids():
+    """Each transcript gets one result line as it completes; skip_ids are not re-processed."""
+    processed = []
+
+    async def fake_summary(self, messages, rolling=None):
+        processed.append(messages[0]["content"])
+        await asyncio.sleep(0.01)
+        if messages[0]["content"] == "boom":
+            raise RuntimeError("model crashed")
+        return {"text": f"Summary of {messages[0]['content']}", "sbar": "", "differential": None,
+                "classification": None, "degraded": False}
+
+    original = SummarizationAgent.summarize_and_triage_structured
+    SummarizationAgent.summarize_and_triage_structured = fake_summary
+    try:
+        transcripts = [{"id": f"t{i}", "messages": [{"role": "user", "content": f"case {i}"}]} for i in range(5)]
+        transcripts.append({"id": "bad", "messages": [{"role": "user", "content": "boom"}]})
+        client = TestClient(app)
+        response = client.post("/summarize/batch", json={"transcripts": transcripts, "skip_ids": ["t0", "t1"],
+                                                         "concurrency": 3})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+    finally:
+        SummarizationAgent.summarize_and_triage_structured = original
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {line["id"]: line for line in lines if line["type"] == "result"}
+    assert set(results) == {"t2", "t3", "t4", "bad"}
+    assert results["t3"]["response"] == "Summary of case 3"
+    assert results["bad"]["status"] == "error" and "model crashed" in results["bad"]["detail"]
+    assert sorted(processed) == ["boom", "case 2", "case 3", "case 4"]
+    assert lines[-1] == {"type": "done", "processed": 4, "skipped": 2, "concurrency": 3,
+                         "ok": 3, "error": 1, "degraded": 0}
+
+
+def test_resume_only_skips_clean_results():
+    """Errors, degraded summaries and a truncated last line are retried on resume."""
+    with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as f:
+        f.write(json.dumps({"type": "result", "id": "a", "status": "ok", "degraded": False}) + "\n")
+        f.write(json.dumps({"type": "result", "id": "b", "status": "error"}) + "\n")
+        f.write(json.dumps({"type": "result", "id": "c", "status": "ok", "degraded": True}) + "\n")
+        f.write('{"type": "result", "id": "d", "sta')
+    try:
+        assert completed_ids(f.name) == {"a"}
+        # Results appended after resuming start on a fresh line instead of completing the cut one
+        end_partial_line(f.name)
+        end_partial_line(f.name)
+        with open(f.name, "a") as out:
+            out.write(json.dumps({"type": "result", "id": "d", "status": "ok", "degraded": False}) + "\n")
+        assert completed_ids(f.name) == {"a", "d"}
+        with open(f.name) as written:
+            assert written.read().count("\n") == 5
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    test_batch_streams_ndjson_and_skips_done_ids()
+    test_resume_only_skips_clean_results()
+    print("✅ All batch summarisation tests passed!")
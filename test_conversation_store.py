@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests for the structured conversation store, using an in-memory SQLite database.
+"""
+
+import sys
+import os
+import tempfile
+import zipfile
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.conversation_store import ConversationStore, expected_referral_type
+from app.conversation_index import QueryError
+from import_conversation_logs import import_logs
+
+PHYSIO_CASE = [
+    {"role": "assistant", "content": "Which side is affected - left or right?", "at": "2025-10-01T09:00:00"},
+    {"role": "user", "content": "My left knee, I'm 34. It aches after running, I've had it for 6 weeks.",
+     "at": "2025-10-01T09:00:12.5"},
+]
+
+
+def test_record_and_read_back_a_conversation():
+    """Messages, timings, analysis and summary round-trip; the expected triage is normalised."""
+    store = ConversationStore(":memory:")
+    conversation_id = store.record_conversation(
+        PHYSIO_CASE, case_id="case_7", title="Runner's knee", expected_triage="SWLEOC Orthopaedic Surgery",
+        summary="SBAR", classification={"referral_type": "physio"}, referral_letters={"physio": "Dear Team"})
+
+    record = store.get(conversation_id)
+    assert record["started_at"] == "2025-10-01T09:00:00"
+    assert [m["seconds"] for m in record["messages"]] == [None, 12.5]
+    assert record["extracted_data"]["laterality"] == "left"
+    assert record["guardrails"]["pathway"] == record["pathway"] and record["engine_output"]
+    assert record["expected_referral_type"] == "swleoc" and record["referral_type"] == "physio"
+    assert record["mismatch"] is True
+    assert record["referral_letters"] == {"physio": "Dear Team"}
+    assert expected_referral_type("MSK Physiotherapy") == "physio"
+    assert expected_referral_type("Something else") is None
+
+
+def test_queries_use_indexes():
+    """Case, date range, pathway and mismatch filters are answered from indexes, not table scans."""
+    store = ConversationStore(":memory:")
+    first = store.record_conversation(PHYSIO_CASE, case_id="case_7", expected_triage="MSK Physiotherapy",
+                                      classification={"referral_type": "physio"})
+    second = store.record_conversation(PHYSIO_CASE, case_id="case_8", expected_triage="SWLEOC Orthopaedic Surgery",
+                                       classification={"referral_type": "physio"}, started_at="2025-11-02T10:00:00")
+
+    assert [r["id"] for r in store.find(case_id="case_7")] == [first]
+    assert [r["id"] for r in store.find(mismatched=True)] == [second]
+    assert [r["id"] for r in store.find(since="2025-11-01", until="2025-12-01")] == [second]
+    pathway = store.get(first)["pathway"]
+    assert {r["id"] for r in store.find(pathway=pathway)} == {first, second}
+
+    for filters in [{"case_id": "case_7"}, {"since": "2025-11-01", "until": "2025-12-01"},
+                    {"pathway": pathway}, {"mismatched": True}]:
+        plan = store.query_plan(**filters)
+        assert "USING INDEX" in plan, (filters, plan)
+
+
+def patient_says(*turns):
+    return [message for turn in turns for message in
+            ({"role": "assistant", "content": "Tell me more."}, {"role": "user", "content": turn})]
+
+
+def test_full_text_search_reads_negation_like_the_guardrails():
+    """Phrases, prefixes and boolean operators; a negated phrase does not count unless asked for."""
+    store = ConversationStore(":memory:")
+    locked = store.record_conversation(patient_says("I was pivoting at netball.", "It gets stuck - true locking."),
+                                       summary="Mechanical block, refer to orthopaedics")
+    denied = store.record_conversation(patient_says("I twisted it skiing.", "No true locking, it just clicks."))
+    split = store.record_conversation(patient_says("It is true.", "Locking happens sometimes."))
+
+    assert {r["id"] for r in store.search('"true locking"')} == {locked}
+    assert {r["id"] for r in store.search('"true locking"', include_negated=True)} == {locked, denied}
+    assert {r["id"] for r in store.search("pivot* OR twist*")} == {locked, denied}
+    assert {r["id"] for r in store.search('locking AND NOT (pivot* OR "true locking")')} == {denied, split}
+    assert {r["id"] for r in store.search('summary:orthopaedics')} == {locked}
+    assert store.search('patient:orthopaedics') == []
+    for bad in ["(locking", "locking AND", "ward:locking"]:
+        try:
+            store.search(bad)
+        except QueryError:
+            continue
+        raise AssertionError(f"{bad!r} should not parse")
+
+
+LEGACY_LOG = """MSK TRIAGE BOT CONVERSATION LOG
+==================================================
+
+Case ID: case_3
+Title: Shoulder Dislocation
+Date: 2025-09-04 11:47:59
+
+PATIENT DEMOGRAPHICS:
+--------------------
+Age: 22
+Expected Triage: Urgent Care/A&E
+
+CONVERSATION:
+--------------------
+[11:47:26] PATIENT: My left shoulder popped out in a rugby tackle.
+
+It looks deformed.
+
+[11:47:27] BOT: When did this start?
+
+[11:47:30] PATIENT: 30 minutes ago.
+
+============================================================
+CLINICAL SUMMARY
+============================================================
+**Clinical Summary**
+---
+Suspected dislocation.
+
+REFERRAL LETTERS:
+============================================================
+
+REFERRAL LETTER - URGENT_ED:
+----------------------------------------
+Dear A&E team
+"""
+
+
+def test_import_logs_from_folder_and_zip():
+    """Logs are read straight from a zip, split into sections, and a log found twice is stored once."""
+    with tempfile.TemporaryDirectory() as folder:
+        with open(os.path.join(folder, "case_3.txt"), "w") as f:
+            f.write(LEGACY_LOG)
+        archive = os.path.join(folder, "logs.zip")
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("conversation_logs/case_3.txt", LEGACY_LOG)
+            z.writestr("conversation_logs/notes.txt", "Not a log")
+
+        store = ConversationStore(":memory:")
+        counts = import_logs([archive, folder], store, workers=1)
+        assert (counts["imported"], counts["duplicates"], counts["skipped"]) == (1, 1, 1)
+        assert import_logs([archive], store, workers=1)["imported"] == 0
+
+    record = store.get(store.find()[0]["id"])
+    assert record["case_id"] == "case_3" and record["started_at"] == "2025-09-04T11:47:26"
+    assert record["expected_referral_type"] == "urgent_ed"
+    assert record["metadata"]["path"].endswith("logs.zip!conversation_logs/case_3.txt")
+    assert record["metadata"]["demographics"] == {"age": "22"}
+    assert [(m["role"], m["seconds"]) for m in record["messages"]] == [("user", None), ("assistant", 1.0),
+                                                                        ("user", 3.0)]
+    assert record["messages"][0]["content"].endswith("tackle.\nIt looks deformed.")
+    assert record["summary"] == "**Clinical Summary**\n---\nSuspected dislocation."
+    assert record["referral_letters"] == {"urgent_ed": "Dear A&E team"}
+
+
+if __name__ == "__main__":
+    test_record_and_read_back_a_conversation()
+    test_queries_use_indexes()
+    test_full_text_search_reads_negation_like_the_guardrails()
+    test_import_logs_from_folder_and_zip()
+    print("✅ All conversation store tests passed!")
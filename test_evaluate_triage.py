@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline evaluation harness, on the bundled patient cases with the rule-based summary stage.
+"""
+
+import sys
+import os
+import copy
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from evaluate_triage import load_cases, evaluate, diff_runs
+
+
+def test_evaluation_report_and_diff():
+    """Every case lands in the confusion matrix with per-stage latencies; a routing change shows in the diff."""
+    items = load_cases(os.path.join(os.path.dirname(__file__), "patient_cases.json"), None)
+    report = evaluate(items, llm="fake", workers=1)
+
+    assert report["run"]["cases"] == len(items) == 11
+    assert sum(sum(row.values()) for row in report["confusion"]["pathway"].values()) == len(items)
+    # The rule-based summary's referral is the guardrail pathway, so it is not scored as a classifier
+    assert report["confusion"]["classification"] is None and report["accuracy"]["classification"] is None
+    assert set(report["latency"]) == {"interview", "extraction", "engine", "guardrails", "summary"}
+    assert all(stats["p50_ms"] <= stats["p95_ms"] <= stats["max_ms"] for stats in report["latency"].values())
+    assert 0 <= report["accuracy"]["guardrails"] <= 1
+
+    after = copy.deepcopy(report)
+    case = next(c for c in after["cases"] if c["referral_type"] == c["expected"] != "gp")
+    before_pathway = case["pathway"]
+    case["pathway"], case["referral_type"] = "gp_primary", "gp"
+    diff = diff_runs(report, after)
+    assert diff["changed"] == [{"id": case["id"], "stage": "pathway", "before": before_pathway,
+                                "after": "gp_primary", "expected": case["expected"], "effect": "broken"}]
+    assert diff["latency"]["extraction"]["p50_ms"] == 0
+
+
+if __name__ == "__main__":
+    test_evaluation_report_and_diff()
+    print("✅ All evaluation harness tests passed!")
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Tests for the Ollama backend pool, run against small fake Ollama servers on local ports.
+"""
+
+import asyncio
+import json
+import sys
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.llm_client import LLMPool, LLMUnavailableError, CircuitBreaker, CircuitOpenError
+from app.generation_profiles import load_profiles
+from app.llm_client import configure_llm_pool, get_llm_pool
+import app.llm_client as llm_client
+from app.llm_cassette import Cassette, CassetteMissError
+
+
+class FakeOllama:
+    """Minimal Ollama stand-in serving /api/ps and /api/generate on a free port."""
+    def __init__(self, name, loaded_models=(), delay=0.0, fail=False):
+        self.name = name
+        self.loaded_models = list(loaded_models)
+        self.delay = delay
+        self.fail = fail
+        self.generate_calls = 0
+        self.last_request = None
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if fake.fail:
+                    return self._send(500, "{}")
+                self._send(200, json.dumps({"models": [{"name": m} for m in fake.loaded_models]}))
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                fake.generate_calls += 1
+                fake.last_request = request
+                if not fake.fail and request["model"] not in fake.loaded_models:
+                    fake.loaded_models.append(request["model"])  # Ollama keeps the model resident
+                time.sleep(fake.delay)
+                if fake.fail:
+                    return self._send(500, "{}")
+                if request.get("stream"):
+                    lines = [json.dumps({"response": part, "done": False}) for part in ["from ", fake.name]]
+                    lines.append(json.dumps({"response": "", "done": True}))
+                    return self._send(200, "\n".join(lines) + "\n")
+                self._send(200, json.dumps({"response": f"from {fake.name}", "done": True}))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_model_affinity_prefers_warm_backend():
+    """Requests go to the backend that already has the model loaded."""
+    cold, warm = FakeOllama("cold"), FakeOllama("warm", loaded_models=["llama3.1:8b"])
+    try:
+        pool = LLMPool([cold.url, warm.url])
+        result = asyncio.run(asyncio.wait_for(pool.generate("llama3.1:8b", "hi"), 5))
+        assert result == "from warm"
+        assert cold.generate_calls == 0
+    finally:
+        cold.close()
+        warm.close()
+
+
+def test_busy_warm_backend_spills_over_to_cold_one():
+    """Affinity is only a cold-start cost: once the warm node is busy enough, the cold node loads the model."""
+    warm, cold = FakeOllama("warm", loaded_models=["llama3.1:8b"], delay=0.3), FakeOllama("cold", delay=0.3)
+    try:
+        pool = LLMPool([warm.url, cold.url], cold_start_penalty=2)
+
+        async def run():
+            return await asyncio.gather(*(pool.generate("llama3.1:8b", f"prompt {i}") for i in range(6)))
+
+        asyncio.run(asyncio.wait_for(run(), 5))
+        assert cold.generate_calls > 0 and warm.generate_calls >= cold.generate_calls
+        assert "llama3.1:8b" in pool.backends[1].loaded_models
+    finally:
+        warm.close()
+        cold.close()
+
+
+def test_least_outstanding_spreads_concurrent_requests():
+    """Concurrent requests are spread over backends instead of queueing on one."""
+    servers = [FakeOllama(f"node{i}", loaded_models=["llama3.1:8b"], delay=0.2) for i in range(3)]
+    try:
+        pool = LLMPool([s.url for s in servers])
+
+        async def run():
+            return await asyncio.gather(*(pool.generate("llama3.1:8b", f"prompt {i}") for i in range(6)))
+
+        results = asyncio.run(asyncio.wait_for(run(), 5))
+        assert len(results) == 6
+        assert [s.generate_calls for s in servers] == [2, 2, 2]
+    finally:
+        for s in servers:
+            s.close()
+
+
+def test_failed_backend_is_ejected_and_failed_over():
+    """A failing node is routed around and ejected; requests still succeed on the healthy node."""
+    bad, good = FakeOllama("bad", fail=True), FakeOllama("good")
+    try:
+        pool = LLMPool([bad.url, good.url], max_failures=1, health_interval=3600)
+        pool.last_health_check = time.monotonic()  # Only request failures can eject here
+
+        async def run():
+            first = await pool.generate("llama3.1:8b", "hi")
+            second = await pool.generate("llama3.1:8b", "hi")
+            return first, second
+
+        first, second = asyncio.run(asyncio.wait_for(run(), 5))
+        assert first == second == "from good"
+        stats = {s["url"]: s for s in pool.stats()}
+        assert not stats[bad.url]["healthy"]
+        # Tried once, ejected, then skipped
+        assert bad.generate_calls == 1
+    finally:
+        bad.close()
+        good.close()
+
+
+def test_streaming_and_all_backends_down():
+    """Streams are assembled from chunks; with no live backend the pool raises."""
+    node = FakeOllama("node")
+    try:
+        pool = LLMPool([node.url])
+
+        async def collect():
+            return "".join([chunk async for chunk in pool.generate_stream("llama3.1:8b", "hi")])
+
+        assert asyncio.run(asyncio.wait_for(collect(), 5)) == "from node"
+    finally:
+        node.close()
+
+    dead = LLMPool([node.url])
+    try:
+        asyncio.run(asyncio.wait_for(dead.generate("llama3.1:8b", "hi", timeout=1.0), 5))
+        assert False, "expected LLMUnavailableError"
+    except LLMUnavailableError:
+        pass
+
+
+def test_slow_first_token_is_hedged_to_another_backend():
+    """A request with no first token by the stage threshold is duplicated; the faster copy wins."""
+    slow = FakeOllama("slow", loaded_models=["llama3.1:8b"], delay=1.5)
+    fast = FakeOllama("fast")
+    try:
+        pool = LLMPool([slow.url, fast.url], hedging=True, hedge_initial_delay=0.1)
+
+        started = time.perf_counter()
+        result = asyncio.run(asyncio.wait_for(pool.generate("llama3.1:8b", "hi", stage="SBAR summary"), 5))
+        assert result == "from fast"
+        assert time.perf_counter() - started < 1.0
+        assert pool.hedge_stats["SBAR summary"] == {"requests": 1, "fired": 1, "won": 1}
+        # Requests without a stage are never hedged
+        assert asyncio.run(asyncio.wait_for(pool.generate("llama3.1:8b", "hi"), 5)) == "from slow"
+        assert fast.generate_calls == 1
+    finally:
+        slow.close()
+        fast.close()
+
+
+def test_hedging_learns_from_unhedged_requests_and_env_configures_it():
+    """Staged requests feed the hedge threshold even before hedging starts; OLLAMA_HEDGING turns it on."""
+    first = FakeOllama("first")
+    second = FakeOllama("second")
+    try:
+        pool = LLMPool([first.url, second.url], hedging=True, hedge_min_samples=2)
+        for _ in range(2):
+            assert pool.hedge_threshold("SBAR summary") is None
+            asyncio.run(asyncio.wait_for(pool.generate("llama3.1:8b", "hi", stage="SBAR summary"), 5))
+        assert len(pool.first_token_times["SBAR summary"]) == 2
+        assert pool.hedge_threshold("SBAR summary") is not None
+        assert pool.hedge_stats["SBAR summary"]["fired"] == 0
+
+        saved = {name: os.environ.get(name) for name in ("OLLAMA_BACKENDS", "OLLAMA_HEDGING", "OLLAMA_HEDGE_INITIAL_DELAY")}
+        os.environ.update(OLLAMA_BACKENDS=f"{first.url},{second.url}", OLLAMA_HEDGING="1",
+                          OLLAMA_HEDGE_INITIAL_DELAY="0.25")
+        try:
+            llm_client._pool = None
+            pool = get_llm_pool()
+            assert pool.hedging and pool.hedge_initial_delay == 0.25
+            assert pool.hedge_threshold("Referral letter") == 0.25
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            llm_client._pool = None
+    finally:
+        first.close()
+        second.close()
+
+
+def test_identical_inflight_requests_share_one_generation():
+    """Concurrent identical prompts, plain or streamed, reach the backend once."""
+    node = FakeOllama("node", delay=0.2)
+    try:
+        pool = LLMPool([node.url])
+
+        async def collect():
+            return "".join([chunk async for chunk in pool.generate_stream("llama3.1:8b", "stream me")])
+
+        async def run():
+            return await asyncio.gather(
+                pool.generate("llama3.1:8b", "same"), pool.generate("llama3.1:8b", "same"),
+                collect(), collect(),
+            )
+
+        results = asyncio.run(asyncio.wait_for(run(), 5))
+        assert results == ["from node", "from node", "from node", "from node"]
+        assert node.generate_calls == 2
+        assert pool.coalesced == {"generate": 1, "stream": 1}
+        # Once finished, the same prompt runs again
+        asyncio.run(asyncio.wait_for(pool.generate("llama3.1:8b", "same"), 5))
+        assert node.generate_calls == 3
+    finally:
+        node.close()
+
+
+def test_stage_profiles_reach_ollama():
+    """Each stage sends its own model, options and keep_alive; the fast preset only moves short stages."""
+    profiles = load_profiles("fast", {"SBAR summary": {"num_predict": 512}})
+    classification, sbar = profiles["triage classification"], profiles["SBAR summary"]
+    assert classification.model_for("llama3.1:8b") == "llama3.2:3b"
+    assert sbar.model_for("llama3.1:8b") == "llama3.1:8b"
+    assert sbar.options()["num_predict"] == 512 and sbar.options()["num_ctx"] == 4096
+
+    node = FakeOllama("node")
+    try:
+        pool = LLMPool([node.url])
+        asyncio.run(asyncio.wait_for(pool.generate(
+            classification.model_for("llama3.1:8b"), "classify", stage=classification.stage,
+            options=classification.options(), keep_alive=classification.keep_alive), 5))
+        assert node.last_request["model"] == "llama3.2:3b"
+        assert node.last_request["options"] == {"num_ctx": 4096, "num_predict": 160, "temperature": 0.0}
+        assert node.last_request["keep_alive"] == "30m"
+    finally:
+        node.close()
+
+
+def test_stages_on_one_model_share_num_ctx():
+    """Ollama reloads a model when num_ctx changes, so stages on one model only vary their output settings."""
+    profiles = load_profiles("default", {"triage classification": {"num_ctx": 8192}})
+    assert {profile.num_ctx for profile in profiles.values()} == {8192}
+
+    profiles = load_profiles("fast")
+    assert profiles["triage classification"].num_ctx == profiles["patient turn"].num_ctx
+    assert len({profile.options()["num_predict"] for profile in profiles.values()}) > 1
+
+    # The warm-up loads each model with the options its stages use
+    node = FakeOllama("node")
+    try:
+        pool = LLMPool([node.url])
+        asyncio.run(asyncio.wait_for(pool.warm_up(["llama3.1:8b"], options={"llama3.1:8b": {"num_ctx": 4096}}), 5))
+        assert node.last_request["options"] == {"num_ctx": 4096}
+    finally:
+        node.close()
+
+
+def test_circuit_breaker_opens_fails_fast_and_recovers():
+    """Repeated failures open the breaker; calls then fail without reaching Ollama until a trial succeeds."""
+    node = FakeOllama("node", fail=True)
+    try:
+        pool = LLMPool([node.url], breaker=CircuitBreaker(max_failures=2, open_seconds=0.3))
+
+        async def attempt():
+            try:
+                return await pool.generate("llama3.1:8b", "hi")
+            except LLMUnavailableError as e:
+                return e
+
+        assert isinstance(asyncio.run(attempt()), LLMUnavailableError)
+        assert isinstance(asyncio.run(attempt()), LLMUnavailableError)
+        assert pool.breaker.is_open()
+
+        started = time.perf_counter()
+        assert isinstance(asyncio.run(attempt()), CircuitOpenError)
+        assert time.perf_counter() - started < 0.1
+        assert node.generate_calls == 2
+
+        node.fail = False
+        time.sleep(0.35)
+        assert asyncio.run(attempt()) == "from node"
+        assert pool.breaker.stats()["state"] == "closed"
+    finally:
+        node.close()
+
+
+def test_circuit_breaker_opens_on_slow_calls():
+    """Calls that succeed but miss the latency SLO also open the breaker."""
+    breaker = CircuitBreaker(slo_seconds=1.0, min_calls=4)
+    for latency in [0.2, 1.5, 1.8]:
+        breaker.record_success(latency)
+    assert not breaker.is_open()
+    breaker.record_success(2.0)
+    assert breaker.is_open() and not breaker.allow()
+
+
+def test_readyz_waits_for_warm_up():
+    """/readyz is 503 until the startup warm-up has loaded the served models, then 200."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    node = FakeOllama("node")
+    previous = get_llm_pool()
+    try:
+        pool = configure_llm_pool([node.url])
+        assert pool.readiness(["llama3.1:8b"])["all_warm"] is False
+
+        with TestClient(app) as client:
+            assert client.get("/healthz").json()["status"] == "ok"
+            deadline = time.monotonic() + 5
+            while True:
+                pool.last_health_check = None  # Re-read /api/ps on every probe
+                response = client.get("/readyz")
+                if response.status_code == 200 or time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+
+        body = response.json()
+        assert response.status_code == 200, body
+        assert body["llm_warm"] and body["models"]["llama3.1:8b"] == [node.url]
+        assert body["queue_depth"] == 0
+        assert node.last_request["prompt"] == "" and node.last_request["keep_alive"] == "30m"
+        assert node.last_request["options"] == {"num_ctx": 4096}
+    finally:
+        configure_llm_pool([b.url for b in previous.backends])
+        node.close()
+
+
+def test_readyz_recovers_when_ollama_comes_up_late():
+    """Warm-up is retried in the background, so an Ollama that was down at startup still gets warmed."""
+    from fastapi.testclient import TestClient
+    import app.main as main
+
+    node = FakeOllama("node", fail=True)
+    previous = get_llm_pool()
+    retry = main.WARM_UP_RETRY_SECONDS
+    try:
+        main.WARM_UP_RETRY_SECONDS = 0.1
+        configure_llm_pool([node.url])
+        with TestClient(main.app) as client:
+            time.sleep(0.3)
+            assert client.get("/readyz").status_code == 503
+            attempts = main.startup_state["warm_up_attempts"]
+            assert attempts >= 1
+
+            node.fail = False
+            deadline = time.monotonic() + 5
+            while client.get("/readyz").status_code != 200 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert client.get("/readyz").status_code == 200
+            assert main.startup_state["warm_up_attempts"] > attempts
+
+            # Ollama dropping the model (keep_alive expired) makes it cold again, and it is reloaded
+            node.loaded_models.clear()
+            time.sleep(0.3)
+            assert "llama3.1:8b" in node.loaded_models
+    finally:
+        main.WARM_UP_RETRY_SECONDS = retry
+        configure_llm_pool([b.url for b in previous.backends])
+        node.close()
+
+
+def test_cassette_records_then_replays_without_ollama():
+    """A recorded run replays offline, for plain and streamed calls; unrecorded requests fail loudly."""
+    node = FakeOllama("node")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "run.jsonl.gz")
+        try:
+            recorder = LLMPool([node.url], cassette=Cassette(path, mode="record"))
+
+            async def record():
+                text = await recorder.generate("llama3.1:8b", "hi")
+                streamed = "".join([c async for c in recorder.generate_stream("llama3.1:8b", "stream me")])
+                return text, streamed
+
+            assert asyncio.run(asyncio.wait_for(record(), 5)) == ("from node", "from node")
+        finally:
+            node.close()
+
+        cassette = Cassette(path, latency="zero")
+        replayer = LLMPool([node.url], cassette=cassette)  # The server is gone
+
+        async def replay():
+            text = await replayer.generate("llama3.1:8b", "hi")
+            streamed = "".join([c async for c in replayer.generate_stream("llama3.1:8b", "stream me")])
+            return text, streamed
+
+        assert asyncio.run(asyncio.wait_for(replay(), 5)) == ("from node", "from node")
+        try:
+            asyncio.run(replayer.generate("llama3.1:8b", "never recorded"))
+            raise AssertionError("expected a cassette miss")
+        except CassetteMissError:
+            pass
+        assert cassette.stats()["hits"] == 2 and cassette.stats()["misses"] == 1
+
+
+if __name__ == "__main__":
+    test_model_affinity_prefers_warm_backend()
+    test_busy_warm_backend_spills_over_to_cold_one()
+    test_least_outstanding_spreads_concurrent_requests()
+    test_failed_backend_is_ejected_and_failed_over()
+    test_streaming_and_all_backends_down()
+    test_slow_first_token_is_hedged_to_another_backend()
+    test_hedging_learns_from_unhedged_requests_and_env_configures_it()
+    test_identical_inflight_requests_share_one_generation()
+    test_stage_profiles_reach_ollama()
+    test_stages_on_one_model_share_num_ctx()
+    test_circuit_breaker_opens_fails_fast_and_recovers()
+    test_circuit_breaker_opens_on_slow_calls()
+    test_readyz_waits_for_warm_up()
+    test_readyz_recovers_when_ollama_comes_up_late()
+    test_cassette_records_then_replays_without_ollama()
+    print("✅ All LLM client tests passed!")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the background log sink, with a writer slowed down to stand in for a slow disk.
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+import time
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.log_sink import LogSink
+
+
+def slow_disk(sink: LogSink, seconds: float):
+    write_batch = sink._write_batch
+
+    def slow_write_batch(batch, fsync):
+        time.sleep(seconds)
+        write_batch(batch, fsync)
+    sink._write_batch = slow_write_batch
+
+
+def test_writes_are_batched_off_the_event_loop():
+    """Queuing returns immediately however slow the disk is; records land in order, batched and fsynced."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "logs", "events.ndjson")
+        sink = LogSink(max_queue=100, batch_size=64, fsync_interval=0.05)
+        slow_disk(sink, 0.2)
+
+        async def run():
+            started = time.perf_counter()
+            for i in range(20):
+                await sink.write(path, f"{i}\n")
+            queued_in = time.perf_counter() - started
+            # The fsync interval passes while the writer is idle
+            await asyncio.sleep(0.5)
+            fsyncs_when_idle = sink.stats()["fsyncs"]
+            await sink.close()
+            return queued_in, fsyncs_when_idle
+
+        queued_in, fsyncs_when_idle = asyncio.run(run())
+        assert queued_in < 0.1
+        assert fsyncs_when_idle >= 1
+        with open(path) as f:
+            assert f.read() == "".join(f"{i}\n" for i in range(20))
+
+    stats = sink.stats()
+    assert stats["written"] == 20 and stats["queued"] == 0
+    assert stats["batches"] < 20 and stats["mean_batch"] > 1
+    assert stats["dropped"] == 0 and stats["errors"] == 0
+
+
+def test_full_queue_drops_or_blocks_and_is_counted():
+    """submit() drops when the queue is full and write() waits for room; both show in the stats."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "events.ndjson")
+        sink = LogSink(max_queue=2, batch_size=1, fsync_interval=60)
+        slow_disk(sink, 0.05)
+
+        async def run():
+            accepted = [sink.submit(path, f"{i}\n") for i in range(5)]
+            await sink.write(path, "last\n")
+            await sink.close()
+            return accepted
+
+        accepted = asyncio.run(run())
+        assert accepted == [True, True, False, False, False]
+        with open(path) as f:
+            assert f.read().splitlines() == ["0", "1", "last"]
+
+    stats = sink.stats()
+    assert stats["dropped"] == 3 and stats["blocked"] == 1
+    assert stats["high_water"] == 2 and stats["fsyncs"] == 1
+
+
+def test_failed_idle_fsync_keeps_the_writer_running():
+    """A log deleted before its idle fsync is counted as an error; the writer carries on with later lines."""
+    with tempfile.TemporaryDirectory() as folder:
+        rotated = os.path.join(folder, "rotated.ndjson")
+        path = os.path.join(folder, "events.ndjson")
+        sink = LogSink(max_queue=10, batch_size=10, fsync_interval=0.2)
+
+        async def run():
+            sink.last_fsync = time.monotonic()  # so the batch itself is not fsynced on a slow start
+            await sink.write(rotated, "old\n")
+            await sink.queue.join()
+            os.remove(rotated)
+            await asyncio.sleep(0.5)  # the idle fsync finds the file gone
+            alive = not sink.writer.done()
+            await sink.write(path, "new\n")
+            await sink.close()
+            return alive
+
+        assert asyncio.run(run())
+        with open(path) as f:
+            assert f.read() == "new\n"
+
+    stats = sink.stats()
+    assert stats["errors"] == 1 and stats["written"] == 2 and stats["dropped"] == 0
+
+
+if __name__ == "__main__":
+    test_writes_are_batched_off_the_event_loop()
+    test_full_queue_drops_or_blocks_and_is_counted()
+    test_failed_idle_fsync_keeps_the_writer_running()
+    print("✅ All log sink tests passed!")
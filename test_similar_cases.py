@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for similar-case retrieval, using an in-memory conversation store.
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+import threading
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from app.conversation_store import configure_conversation_store
+from app.similar_cases import SimilarCaseIndex, find_similar_cases, configure_similar_case_index
+from app.summarization_agent import SummarizationAgent
+
+CASES = {
+    "instability": "My knee gives way when I pivot at football and it locks. I had an ACL tear on the scan.",
+    "kneecap": "My kneecap pops out when I twist and it gives way on the stairs.",
+    "back": "My lower back aches after long shifts driving the taxi, no leg pain and no numbness.",
+    "shoulder": "My shoulder hurts when I reach overhead, I can't sleep on that side.",
+}
+
+
+def test_index_ranks_and_persists_incrementally():
+    """The nearest case ranks first; appended rows survive reopening the memory-mapped files."""
+    with tempfile.TemporaryDirectory() as folder:
+        index = SimilarCaseIndex(os.path.join(folder, "index"))
+        assert index.add(list(CASES.items())[:2]) == 2
+        assert index.add(list(CASES.items())) == 2  # only the new ones
+
+        query = ["Twisted my knee playing football, now it gives way and locks"]
+        first = index.query(query, k=2)[0]
+        assert [case for case, _ in first] == ["instability", "kneecap"]
+        assert 0 < first[1][1] < first[0][1] <= 1
+
+        reopened = SimilarCaseIndex(os.path.join(folder, "index"))
+        in_memory = SimilarCaseIndex()
+        in_memory.add(CASES.items())
+        assert len(reopened) == 4
+        assert reopened.query(query, k=4) == index.query(query, k=4)
+        assert in_memory.query(query, k=4) == reopened.query(query, k=4)
+
+        # One batched call answers every query
+        batch = reopened.query(["shoulder pain reaching overhead", "taxi driving back ache"], k=1)
+        assert [results[0][0] for results in batch] == ["shoulder", "back"]
+
+
+def test_similar_cases_report_pathways_and_feed_classification_examples():
+    """Results carry where each case went; with SIMILAR_CASE_EXAMPLES the classifier prompt lists them."""
+    store = configure_conversation_store(":memory:")
+    ids = {name: store.record_conversation([{"role": "user", "content": text}], case_id=name,
+                                           expected_triage="SWLEOC Orthopaedic Surgery" if name == "instability" else None)
+           for name, text in CASES.items()}
+    index = configure_similar_case_index()
+    messages = [{"role": "user", "content": "My knee gives way when I pivot, the scan showed an ACL tear"}]
+
+    cases = find_similar_cases(messages, k=2)
+    assert cases[0]["conversation_id"] == ids["instability"] and len(index) == 4
+    assert cases[0]["expected_referral_type"] == "swleoc" and cases[0]["pathway"]
+    assert cases[0]["presenting_complaint"] == CASES["instability"]
+    excluded = find_similar_cases(messages, exclude_id=ids["instability"])
+    assert ids["instability"] not in [case["conversation_id"] for case in excluded]
+
+    agent = SummarizationAgent()
+    agent.similar_case_examples = 1
+    prompts = []
+
+    async def capture(prompt, schema, label, attempts=2):
+        prompts.append(prompt)
+    agent._generate_structured = capture
+    asyncio.run(agent.generate_structured_classification("Knee gives way after a pivot; ACL tear on MRI"))
+    assert "SIMILAR PAST CASES" in prompts[0]
+    assert f'{CASES["instability"]} -> "swleoc"' in prompts[0]
+    assert prompts[0].index("SIMILAR PAST CASES") < prompts[0].index("**CLINICAL SUMMARY:**")
+
+
+def test_concurrent_syncs_index_each_conversation_once():
+    """Lookups racing in worker threads add each conversation once; later syncs read only new rows."""
+    store = configure_conversation_store(":memory:")
+    for name, text in CASES.items():
+        store.record_conversation([{"role": "user", "content": text}], case_id=name)
+    with tempfile.TemporaryDirectory() as folder:
+        index = SimilarCaseIndex(os.path.join(folder, "index"))
+        threads = [threading.Thread(target=index.sync, args=(store,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(index) == len(set(index.ids)) == 4
+        assert index.df.max() <= 4
+        assert len(SimilarCaseIndex(os.path.join(folder, "index"))) == 4
+
+        seen = []
+        recorded_after = store.recorded_after
+        store.recorded_after = lambda rowid=0: seen.append(rowid) or recorded_after(rowid)
+        store.record_conversation([{"role": "user", "content": "My wrist clicks when I type"}], case_id="wrist")
+        assert index.sync(store) == 1 and index.sync(store) == 0
+        assert seen[0] == 4 and seen[1] == 5
+
+
+if __name__ == "__main__":
+    test_index_ranks_and_persists_incrementally()
+    test_similar_cases_report_pathways_and_feed_classification_examples()
+    test_concurrent_syncs_index_each_conversation_once()
+    print("✅ All similar case tests passed!")
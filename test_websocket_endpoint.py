@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the /ws/triage conversation endpoint that do not need a running Ollama server.
+Summary generation is replaced with a fake that streams fixed tokens.
+"""
+
+import sys
+import os
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+
+from fastapi.testclient import TestClient
+
+from app.main import app, triage_sessions, SessionCache
+from app.summarization_agent import SummarizationAgent
+
+
+async def fake_generate_stream(self, prompt, fallback, label):
+    for token in ["Generated ", label]:
+        yield token
+
+
+async def fake_generate(self, prompt, fallback, label):
+    return f"Generated {label}"
+
+
+async def no_structured_output(self, prompt, schema, label, attempts=2):
+    return None
+
+
+def test_websocket_conversation_streams_summary():
+    """Questions come back one per patient message and the summary is streamed at the end."""
+    original = SummarizationAgent._generate_stream, SummarizationAgent._generate, SummarizationAgent._generate_structured
+    SummarizationAgent._generate_stream = fake_generate_stream
+    SummarizationAgent._generate = fake_generate
+    # No valid JSON, so the free-text stages are streamed instead
+    SummarizationAgent._generate_structured = no_structured_output
+    try:
+        client = TestClient(app)
+        with client.websocket_connect("/ws/triage?conversation_id=ws-test") as ws:
+            greeting = ws.receive_json()
+            assert greeting["state"] == "GREETING"
+            assert "ws-test" in triage_sessions
+
+            ws.send_json({"type": "message", "content": "I'm 34 years old, female. My left knee keeps giving way "
+                                                        "since I twisted it pivoting at netball, and the MRI "
+                                                        "showed an ACL rupture."})
+            assert ws.receive_json()["state"] == "GATHER_RED_FLAGS"
+
+            ws.send_json({"type": "message", "content": "No, none of those"})
+            assert ws.receive_json()["state"] == "COMPLETE"
+
+            tokens = []
+            while True:
+                event = ws.receive_json()
+                if event["type"] == "summary_done":
+                    break
+                assert event["type"] == "summary_token"
+                tokens.append(event["content"])
+
+        assert len(tokens) > 3
+        assert event["content"] == "".join(tokens)
+        assert "Generated triage classification" in event["content"]
+        assert event["classification"] is None
+        assert "ws-test" not in triage_sessions
+    finally:
+        (SummarizationAgent._generate_stream, SummarizationAgent._generate,
+         SummarizationAgent._generate_structured) = original
+
+
+def test_websocket_resumes_session():
+    """Reconnecting with the same conversation_id repeats the last question instead of starting over."""
+    client = TestClient(app)
+    with client.websocket_connect("/ws/triage?conversation_id=ws-resume") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "message", "content": "My left knee hurts"})
+        question = ws.receive_json()
+
+    with client.websocket_connect("/ws/triage?conversation_id=ws-resume") as ws:
+        assert ws.receive_json()["content"] == question["content"]
+    triage_sessions.pop("ws-resume", None)
+
+
+def test_session_cache_evicts_idle_and_least_recent():
+    """Sessions left behind by abandoned conversations do not accumulate."""
+    sessions = SessionCache(ttl_seconds=60, max_entries=2)
+    sessions["a"], sessions["b"] = "A", "B"
+    assert sessions.get("a") == "A"  # now the most recently used
+    sessions["c"] = "C"
+    assert "b" not in sessions and len(sessions) == 2
+    assert sessions.setdefault("a", "other") == "A"
+
+    sessions.ttl_seconds = -1  # everything is now idle too long
+    assert sessions.get("a") is None and len(sessions) == 0
+
+
+if __name__ == "__main__":
+    test_websocket_conversation_streams_summary()
+    test_websocket_resumes_session()
+    test_session_cache_evicts_idle_and_least_recent()
+    print("✅ All WebSocket endpoint tests passed!")